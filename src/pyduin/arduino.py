@@ -7,18 +7,61 @@
     Arduino module
 """
 import os
-from collections import OrderedDict
+import random
+import threading
+import time
+from collections import OrderedDict, deque
 import logging
 import serial
 
 from pyduin import _utils as utils
-from pyduin import BoardFile, DeviceConfigError, SocatProxy
-from pyduin.pin import ArduinoPin
+from pyduin import AttrDict, BoardFile, DeviceConfigError, SocatProxy
+from pyduin.utils import ReplyTimeoutError, UnsupportedOperationError
+from pyduin.bus import I2CBus, SPIBus
+from pyduin.clock import ClockSync
+from pyduin.coalesce import CoalescingWriter, COALESCE_RATE
+from pyduin.firmware import FEATURES
+from pyduin.metrics import Metrics
+from pyduin.pin import ArduinoPin, PinGroup
+from pyduin.recording import RecordingConnection, ReplayConnection
+from pyduin.timings import Timings, phase
+from pyduin.transport import LineReader
 
 IMMEDIATE_RESPONSE = True
 
+# Baudrates the firmware can switch to. The index into this tuple is
+# sent to the device, so the order must match `baudrates[]` in pyduin.cpp.
+BAUDRATES = (9600, 19200, 38400, 57600, 115200, 230400, 250000, 500000, 1000000, 2000000)
+# Time the firmware waits for the confirmation of a new baudrate before
+# it falls back to the last confirmed one.
+BAUDRATE_PROBATION = 2
+# Time to wait for the device to confirm a baudrate negotiated before
+BAUDRATE_PROBE_TIMEOUT = 0.5
+# Serial receive buffer of the device (bytes), if neither the firmware
+# nor the boardfile tell.
+RX_BUFFER = 64
+# Reconnect attempts and the initial delay between them (doubled per
+# attempt, up to RECONNECT_BACKOFF_MAX seconds)
+RECONNECT_ATTEMPTS = 8
+RECONNECT_BACKOFF = 0.05
+RECONNECT_BACKOFF_MAX = 1
+# Time to wait for the boot banner after the port was reopened
+BOOT_TIMEOUT = 2
+# Time a device that was not reset on reconnect has to answer
+BOOT_PROBE_TIMEOUT = 0.2
+BOOT_BANNER = 'Boot complete'
+# Time the line must stay quiet, before replies given up on are taken as lost
+DRAIN_QUIET = 0.5
+# Samples (rows * pins) of one analog capture, if the firmware does not tell
+CAPTURE_SAMPLES = 256
+# ADC prescalers of a capture (AVR), 0 = keep the current one
+ADC_PRESCALERS = (0, 2, 4, 8, 16, 32, 64, 128)
+# Macro slots and bytes per macro, if the firmware does not tell
+MACRO_SLOTS = 4
+MACRO_SIZE = 64
 
-class Arduino:  # pylint: disable=too-many-instance-attributes
+
+class Arduino:  # pylint: disable=too-many-instance-attributes,too-many-public-methods
     """
         Arduino object that can send messages to any arduino
     """
@@ -30,7 +73,10 @@ class Arduino:  # pylint: disable=too-many-instance-attributes
 
     # pylint: disable=too-many-arguments
     def __init__(self,  board=False, tty=False, baudrate=False, boardfile=False,
-                 serial_timeout=3, wait=False, socat=False, log_level=logging.INFO):
+                 serial_timeout=3, wait=False, socat=False, log_level=logging.INFO,
+                 metrics=False, flow_window=False, auto_reconnect=False, timings=False):
+        # True records into a new Timings object, pass one to share it (e.g. with the CLI)
+        self.timings = Timings() if timings is True else timings or None
         self.board = board
         self.tty = tty
         self.baudrate = baudrate
@@ -40,16 +86,38 @@ class Arduino:  # pylint: disable=too-many-instance-attributes
         self.wait = wait
         self.serial_timeout = serial_timeout
         self.Pins = OrderedDict()
+        self.Busses = {}
         self.socat = socat
         self.logger = utils.logger()
         self.logger.setLevel(utils.loglevel_int(log_level))
-        self.boardfile = BoardFile(self._boardfile)
+        with phase(self.timings, 'boardfile'):
+            self.boardfile = BoardFile.get(self._boardfile)
+        self.metrics = Metrics() if metrics else None
+        self.lock = threading.RLock()
+        self._flow_window = flow_window
+        self.auto_reconnect = auto_reconnect
+        self._restoring = False
+        self._reader = None
+        # name -> (slot, define message) of the macros on the device
+        self.macros = {}
+        self._writer = None
+        # Device clock, see sync_clock()
+        self.clock = ClockSync()
+        # Number of replies given up on (per-call timeout), that may still arrive,
+        # and the time.monotonic() the line was last heard of
+        self._abandoned = 0
+        self._abandoned_at = 0
+        # Capabilities reported by the firmware. None = not fetched,
+        # False = the firmware does not support describe.
+        self._capabilities = None
 
         if not os.path.isfile(self._boardfile):
             raise DeviceConfigError(f'Cannot open boardfile: {self._boardfile}')
 
         if not self.baudrate:
             self.baudrate = self.boardfile.baudrate
+        # The baudrate the device starts with after a reset
+        self.boot_baudrate = self.baudrate
 
         if self.socat:
             self.socat = SocatProxy(self.tty, self.baudrate, log_level=log_level)
@@ -65,15 +133,134 @@ class Arduino:  # pylint: disable=too-many-instance-attributes
         try:
             tty = self.socat.proxy_tty if self.socat else self.tty
             if self.socat:
-                self.socat.start()
-            self.Connection = serial.Serial(tty, self.baudrate, timeout=self.serial_timeout)  # pylint: disable=invalid-name
-            self.setup_pins()
+                with phase(self.timings, 'socat'):
+                    self.socat.start()
+            if self.Connection and self.metrics is not None:
+                self.metrics.count('reconnects')
+            with phase(self.timings, 'serial_open'):
+                self.Connection = serial.Serial(tty, self.baudrate, timeout=self.serial_timeout)  # pylint: disable=invalid-name
+            with phase(self.timings, 'setup_pins'):
+                self.setup_pins()
+            # The firmware may have changed (e.g. flashed), describe it again when asked.
+            self._capabilities = None
             self.ready = True
         except serial.SerialException as error:
             self.ready = False
             errmsg = f'Could not open Serial connection on {self.tty}'
             raise DeviceConfigError(errmsg) from error
 
+    def reconnect(self):
+        """
+            Reopen the serial connection, retrying with backoff, and restore
+            the pin modes and outputs. Pin objects are kept.
+        """
+        with self.lock:
+            recording = self.Connection.path \
+                if isinstance(self.Connection, RecordingConnection) else None
+            try:
+                self.Connection.close()
+            except (serial.SerialException, OSError):
+                pass
+            tty = self.socat.proxy_tty if self.socat else self.tty
+            delay = RECONNECT_BACKOFF
+            for attempt in range(RECONNECT_ATTEMPTS):
+                try:
+                    connection = serial.Serial(tty, self.baudrate,
+                                               timeout=self.serial_timeout)
+                    break
+                except serial.SerialException:
+                    self.logger.debug('Reconnect to %s failed (attempt %s)', tty, attempt + 1)
+                    time.sleep(delay)
+                    delay = min(delay * 2, RECONNECT_BACKOFF_MAX)
+            else:
+                self.ready = False
+                raise DeviceConfigError(f'Could not reconnect to {self.tty}')
+            self.logger.info('Reconnected to %s', tty)
+            if self.metrics is not None:
+                self.metrics.count('reconnects')
+            self.Connection = connection
+            self._abandoned = 0
+            if recording:
+                self.record(recording, append=True)
+            # Opening the port resets most boards. A device that answers right
+            # away was not reset (hang_up_on_close: no) and kept its baudrate.
+            reply = self._probe(BOOT_PROBE_TIMEOUT)
+            if '%version%' not in reply:
+                baudrate = self.baudrate
+                self.Connection.baudrate = self.baudrate = self.boot_baudrate
+                if reply != BOOT_BANNER:
+                    # The banner may have been sent at the boot baudrate
+                    # already. Ask again, the reply or the banner is enough.
+                    self._reset_input()
+                    self._probe(BOOT_TIMEOUT)
+                self._reset_input()
+                if baudrate != self.boot_baudrate:
+                    self.set_baudrate(baudrate)
+            return self.restore_state()
+
+    def _probe(self, timeout):
+        """
+            Request the version and return the first line the device sends
+            within <timeout> (the reply, the boot banner or '').
+        """
+        self._write(b'<zv00000>')
+        return self.reader.readline(timeout).decode('utf-8', errors='replace').strip()
+
+    def restore_state(self):
+        """
+            Send the last known pin modes and outputs to the device in one
+            batch, e.g. after it was reset.
+        """
+        messages = [pin.Mode.message for pin in self.Pins.values() if pin.Mode.message] + \
+            [pin.output for pin in self.Pins.values() if pin.output] + \
+            [message for _slot, message in self.macros.values()]
+        if not messages:
+            return []
+        self._restoring = True
+        try:
+            return self.send_batch(messages)
+        finally:
+            self._restoring = False
+
+    def _on_boot(self):
+        """ The device sent its boot banner, so it has been reset """
+        if self.auto_reconnect and not self._restoring:
+            self.logger.info('Device on %s was reset, restoring pin state', self.tty)
+            self.restore_state()
+
+    def use_connection(self, connection):
+        """
+            Use an already opened connection object (anything that provides
+            write() and readline() like serial.Serial) and setup pins.
+        """
+        self.Connection = connection
+        self.setup_pins()
+        self.ready = True
+
+    def replay(self, path, realtime=False, strict=False):
+        """
+            Feed a recorded session back to this object. With realtime=True
+            the recorded reply latencies are reproduced, otherwise the session
+            is replayed as fast as possible.
+        """
+        self.use_connection(ReplayConnection(path, realtime=realtime, strict=strict))
+        return self.Connection
+
+    def record(self, path, append=False):
+        """
+            Record every frame sent and received to <path>. An existing
+            recording is replaced, unless <append> continues it.
+        """
+        if isinstance(self.Connection, RecordingConnection):
+            self.stop_recording()
+        self.Connection = RecordingConnection(self.Connection, path, append)
+        return self.Connection
+
+    def stop_recording(self):
+        """ Stop a recording started with record() """
+        if isinstance(self.Connection, RecordingConnection):
+            self.Connection = self.Connection.stop()
+
     def setup_pins(self):
         """
             Setup pins according to boardfile.
@@ -86,6 +273,185 @@ class Arduino:  # pylint: disable=too-many-instance-attributes
         pin = self.boardfile.normalize_pin_id(pin)
         return self.Pins[pin]
 
+    def group(self, pins):
+        """ Return a PinGroup of <pins> (pin ids or aliases) """
+        return PinGroup(self, pins)
+
+    def i2c(self, num=0):
+        """ Return the I2C bus <num> of the device """
+        key = ('i2c', num)
+        if key not in self.Busses:
+            self.Busses[key] = I2CBus(self, num)
+        return self.Busses[key]
+
+    def spi(self, num=0, **kwargs):
+        """
+            Return the SPI bus <num> of the device. With keyword arguments
+            (clock, mode, cs), the bus is configured anew.
+        """
+        key = ('spi', num)
+        if kwargs or key not in self.Busses:
+            self.Busses[key] = SPIBus(self, num, **kwargs)
+        return self.Busses[key]
+
+    def capture(self, pins, n, rate=None, prescaler=0, timestamps=False):
+        """
+            Sample the analog <pins> <n> times at <rate> (Hz, None: as fast as
+            possible) into the buffer of the device and return the samples as
+            NumPy array of shape (n, len(pins)). <prescaler> sets the ADC clock
+            of AVR boards for the burst. With <timestamps>, (times, samples)
+            is returned, times are the device times (micros()) of the rows in
+            seconds. device_time(times * 1e6) maps them to time.monotonic().
+        """
+        # pylint: disable=too-many-arguments,too-many-locals
+        if not self.wait:
+            raise DeviceConfigError('Captures require wait=True')
+        self.require('CB')
+        import numpy  # pylint: disable=import-outside-toplevel
+        pins = [self.boardfile.normalize_pin_id(pin) for pin in pins]
+        analog_pins = self.capabilities['analog_pins'] if self.capabilities \
+            else self.boardfile.analog_pins
+        for pin in pins:
+            if pin not in analog_pins:
+                raise ValueError(f'Pin {pin} is not an analog pin')
+        capacity = (self.capabilities.get('capture_samples') if self.capabilities else None) \
+            or CAPTURE_SAMPLES
+        if not pins or not 0 < n * len(pins) <= capacity:
+            raise ValueError(f'Captures are limited to {capacity} samples (n * pins)')
+        if prescaler not in ADC_PRESCALERS:
+            raise ValueError(f'Invalid ADC prescaler: {prescaler}')
+        interval = round(1e6 / rate) if rate else 0
+        size = n * len(pins) * 2
+        # The burst itself, then about 10 bits per byte on the wire
+        timeout = self.serial_timeout + n * interval / 1e6 + size * 10 / self.baudrate
+        with self.lock:
+            deadline = time.monotonic() + timeout
+            reply = self._send(f'<CB00000:{interval},{prescaler},{n},'
+                               f'{",".join(map(str, pins))}>', timeout)
+            header = reply.split('%')[-1].split(',')
+            if len(header) != 4:
+                raise DeviceConfigError(f'Capture failed: {reply}')
+            data = self.reader.read(size, max(deadline - time.monotonic(), 0))
+            if self.metrics is not None:
+                self.metrics.count('bytes_in', len(data))
+            if len(data) < size:
+                # The rest of the samples and the line break
+                self._abandon(1)
+                raise ReplyTimeoutError(f'Capture from {self.tty} incomplete: '
+                                        f'{len(data)} of {size} bytes')
+            # line break after the samples
+            self._readline(deadline)
+        samples = numpy.frombuffer(data, dtype='<u2').reshape(n, len(pins))
+        if not timestamps:
+            return samples
+        first, last = int(header[2]), int(header[3])
+        times = numpy.linspace(first, first + ((last - first) & 0xffffffff), n) / 1e6
+        return times, samples
+
+    def define_macro(self, name, ops):
+        """
+            Store the frames <ops> (str or bytes, e.g. ArduinoPin.frame('high'))
+            on the device as macro <name>. run_macro() runs them with one frame.
+            Macros are kept in the RAM of the device and defined again by
+            restore_state(). Pin modes and outputs set by macros are not tracked.
+        """
+        self.require('KD')
+        frames = []
+        for op in ops:
+            frame = (op.decode('utf-8') if isinstance(op, bytes) else op).strip('<>')
+            # Captures reply binary, describe replies contain ';'
+            if len(frame) < 7 or frame[0] in 'KC' or frame[:2] == 'zd' or ';' in frame:
+                raise ValueError(f'{op!r} cannot be used in a macro')
+            frames.append(frame)
+        body = ';'.join(frames)
+        slots = (self.capabilities.get('macro_slots') if self.capabilities else None) \
+            or MACRO_SLOTS
+        size = (self.capabilities.get('macro_size') if self.capabilities else None) \
+            or MACRO_SIZE
+        if not frames or len(body) > size:
+            raise ValueError(f'Macros are limited to {size} bytes, {name} has {len(body)}')
+        # A macro defined again keeps its slot
+        used = {slot for slot, _message in self.macros.values()}
+        free = [self.macros[name][0]] if name in self.macros else \
+            [slot for slot in range(slots) if slot not in used]
+        if not free:
+            raise ValueError(f'All {slots} macro slots are in use')
+        message = f'<KD{free[0]:02d}000:{body}>'
+        reply = self.send(message)
+        if not isinstance(reply, str) or reply.split('%')[-1] != str(len(frames)):
+            raise DeviceConfigError(f'Could not define macro {name}: {reply}')
+        self.macros[name] = (free[0], message)
+
+    def run_macro(self, name, timeout=None):
+        """ Run the macro <name> and return the replies of its frames """
+        self.require('KR')
+        try:
+            slot, message = self.macros[name]
+        except KeyError as exc:
+            raise ValueError(f'Unknown macro: {name}') from exc
+        # One reply line: id%macro%<number of frames>%<replies separated by ';'>
+        reply = self.send(f'<KR{slot:02d}000>', timeout)
+        fields = reply.split('%', 3) if isinstance(reply, str) else []
+        if len(fields) < 4 or fields[1] != 'macro' or \
+                fields[2] != str(message.count(';') + 1):
+            raise DeviceConfigError(f'Macro {name} failed: {reply}')
+        return fields[3].split(';')
+
+    def delete_macro(self, name):
+        """ Delete the macro <name> and free its slot on the device """
+        self.require('KD')
+        try:
+            slot, _message = self.macros.pop(name)
+        except KeyError as exc:
+            raise ValueError(f'Unknown macro: {name}') from exc
+        self.send(f'<KD{slot:02d}000>')
+
+    def sync_clock(self, exchanges=8, interval=0.02):
+        """
+            Query the device time (micros()) <exchanges> times, <interval>
+            seconds apart, and fit offset and drift of the device clock against
+            time.monotonic(). More exchanges are added with every call, so
+            syncing again now and then tracks the drift. The drift is fitted,
+            once the exchanges span clock.MIN_BASELINE seconds. Return the
+            ClockSync.
+        """
+        if exchanges < 1:
+            raise ValueError('At least one exchange is needed to sync the clock')
+        self.require('zt')
+        for exchange in range(exchanges):
+            if exchange:
+                time.sleep(interval)
+            with self.lock:
+                before = time.monotonic()
+                reply = self.send('<zt00000>')
+                after = time.monotonic()
+            try:
+                self.clock.add(int(reply.split('%')[-1]), before, after)
+            except ValueError as exc:
+                raise DeviceConfigError(f'Invalid device time: {reply!r}') from exc
+        return self.clock.fit()
+
+    def device_time(self, device_us):
+        """
+            Return the time.monotonic() of the device time <device_us> (micros(),
+            also as NumPy array). The clock is synced on first use.
+        """
+        if not self.clock.synced:
+            self.sync_clock()
+        return self.clock.to_host(device_us)
+
+    def coalescing_writer(self, rate=COALESCE_RATE):
+        """
+            Return the CoalescingWriter of the device, which sends only the
+            latest of quickly changing outputs, at most <rate> times per second.
+            It is started on first use and stopped with the connection.
+        """
+        if self._writer is None:
+            self._writer = CoalescingWriter(self, rate)
+            self._writer.start()
+        self._writer.rate = rate
+        return self._writer
+
     def get_led(self, led:int):
         """ Return the pin id of an led """
         return self.boardfile.led_to_pin(led)
@@ -94,28 +460,289 @@ class Arduino:  # pylint: disable=too-many-instance-attributes
         """
             Close the serial connection to the arduino.
         """
-        self.Connection.close()
+        writer, self._writer = self._writer, None
+        try:
+            if writer is not None:
+                writer.stop()
+        finally:
+            self.Connection.close()
+
+    def _write(self, data):
+        """ Write raw bytes to the connection """
+        self.Connection.write(data)
+        if self.metrics is not None:
+            self.metrics.count('bytes_out', len(data))
+
+    @property
+    def reader(self):
+        """ Return the LineReader of the current connection """
+        if self._reader is None or self._reader.connection is not self.Connection:
+            self._reader = LineReader(self.Connection)
+        return self._reader
+
+    def _reset_input(self):
+        """ Discard received, but unread data """
+        self.reader.reset()
+        self._abandoned = 0
+
+    def _abandon(self, count):
+        """ Give up on the replies of <count> frames, see _drain() """
+        self._abandoned = count
+        self._abandoned_at = time.monotonic()
+
+    def _drain(self, deadline=None):
+        """
+            Wait for the replies given up on and discard them, so they are not
+            taken as replies to the next command. Replies that do not arrive
+            until the line was quiet for DRAIN_QUIET seconds are taken as lost.
+            The quiet time counts across calls. If the <deadline> of the
+            current call passes first, ReplyTimeoutError is raised and nothing
+            is sent, so a device that stopped answering does not stall every
+            call for DRAIN_QUIET.
+        """
+        while self._abandoned:
+            now = time.monotonic()
+            quiet_end = self._abandoned_at + DRAIN_QUIET
+            if now >= quiet_end:
+                break
+            if deadline is not None and now >= deadline:
+                raise ReplyTimeoutError(f'{self.tty} did not send the replies given up on yet')
+            wait = quiet_end - now if deadline is None else min(quiet_end, deadline) - now
+            line = self.reader.readline(wait)
+            if line:
+                self._abandoned_at = time.monotonic()
+            if line.endswith(b'\n'):
+                self._abandoned -= 1
+        self._reset_input()
+
+    def _readline(self, deadline=None):
+        """
+            Read and decode one reply line from the connection. With a
+            <deadline> (time.monotonic()), ReplyTimeoutError is raised,
+            when no complete line arrived in time.
+        """
+        timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+        line = self.reader.readline(timeout)
+        if self.metrics is not None:
+            self.metrics.received(line)
+        if deadline is not None and not line.endswith(b'\n'):
+            self._abandon(1)
+            raise ReplyTimeoutError(f'No reply from {self.tty} in time')
+        return line.decode('utf-8', errors='replace').strip()
 
-    def send(self, message):
+    def send(self, message, timeout=None):
         """
-            Send a serial message to the arduino.
+            Send a serial message to the arduino. <message> is a str or
+            an already encoded frame (bytes). With <timeout> (seconds),
+            ReplyTimeoutError is raised, if the reply takes longer.
+            With auto_reconnect, a lost connection is reopened and the
+            message is sent again.
         """
-        # print(message)
-        self.Connection.write(message.encode('utf-8'))
+        with self.lock:
+            try:
+                return self._send(message, timeout)
+            except (serial.SerialException, OSError):
+                if not self.auto_reconnect:
+                    raise
+                self.reconnect()
+                return self._send(message, timeout)
+
+    def _send(self, message, timeout=None):
+        """ Send a message and read the reply """
+        frame = message if isinstance(message, bytes) else message.encode('utf-8')
+        if self.metrics is not None:
+            start = time.perf_counter()
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        if self._abandoned:
+            self._drain(deadline)
+        self._write(frame)
         if self.wait:
-            msg = self.Connection.readline().decode('utf-8').strip()
-            if msg == "Boot complete":
+            msg = self._readline(deadline)
+            if msg == BOOT_BANNER:
                 # It seems, we need to re-send, if the first thing we see
                 # is the boot-complete. Before, the Serial does not seem
                 # to be up reliably.
-                self.Connection.write(message.encode('utf-8'))
-                msg = self.Connection.readline().decode('utf-8').strip()
+                self._on_boot()
+                self._write(frame)
+                msg = self._readline(deadline)
+            if self.metrics is not None:
+                self.metrics.observe(message, time.perf_counter() - start)
             return msg
         return True
 
+    @property
+    def flow_window(self):
+        """
+            Return the number of bytes that may be sent to the device without
+            being answered yet. This is the serial receive buffer of the device,
+            as given on init, reported by the firmware or set in the boardfile.
+        """
+        if self._flow_window:
+            return self._flow_window
+        # Known capabilities only, a batch does not fetch them
+        rx_buffer = self._capabilities['rx_buffer'] if self._capabilities else None
+        return rx_buffer or self.boardfile.rx_buffer or RX_BUFFER
+
+    def send_batch(self, messages, timeout=None):
+        """
+            Send several messages and return their replies in order (pipelined).
+            Frames are written as long as the unanswered bytes fit into the
+            receive buffer of the device (see flow_window), otherwise the next
+            reply is awaited first. Without wait, nothing is read back.
+            <timeout> (seconds) applies to the whole batch.
+        """
+        with self.lock:
+            try:
+                return self._send_batch(messages, timeout)
+            except (serial.SerialException, OSError):
+                if not self.auto_reconnect:
+                    raise
+                self.reconnect()
+                return self._send_batch(messages, timeout)
+
+    def _send_batch(self, messages, timeout=None):
+        """ Send messages pipelined and read the replies """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        if self._abandoned:
+            self._drain(deadline)
+        frames = [message if isinstance(message, bytes) else message.encode('utf-8')
+                  for message in messages]
+        if not self.wait:
+            self._write(b''.join(frames))
+            return [True] * len(messages)
+        window = self.flow_window
+        pending = deque()
+        outstanding = sent = 0
+        replies = []
+        while len(replies) < len(frames):
+            end = sent
+            size = 0
+            # A frame larger than the window is sent alone.
+            while end < len(frames) and (outstanding + size + len(frames[end]) <= window
+                                         or (not pending and end == sent)):
+                size += len(frames[end])
+                end += 1
+            if end > sent:
+                self._write(b''.join(frames[sent:end]))
+                written = time.perf_counter()
+                pending.extend((len(frame), written) for frame in frames[sent:end])
+                outstanding += size
+                sent = end
+            if sent < len(frames) and self.metrics is not None:
+                self.metrics.count('flow_stalls')
+            try:
+                msg = self._readline(deadline)
+            except ReplyTimeoutError:
+                # All frames sent, but not answered yet may still be answered
+                self._abandon(len(pending))
+                raise
+            if msg == BOOT_BANNER:
+                # The device was reset, unanswered frames are lost. Send them again.
+                self._on_boot()
+                pending.clear()
+                outstanding = 0
+                sent = len(replies)
+                continue
+            size, written = pending.popleft()
+            outstanding -= size
+            replies.append(msg)
+            if self.metrics is not None:
+                self.metrics.observe(messages[len(replies) - 1],
+                                     time.perf_counter() - written)
+                if not msg or msg.startswith('Invalid command'):
+                    self.metrics.count('flow_drops')
+            if not msg:
+                # Timeout. The remaining replies will not come either.
+                replies.extend([''] * (len(messages) - len(replies)))
+        return replies
+
+    def stats(self):
+        """
+            Return the collected metrics (latency histograms per command type,
+            timeout, invalid reply, byte and reconnect counters). Metrics are
+            only collected, if the object was created with metrics=True.
+        """
+        if self.metrics is None:
+            return {}
+        return self.metrics.as_dict()
+
+    def describe(self, refresh=False):
+        """
+            Return the capabilities of the firmware (version, build hash, number
+            of pins, pwm and analog pins, rx buffer size and supported commands).
+            They are fetched on first use and cached per connection. Returns
+            False (also cached), if the firmware does not support describe.
+        """
+        if self._capabilities is not None and not refresh:
+            return self._capabilities
+        with phase(self.timings, 'describe'):
+            res = self.send('<zd00000>')
+        if not isinstance(res, str) or '%describe%' not in res:
+            self._capabilities = False
+            return False
+        fields = dict(field.split('=', 1) for field in res.split('%', 2)[-1].split(';')
+                      if '=' in field)
+
+        def _pins(key):
+            return frozenset(int(pin) for pin in fields.get(key, '').split(',') if pin)
+
+        self._capabilities = AttrDict(
+            version=fields.get('version'),
+            build_hash=fields.get('hash'),
+            num_pins=int(fields.get('pins', 0)),
+            pwm_pins=_pins('pwm'),
+            analog_pins=_pins('analog'),
+            rx_buffer=int(fields.get('rx', 0)),
+            i2c_block=int(fields.get('i2c', 0)) or None,
+            spi_block=int(fields.get('spi', 0)) or None,
+            capture_samples=int(fields.get('capture', 0)) or None,
+            macro_slots=int(fields.get('macros', 0)) or None,
+            macro_size=int(fields.get('macro', 0)) or None,
+            ops=frozenset(fields.get('ops', '').split(',')))
+        for pin in self.Pins.values():
+            pin.pwm_capable = pin.pin_id in self._capabilities['pwm_pins']
+        return self._capabilities
+
+    @property
+    def capabilities(self):
+        """
+            Return the capabilities of the firmware (see describe()). They are
+            fetched on first access, not on connect, so connecting to firmware
+            that cannot describe itself does not wait for a reply.
+        """
+        if self._capabilities is None and self.wait and self.ready:
+            return self.describe()
+        return self._capabilities
+
+    def supports(self, op):
+        """
+            Return True, if the firmware supports the command <op> (e.g. 'PR').
+            Without known capabilities, everything is assumed to be supported.
+        """
+        if not self.capabilities:
+            return True
+        return op in self.capabilities['ops']
+
+    def require(self, op):
+        """
+            Raise UnsupportedOperationError, if the firmware lacks the command
+            <op>. For commands of optional features, the error tells how to
+            build them in.
+        """
+        if self.supports(op):
+            return
+        message = f'Firmware {self.capabilities["version"]} does not support {op}'
+        feature = next((name for name, ops in FEATURES.items() if op in ops), None)
+        if feature:
+            message += f'. Add {feature} to firmware: features: in the boardfile ' \
+                       f'{self._boardfile} and flash the firmware again'
+        raise UnsupportedOperationError(message)
+
     @property
     def firmware_version(self):
         """ Get arduino firmware version """
+        if self._capabilities:
+            return self._capabilities['version']
         res = self.send("<zv00000>")
         if self.wait:
             return res.split("%")[-1]
@@ -128,3 +755,132 @@ class Arduino:  # pylint: disable=too-many-instance-attributes
         if self.wait:
             return res.split("%")[-1]
         return res
+
+    def _check_link_control(self):
+        """ Raise, if the baudrate of the connection cannot be changed """
+        if not self.wait:
+            raise DeviceConfigError('Baudrate negotiation requires wait=True')
+        if self.socat:
+            raise DeviceConfigError('Baudrate negotiation does not work through a socat proxy')
+
+    def set_baudrate(self, baudrate, confirm=True):
+        """
+            Switch device and host to <baudrate>. Unless confirmed, the device
+            falls back to the previous baudrate after BAUDRATE_PROBATION seconds.
+        """
+        self._check_link_control()
+        if baudrate not in BAUDRATES:
+            raise DeviceConfigError(f'Unsupported baudrate: {baudrate}')
+        self.send(f'<zb00{BAUDRATES.index(baudrate):03d}>')
+        self.Connection.baudrate = baudrate
+        self.baudrate = baudrate
+        # Drop whatever arrived while both sides switched.
+        time.sleep(0.05)
+        self._reset_input()
+        if confirm:
+            return self.confirm_baudrate()
+        return True
+
+    def confirm_baudrate(self, timeout=None):
+        """ Confirm the current baudrate, so the device keeps it """
+        res = self.send('<zk00000>', timeout)
+        return res.split('%')[-1] == str(self.baudrate)
+
+    def resume_baudrate(self, baudrate):
+        """
+            Continue at the negotiated <baudrate>. A device that was not reset
+            on connect (hang_up_on_close: no) still runs at it, which is probed
+            with a confirmation first. Otherwise the device is switched from
+            the baudrate it starts with.
+        """
+        self._check_link_control()
+        if baudrate not in BAUDRATES:
+            raise DeviceConfigError(f'Unsupported baudrate: {baudrate}')
+        self.Connection.baudrate = baudrate
+        self.baudrate = baudrate
+        self._reset_input()
+        try:
+            if self.confirm_baudrate(BAUDRATE_PROBE_TIMEOUT):
+                return True
+        except ReplyTimeoutError:
+            pass
+        self.logger.debug('Device on %s does not run at %s baud, switching', self.tty, baudrate)
+        self.Connection.baudrate = self.boot_baudrate
+        self.baudrate = self.boot_baudrate
+        self._reset_input()
+        return self.set_baudrate(baudrate)
+
+    def link_test(self, frames=100, max_failures=3):
+        """
+            Run an error-checked echo test over the current connection. Return
+            a dict with the achieved throughput (bytes/s) and the error rate.
+            The test is aborted after <max_failures> consecutive failures.
+        """
+        errors = failures = transferred = 0
+        sent = 0
+        start = time.monotonic()
+        for _ in range(frames):
+            value = random.randint(0, 999)
+            message = f'<ze00{value:03d}>'
+            res = self.send(message)
+            sent += 1
+            if res.split('%')[-1] == str(value) and '%echo%' in res:
+                transferred += len(message) + len(res) + 2
+                failures = 0
+                continue
+            errors += 1
+            failures += 1
+            if failures >= max_failures:
+                errors += frames - sent
+                break
+        duration = time.monotonic() - start
+        return {'baudrate': self.baudrate,
+                'frames': frames,
+                'errors': errors,
+                'error_rate': errors / frames,
+                'throughput': int(transferred / duration) if duration else 0}
+
+    def _revert_baudrate(self, baudrate):
+        """ Wait for the device to fall back to <baudrate> and follow """
+        time.sleep(BAUDRATE_PROBATION + 0.1)
+        self.Connection.baudrate = baudrate
+        self.baudrate = baudrate
+        self._reset_input()
+
+    def negotiate_baudrate(self, rates=BAUDRATES, frames=100, max_error_rate=0.0):
+        """
+            Step up through <rates> and keep the highest baudrate that passes
+            the link test. Return the negotiated baudrate.
+        """
+        self._check_link_control()
+        best = self.baudrate
+        for rate in sorted(r for r in rates if r > best):
+            self.set_baudrate(rate, confirm=False)
+            result = self.link_test(frames)
+            self.logger.info('Link test at %s baud: %s', rate, result)
+            if result['error_rate'] > max_error_rate or not self.confirm_baudrate():
+                self._revert_baudrate(best)
+                break
+            best = rate
+        return best
+
+    def benchmark_link(self, rates=BAUDRATES, frames=100):
+        """
+            Run the link test at each of <rates> and return the results. The
+            device is switched back to the current baudrate afterwards.
+        """
+        self._check_link_control()
+        initial = confirmed = self.baudrate
+        results = []
+        for rate in rates:
+            if rate != self.baudrate:
+                self.set_baudrate(rate, confirm=False)
+            result = self.link_test(frames)
+            results.append(result)
+            if result['error_rate'] < 1 and self.confirm_baudrate():
+                confirmed = rate
+                continue
+            self._revert_baudrate(confirmed)
+        if self.baudrate != initial:
+            self.set_baudrate(initial)
+        return results
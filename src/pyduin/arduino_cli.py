@@ -8,32 +8,44 @@
 """
 import argparse
 import configparser
+import cProfile
+import json
 import logging
 import os
+import shlex
 import subprocess
 import sys
 
-from jinja2 import Template
 from termcolor import colored
 import yaml
 
 
 from pyduin.arduino import Arduino
+from pyduin import datalog
+from pyduin import discover
+from pyduin.firmware import HostBuild, HostDevice, firmware_env, render_firmware, \
+    resolve_features
+from pyduin.timings import Timings, phase
 from pyduin import _utils as utils
 from pyduin import AttrDict, VERSION, DeviceConfigError, BuildEnv
+from pyduin.utils import UnsupportedOperationError, PinNotFoundError, LEDNotFoundError
 
 logger = utils.logger()
 
+# Sub-commands that can be used in scripts (pyduin run)
+RUN_COMMANDS = ('pin', 'p', 'led', 'free', 'f', 'versions', 'v')
+
 def get_basic_config(args):
     """
         Get configuration,  needed for all operations
     """
-    configfile = args.configfile or '~/.pyduin.yml'
+    configfile = getattr(args.configfile, 'name', args.configfile) or '~/.pyduin.yml'
     confpath = os.path.expanduser(configfile)
     utils.ensure_user_config_file(confpath)
     with open(confpath, 'r', encoding='utf-8') as _configfile:
         cfg = yaml.load(_configfile, Loader=yaml.Loader)
     logger.debug("Using configuration file: %s", confpath)
+    cfg['configfile'] = confpath
 
     workdir = args.workdir or cfg.get('workdir', '~/.pyduin')
     logger.debug("Using workdir %s", workdir)
@@ -64,8 +76,8 @@ def _get_arduino_config(args, config):
     Determine tty, baudrate, model and boardfile for the currently used arduino.
     """
     arduino_config = {}
-    for opt in ('tty', 'baudrate', 'board', 'boardfile'):
-        _opt = getattr(args, opt)
+    for opt in ('tty', 'baudrate', 'board', 'boardfile', 'link_baudrate', 'arduino_id'):
+        _opt = getattr(args, opt, False)
         arduino_config[opt] = _opt
         if not _opt:
             try:
@@ -130,7 +142,7 @@ def get_pyduin_userconfig(args, config):
     config = _get_arduino_config(args, config)
     return config
 
-def get_arduino(config):
+def get_arduino(config, timings=None):
     """
         Get an arduino object, open the serial connection if it is the first connection
         or wait=True (socat off/unavailable) and return it. To circumvent restarts of
@@ -152,7 +164,11 @@ def get_arduino(config):
 
     arduino = Arduino(tty=aconfig['tty'], baudrate=aconfig['baudrate'],
                   boardfile=aconfig['boardfile'], board=aconfig['board'],
-                  wait=True, socat=config['serial']['use_socat'])
+                  wait=True, socat=config['serial']['use_socat'], timings=timings)
+    if aconfig.get('link_baudrate') and not arduino.socat:
+        logger.debug("Resuming negotiated baudrate %s", aconfig['link_baudrate'])
+        with phase(timings, 'set_baudrate'):
+            arduino.resume_baudrate(aconfig['link_baudrate'])
     return arduino
 
 def prepare_buildenv(arduino, config, args):
@@ -167,14 +183,21 @@ def prepare_buildenv(arduino, config, args):
     setattr(arduino, 'buildenv', buildenv)
 
 
-def update_firmware(arduino):  # pylint: disable=too-many-locals,too-many-statements
+def update_firmware(arduino, upload=True):  # pylint: disable=too-many-locals,too-many-statements
     """
-        Update firmware on arduino (cmmi!)
+        Update firmware on arduino (cmmi!). Without <upload>, the firmware
+        is only built. Print and return flash and ram usage.
     """
-    if arduino.socat:
+    if arduino.socat and upload:
         arduino.socat.stop()
 
-    arduino.buildenv.build()
+    features = resolve_features(arduino.boardfile.features)
+    sizes = arduino.buildenv.build(features, upload=upload)
+    usage = ', '.join(f'{name} {used}/{total} bytes ({used / total:.1%})'
+                      for name, (used, total) in sorted(sizes.items()))
+    print(colored(f'{arduino.board} [{",".join(features) or "no features"}]: '
+                  f'{usage or "no size report"}', 'green'))
+    return sizes
 
 def versions(arduino, workdir):
     """ Print both firmware and package version """
@@ -183,29 +206,182 @@ def versions(arduino, workdir):
            "available": utils.available_firmware_version(workdir) }
     return res
 
+def link(arduino, config, args):
+    """ Negotiate the baudrate or benchmark the serial link """
+    if args.linkcmd in ('negotiate', 'n'):
+        rate = arduino.negotiate_baudrate(frames=args.frames)
+        print(colored(f'Negotiated baudrate: {rate}', 'green'))
+        if args.buddy:
+            utils.update_buddy_cfg(config['configfile'], args.buddy, 'link_baudrate', rate)
+            logger.info("Stored link_baudrate for %s in %s", args.buddy, config['configfile'])
+        return rate
+    if args.linkcmd in ('bench', 'b'):
+        results = arduino.benchmark_link(frames=args.frames)
+        for result in results:
+            color = 'green' if not result['errors'] else 'red'
+            print(colored(f"{result['baudrate']:>8} baud: {result['throughput']:>7} bytes/s, "
+                          f"error rate {result['error_rate']:.2%}", color))
+        return results
+    print("Nothing to do")
+    return False
+
+def discover_devices(config, args):
+    """ Find devices, match them to buddies and optionally store their tty """
+    devices = discover.discover(args.ports or None, timeout=args.timeout)
+    buddies = discover.match_buddies(devices, config.get('buddies'))
+    names = {device['tty']: name for name, device in buddies.items()}
+    for device in devices:
+        buddy = names.get(device['tty'], '-')
+        print(colored(f"{device['tty']}: arduino_id {device['arduino_id']}, "
+                      f"firmware {device['version']}, buddy {buddy}", 'green'))
+    if args.update:
+        for name, device in buddies.items():
+            if config['buddies'][name].get('tty') != device['tty']:
+                utils.update_buddy_cfg(config['configfile'], name, 'tty', device['tty'])
+                logger.info("Stored tty %s for %s in %s", device['tty'], name,
+                            config['configfile'])
+    return buddies
+
+def run_host(config, args):
+    """ Build the firmware for the host and run it until interrupted """
+    if not config.get('board'):
+        raise DeviceConfigError('Cannot determine board, use -b or -B')
+    binary = HostBuild(config['workdir'], config['board']).build(
+        baudrate=args.baudrate or None, boardfile=config['boardfile'],
+        arduino_id=utils.get_buddy_cfg(config, args.buddy, 'arduino_id'))
+    with HostDevice(binary) as device:
+        print(colored(f'Firmware running on {device.tty} (Ctrl-C to stop)', 'green'))
+        try:
+            device.process.wait()
+        except KeyboardInterrupt:
+            pass
+    return binary
+
+def _reply_value(replies):
+    """ Return the value of the last reply of a script command """
+    reply = replies[-1] if replies else None
+    return reply.split('%')[-1] if isinstance(reply, str) else reply
+
+def _track(pin, mode=None, output=None):
+    """ Return a function, that tracks <mode> and <output> of <pin> for restore_state() """
+    def track():
+        if mode is not None:
+            pin.Mode.message = pin.Mode.frame(mode)
+            pin.Mode.wanted_mode = pin.pin_mode = 'output' if mode == 'pwm' else mode
+        if output is not None:
+            pin.output = output
+    return track
+
+def script_step(arduino, config, args):
+    """
+        Return the frames of one script command, a function, that turns
+        their replies into the result of the command and a function, that
+        tracks the pin state the command sets (or None). Nothing is changed
+        before the returned functions are called.
+    """
+    if args.cmd in ('versions', 'v'):
+        return [b'<zv00000>'], lambda replies: {
+            "pyduin": VERSION, "device": _reply_value(replies),
+            "available": utils.available_firmware_version(config['workdir'])}, None
+    if args.cmd in ('free', 'f'):
+        return [b'<zz00000>'], _reply_value, None
+    if args.cmd == 'led':
+        pin = arduino.get_pin(arduino.get_led(args.led))
+        output = pin.frames['high' if args.action == 'on' else 'low']
+        return [pin.Mode.frame('output'), output], _reply_value, \
+            _track(pin, 'output', output)
+    pin = arduino.get_pin(args.pin)
+    act = {'h': 'high', 'l': 'low'}.get(args.pincmd, args.pincmd)
+    if act == 'mode':
+        return [pin.Mode.frame(args.mode)], _reply_value, _track(pin, args.mode)
+    if act == 'read':
+        return [pin.frames['read']], _reply_value, None
+    if act == 'pwm':
+        if not pin.pwm_capable:
+            raise UnsupportedOperationError(f'Pin {pin.pin_id} is not pwm capable')
+        output = pin.frame('pwm', args.value)
+    elif act in ('high', 'low'):
+        output = pin.frames[act]
+    else:
+        raise DeviceConfigError(f'No action given for pin {args.pin}')
+    return [output], _reply_value, _track(pin, output=output)
+
+def parse_script(arduino, config, script):
+    """
+        Check all lines of <script>. Return the steps (line number, line,
+        frames, result function) and the functions tracking the pin state.
+    """
+    parser = get_parser()
+    steps = []
+    tracks = []
+    for num, line in enumerate(script, 1):
+        words = shlex.split(line, comments=True)
+        if not words:
+            continue
+        try:
+            cmd = parser.parse_args(words)
+        except SystemExit as error:
+            raise DeviceConfigError(f'Line {num}: invalid command: {line.strip()}') from error
+        if cmd.cmd not in RUN_COMMANDS:
+            raise DeviceConfigError(f'Line {num}: {cmd.cmd} cannot be used in scripts')
+        try:
+            frames, result, track = script_step(arduino, config, cmd)
+        except (UnsupportedOperationError, DeviceConfigError, PinNotFoundError,
+                LEDNotFoundError) as error:
+            raise DeviceConfigError(f'Line {num}: {error}') from error
+        steps.append((num, line.strip(), frames, result))
+        tracks += [track] if track else []
+    return steps, tracks
+
+def run_script(arduino, config, args):
+    """
+        Run the commands of a script (one per line, like on the command-line)
+        over one connection. All lines are checked first, then the pin state
+        they set is tracked and their frames are sent as one pipelined batch.
+        Print one result per command.
+    """
+    steps, tracks = parse_script(arduino, config, args.script)
+    for track in tracks:
+        track()
+    replies = arduino.send_batch([frame for step in steps for frame in step[2]])
+    results = []
+    for num, line, frames, result in steps:
+        value = result(replies[:len(frames)])
+        replies = replies[len(frames):]
+        results.append(value)
+        if args.json:
+            print(json.dumps({'line': num, 'command': line, 'result': value}))
+        else:
+            print(value)
+    return results
+
+def log_pins(arduino, args):
+    """ Sample pins into a data log file """
+    logger_ = datalog.DataLogger(arduino, args.pins, args.rate, args.output,
+                                 rotate_bytes=args.rotate_size, rotate_seconds=args.rotate_time)
+    try:
+        logger_.run(duration=args.duration, samples=args.samples)
+    except KeyboardInterrupt:
+        pass
+    print(colored(f'{logger_.samples} samples written to {", ".join(logger_.writer.files)} '
+                  f'({logger_.overruns} overruns)', 'green'))
+    if args.csv:
+        for num, path in enumerate(logger_.writer.files):
+            csvpath = args.csv if len(logger_.writer.files) == 1 else \
+                f'{os.path.splitext(args.csv)[0]}.{num:04d}.csv'
+            datalog.export_csv(path, csvpath)
+    return logger_.samples
+
 def template_firmware(arduino, config):
-    """ Render firmware from template """
-    _tpl = '{%s}'
-    fwenv = {
-        "num_analog_pins": arduino.boardfile.num_analog_pins,
-        "num_digital_pins": arduino.boardfile.num_digital_pins,
-        "num_pwm_pins": arduino.boardfile.num_pwm_pins,
-        "pwm_pins": _tpl % ", ".join(map(str, arduino.boardfile.pwm_pins)),
-        "analog_pins": _tpl % ", ".join(map(str, arduino.boardfile.analog_pins)),
-        "digital_pins": _tpl % ", ".join(map(str, arduino.boardfile.digital_pins)),
-        "physical_pins": _tpl % ", ".join(map(str, arduino.boardfile.physical_pin_ids)),
-        "num_physical_pins":  arduino.boardfile.num_physical_pins,
-        "extra_libs": '\n'.join(arduino.boardfile.extra_libs),
-        "baudrate": arduino.baudrate
-    }
+    """ Render firmware from template. It starts at the boot baudrate, not a negotiated one. """
+    fwenv = firmware_env(arduino.boardfile, arduino.boot_baudrate,
+                         config['_arduino_'].get('arduino_id'))
     workdir = os.path.expanduser(config["workdir"])
     firmware = os.path.join(workdir, config['_arduino_']['board'], 'src', 'pyduin.cpp')
     logger.debug("Using firmware template: %s", firmware)
 
     with open(firmware, 'r', encoding='utf-8') as template:
-        tpl = Template(template.read())
-        tpl = tpl.render(fwenv)
-        #logger.debug(tpl)
+        tpl = render_firmware(template.read(), fwenv)
 
     with open(firmware, 'w', encoding='utf8') as template:
         template.write(tpl)
@@ -219,9 +395,9 @@ def lint_firmware():
     except subprocess.CalledProcessError:
         logger.error("The firmware contains errors")
 
-def main(): # pylint: disable=too-many-locals,too-many-statements,too-many-branches
+def get_parser():  # pylint: disable=too-many-locals,too-many-statements
     """
-        Evaluate user arguments and determine task
+        Return the argument parser of the command-line
     """
     parser = argparse.ArgumentParser(prog="pyduin")
     paa = parser.add_argument
@@ -234,7 +410,15 @@ def main(): # pylint: disable=too-many-locals,too-many-statements,too-many-branc
     paa('-l', '--log-level', default=False)
     paa('-p', '--boardfile', default=False,
         help="Pinfile to use (default: <package_install_dir>/boardfiles/<board>.yml")
+    paa('-R', '--record', default=False, metavar="FILE",
+        help="Record all serial traffic to FILE (see pyduin.recording)")
     paa('-s', '--baudrate', type=int, default=False)
+    paa('--timings', action="store_true", default=False,
+        help="Print the time spent in each phase (config, connect, command) to stderr")
+    paa('--stacks', default=False, metavar="FILE",
+        help="Write the phase timings as collapsed stacks (flamegraph.pl, speedscope) to FILE")
+    paa('--profile', default=False, metavar="FILE",
+        help="Run under cProfile and write the stats to FILE (see pstats)")
     paa('-t', '--tty', default=False, help="Device tty. Consult `platformio device list`")
     paa('-w', '--workdir', type=str, default=False,
         help="Alternate workdir path (default: ~/.pyduin)")
@@ -254,11 +438,53 @@ def main(): # pylint: disable=too-many-locals,too-many-statements,too-many-branc
                                                help="Flash firmware to device")
     flash_subparser.add_argument('-n', '--no-cache', action="store_true", default=False)
     fwsubparsers.add_parser("lint", help="Lint Firmware in <workdir>", aliases=['l'])
+    fwsubparsers.add_parser("size", aliases=['s'],
+                            help="Build the firmware and report flash and ram usage")
+    fwsubparsers.add_parser("host", aliases=['h'],
+                            help="Build the firmware for this computer and run it on a pty")
     fwv_subparsers = firmwareversion_parser.add_subparsers(help="Available sub-commands",
                                                            dest='fwscmd')
     fwv_subparsers.add_parser('device', help="Device Firmware", aliases=['d'])
     fwv_subparsers.add_parser("available", help="Available Firmware", aliases=['a'])
 
+    link_parser = subparsers.add_parser("link", help="Serial link options")
+    linksubparsers = link_parser.add_subparsers(help="Available sub-commands", dest="linkcmd")
+    for linkcmd, linkhelp in (('negotiate', "Negotiate and store the highest working baudrate"),
+                              ('bench', "Report throughput and error rate at each baudrate")):
+        linkcmd_parser = linksubparsers.add_parser(linkcmd, help=linkhelp, aliases=[linkcmd[0]])
+        linkcmd_parser.add_argument('-f', '--frames', type=int, default=100,
+                                    help="Number of echo frames per baudrate")
+
+    discover_parser = subparsers.add_parser("discover", help="Find devices and their buddies")
+    discover_parser.add_argument('ports', nargs='*', metavar="<tty>",
+                                 help="Ports to probe (default: all serial ports)")
+    discover_parser.add_argument('-u', '--update', action="store_true", default=False,
+                                 help="Store the tty of matched buddies in the configfile")
+    discover_parser.add_argument('-T', '--timeout', type=float, default=discover.PROBE_TIMEOUT,
+                                 help="Seconds to wait for each device")
+
+    run_parser = subparsers.add_parser("run", help="Run the commands of a script over one "
+                                       "connection (pin, led, free, versions)")
+    run_parser.add_argument('script', nargs='?', default='-', type=argparse.FileType('r'),
+                            help="Script with one command per line (default: stdin)")
+    run_parser.add_argument('-j', '--json', action="store_true", default=False,
+                            help="Print the results as JSON lines")
+
+    log_parser = subparsers.add_parser("log", help="Sample pins into a data log file")
+    log_parser.add_argument('pins', nargs='+', help="Pins to sample", metavar="<pin_id>")
+    log_parser.add_argument('-r', '--rate', type=float, default=10, help="Samples per second")
+    log_parser.add_argument('-d', '--duration', type=float, default=None,
+                            help="Seconds to sample (default: until interrupted)")
+    log_parser.add_argument('-n', '--samples', type=int, default=None,
+                            help="Number of samples to take")
+    log_parser.add_argument('-o', '--output', default='pyduin.pdl', help="Data log file")
+    log_parser.add_argument('--rotate-size', type=int, default=None, metavar="BYTES",
+                            help="Start a new file after BYTES")
+    log_parser.add_argument('--rotate-time', type=float, default=None, metavar="SECONDS",
+                            help="Start a new file after SECONDS")
+    log_parser.add_argument('--csv', default=False, metavar="FILE",
+                            help="Export the samples to CSV when done")
+
     pin_parser = subparsers.add_parser("pin", help="Pin related actions (high,low,pwm)",
                                         aliases=['p'])
     pin_parser.add_argument('pin', default=False, type=str, help="The pin to do action x with.",
@@ -274,27 +500,83 @@ def main(): # pylint: disable=too-many-locals,too-many-statements,too-many-branc
     digitalpin_parser_pwm = pinsubparsers.add_parser("pwm")
     digitalpin_parser_pwm.add_argument('value', type=int, help='0-255')
 
-    args = parser.parse_args()
+    return parser
+
+def main():
+    """
+        Evaluate user arguments and run the task, optionally timed and profiled
+    """
+    args = get_parser().parse_args()
+    timings = Timings() if args.timings or args.stacks else None
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
     try:
+        run(args, timings)
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if args.stacks:
+            with open(args.stacks, 'w', encoding='utf-8') as stacks:
+                stacks.write(timings.collapsed())
+        if args.timings:
+            print(timings.breakdown(), file=sys.stderr)
+
+
+def run(args, timings=None):
+    """
+        Determine and run the task of <args>. Phases are recorded to <timings>.
+    """
+    if args.cmd == 'discover':
+        # Runs without a configured device
+        try:
+            with phase(timings, 'command'):
+                discover_devices(get_basic_config(args), args)
+        except DeviceConfigError as error:
+            print(colored(error, 'red'))
+            sys.exit(1)
+        sys.exit(0)
+    if args.cmd in ('firmware', 'fw') and args.fwcmd in ('host', 'h'):
+        try:
+            with phase(timings, 'command'):
+                run_host(get_basic_config(args), args)
+        except DeviceConfigError as error:
+            print(colored(error, 'red'))
+            sys.exit(1)
+        sys.exit(0)
+    with phase(timings, 'config'):
+        try:
+            basic_config = get_basic_config(args)
+            config = get_pyduin_userconfig(args, basic_config)
+        except DeviceConfigError as error:
+            print(colored(error, 'red'))
+            sys.exit(1)
+
+        log_level = args.log_level or config.get('log_level', 'info')
+        logger.setLevel(level=getattr(logging, log_level.upper()))
+        #logger.basicConfig(level=getattr(logger, log_level.upper()))
+        # re-read configs to be able to see the log messages.
         basic_config = get_basic_config(args)
         config = get_pyduin_userconfig(args, basic_config)
-    except DeviceConfigError as error:
-        print(colored(error, 'red'))
-        sys.exit(1)
-
-    log_level = args.log_level or config.get('log_level', 'info')
-    logger.setLevel(level=getattr(logging, log_level.upper()))
-    #logger.basicConfig(level=getattr(logger, log_level.upper()))
-    # re-read configs to be able to see the log messages.
-    basic_config = get_basic_config(args)
-    config = get_pyduin_userconfig(args, basic_config)
 
     #if getattr(args, 'fwcmd', False) not in ('flash', 'f'):
-    arduino = get_arduino(config)
-    prepare_buildenv(arduino, config, args)
+    with phase(timings, 'connect'):
+        arduino = get_arduino(config, timings)
+        if args.record:
+            arduino.record(args.record)
+    with phase(timings, 'buildenv'):
+        prepare_buildenv(arduino, config, args)
     #args.pin = arduino.boardfile.normalize_pin_id(args.pin)
-    print(args)
+    logger.debug("Arguments: %s", args)
+    with phase(timings, 'command'):
+        run_command(arduino, config, args)
 
+
+def run_command(arduino, config, args):  # pylint: disable=too-many-statements,too-many-branches
+    """
+        Run the command of <args> on <arduino>
+    """
     if args.cmd in ('versions', 'v'):
         print(versions(arduino, config['workdir']))
         sys.exit(0)
@@ -322,6 +604,26 @@ def main(): # pylint: disable=too-many-locals,too-many-statements,too-many-branc
             template_firmware(arduino, config)
             lint_firmware()
             update_firmware(arduino)
+        elif args.fwcmd in ('size', 's'):
+            template_firmware(arduino, config)
+            update_firmware(arduino, upload=False)
+        sys.exit(0)
+    elif args.cmd == 'link':
+        try:
+            link(arduino, config, args)
+        except DeviceConfigError as error:
+            print(colored(error, 'red'))
+            sys.exit(1)
+        sys.exit(0)
+    elif args.cmd == 'log':
+        log_pins(arduino, args)
+        sys.exit(0)
+    elif args.cmd == 'run':
+        try:
+            run_script(arduino, config, args)
+        except DeviceConfigError as error:
+            print(colored(error, 'red'))
+            sys.exit(1)
         sys.exit(0)
     elif args.cmd == 'led':
         pin_id = arduino.get_led(args.led)
@@ -336,10 +638,11 @@ def main(): # pylint: disable=too-many-locals,too-many-statements,too-many-branc
             act = 'pwm' if act == 'p' else act
             pin = arduino.get_pin(args.pin)
             func = getattr(pin, act)
-            if act == 'pwm':
-                res = func(args.value)
-            else:
-                res = func()
+            try:
+                res = func(args.value) if act == 'pwm' else func()
+            except UnsupportedOperationError as error:
+                print(colored(error, 'red'))
+                sys.exit(1)
             logger.debug(res)
         elif args.pincmd == 'mode' and args.mode in ('input_pullup', 'input', 'output', 'pwm'):
             pin = arduino.get_pin(args.pin)
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  bus.py
+#
+"""
+    Bus module. Access to peripherals on the device's I2C and SPI busses.
+"""
+import weakref
+
+from pyduin.utils import BusError, DeviceConfigError
+
+# Bytes per I2C frame, if the firmware does not report it (Wire BUFFER_LENGTH)
+I2C_BLOCK = 32
+# Bytes per SPI frame, if the firmware does not report it
+SPI_BLOCK = 32
+SPI_MODES = (0, 1, 2, 3)
+# Frame flags of an SPI exchange spanning several frames
+SPI_BEGIN = 1
+SPI_END = 2
+
+
+class I2CBus:
+    """
+        An I2C bus of the device. Data is passed as bytes. Reads and writes
+        larger than one frame are split into consecutive register blocks,
+        which are sent as one pipelined batch.
+    """
+
+    def __init__(self, arduino, num=0):
+        self.arduino = weakref.proxy(arduino)
+        self.num = num
+        try:
+            self.interface = arduino.boardfile.i2c_interfaces[str(num)]
+        except KeyError as exc:
+            raise DeviceConfigError(f'Board has no I2C interface {num}') from exc
+
+    @property
+    def block(self):
+        """ Return the maximum number of bytes per frame """
+        capabilities = self.arduino.capabilities
+        return (capabilities.get('i2c_block') if capabilities else None) or I2C_BLOCK
+
+    def _frame(self, command, address, payload=''):
+        """ Return an i2c message """
+        if not 0 <= address < 128:
+            raise ValueError(f'Invalid I2C address: {address}')
+        return f'<I{command}{self.num:02d}{address:03d}{":" if payload else ""}{payload}>'
+
+    def _value(self, reply):
+        """ Return the value of a reply or raise BusError """
+        value = reply.split('%')[-1] if isinstance(reply, str) else ''
+        if value == '-1' or not reply:
+            raise BusError(f'I2C transfer on bus {self.num} failed: {reply!r}')
+        return value
+
+    def _data(self, reply):
+        """ Return the hex decoded data of a reply or raise BusError """
+        try:
+            return bytes.fromhex(self._value(reply))
+        except ValueError as exc:
+            raise BusError(f'Invalid reply from I2C bus {self.num}: {reply}') from exc
+
+    def scan(self):
+        """ Return the addresses of all devices answering on the bus """
+        self.arduino.require('IS')
+        return list(self._data(self.arduino.send(self._frame('S', 0))))
+
+    def read(self, address, count):
+        """ Read <count> bytes from the device at <address> (max. one block) """
+        if not 0 < count <= self.block:
+            raise ValueError(f'Raw reads are limited to 1-{self.block} bytes')
+        self.arduino.require('IR')
+        return self._data(self.arduino.send(self._frame('R', address, f'-1,{count}')))
+
+    def read_block(self, address, register, count):
+        """ Read <count> bytes starting at <register> """
+        self.arduino.require('IR')
+        messages = [self._frame('R', address, f'{reg},{min(self.block, count - offset)}')
+                    for offset, reg in self._blocks(register, count)]
+        return b''.join(self._data(reply) for reply in self.arduino.send_batch(messages))
+
+    def read_register(self, address, register):
+        """ Read a single byte register """
+        return self.read_block(address, register, 1)[0]
+
+    def write(self, address, data):
+        """ Write <data> to the device at <address> (max. one block) """
+        if len(data) > self.block:
+            raise ValueError(f'Raw writes are limited to {self.block} bytes')
+        self.arduino.require('IW')
+        reply = self.arduino.send(self._frame('W', address, f'-1,{bytes(data).hex()}'))
+        return int(self._value(reply))
+
+    def write_block(self, address, register, data):
+        """ Write <data> starting at <register> """
+        self.arduino.require('IW')
+        data = bytes(data)
+        # The register address takes one byte of the device's buffer.
+        block = self.block - 1
+        messages = [self._frame('W', address, f'{reg},{data[offset:offset + block].hex()}')
+                    for offset, reg in self._blocks(register, len(data), block)]
+        return sum(int(self._value(reply)) for reply in self.arduino.send_batch(messages))
+
+    def write_register(self, address, register, value):
+        """ Write a single byte register """
+        return self.write_block(address, register, bytes((value,)))
+
+    def _blocks(self, register, count, block=None):
+        """ Return (offset, register) pairs for the blocks of a transfer """
+        block = block or self.block
+        return [(offset, register + offset) for offset in range(0, count, block)]
+
+
+class SPIBus:
+    """
+        An SPI bus of the device. <cs> is the chip select pin driven by the
+        device around each transfer (default: the ss pin of the boardfile,
+        0: none). Buffers larger than one frame are sent as one pipelined
+        batch of frames flagged as begin and end of one exchange, so chip
+        select stays asserted for the whole buffer.
+    """
+
+    def __init__(self, arduino, num=0, clock=1000000, mode=0, cs=None):
+        self.arduino = weakref.proxy(arduino)
+        self.num = num
+        try:
+            self.interface = arduino.boardfile.spi_interfaces[str(num)]
+        except KeyError as exc:
+            raise DeviceConfigError(f'Board has no SPI interface {num}') from exc
+        self.clock = clock
+        self.mode = mode
+        if cs is None:
+            cs = self.interface.get('ss', 0)
+        self.cs = arduino.boardfile.normalize_pin_id(cs) if cs else 0
+
+    @property
+    def mode(self):
+        """ Return the SPI mode (0-3) """
+        return self._mode
+
+    @mode.setter
+    def mode(self, mode):
+        if mode not in SPI_MODES:
+            raise ValueError(f'SPI mode must be one of {SPI_MODES}')
+        self._mode = mode
+
+    @property
+    def block(self):
+        """ Return the maximum number of bytes per frame """
+        capabilities = self.arduino.capabilities
+        return (capabilities.get('spi_block') if capabilities else None) or SPI_BLOCK
+
+    def _frames(self, command, data):
+        """ Return the spi messages of one exchange of <data> """
+        data = memoryview(data).cast('B')
+        block = self.block
+        frames = []
+        for offset in range(0, len(data), block):
+            chunk = data[offset:offset + block]
+            flags = (SPI_BEGIN if offset == 0 else 0) | \
+                (SPI_END if offset + block >= len(data) else 0)
+            # A single frame is begin and end, that is the default
+            flags = f',{flags}' if flags != SPI_BEGIN | SPI_END else ''
+            frames.append(f'<X{command}{self.num:02d}{self.cs:03d}:{self.clock},{self.mode},'
+                          f'{len(chunk)},{chunk.hex()}{flags}>')
+        return frames
+
+    def _value(self, reply):
+        """ Return the value of a reply or raise BusError """
+        value = reply.split('%')[-1] if isinstance(reply, str) else ''
+        if value == '-1' or not reply:
+            raise BusError(f'SPI transfer on bus {self.num} failed: {reply!r}')
+        return value
+
+    def transfer(self, data):
+        """ Shift <data> out and return the bytes shifted in """
+        self.arduino.require('XT')
+        res = bytearray()
+        for reply in self.arduino.send_batch(self._frames('T', data)):
+            try:
+                res += bytes.fromhex(self._value(reply))
+            except ValueError as exc:
+                raise BusError(f'Invalid reply from SPI bus {self.num}: {reply}') from exc
+        return bytes(res)
+
+    def write(self, data):
+        """ Shift <data> out and return the number of bytes written """
+        self.arduino.require('XW')
+        return sum(int(self._value(reply))
+                   for reply in self.arduino.send_batch(self._frames('W', data)))
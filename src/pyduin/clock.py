@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  clock.py
+#
+"""
+    Clock module. Maps the device clock (micros(), 32 bit, wraps after
+    ~71 minutes) to time.monotonic() of the host. Offset and drift are
+    fitted to NTP style exchanges: the device time is taken to be in the
+    middle of the round trip, only the exchange with the shortest round
+    trip of each stretch of time is used. The drift is only fitted, once
+    the exchanges span MIN_BASELINE seconds; over shorter spans the jitter
+    of the round trips outweighs it.
+"""
+import math
+
+WRAP = 2 ** 32
+# Exchanges kept for the fit
+MAX_POINTS = 64
+# Share of the exchanges used for the fit: the exchanges are split into this
+# share of stretches of time, the one with the shortest round trip of each is used
+FASTEST = 0.5
+# Seconds the exchanges must span, before the drift is fitted (offset only before)
+MIN_BASELINE = 5.0
+
+
+class ClockSync:
+    """
+        Offset and drift of a device clock. host = offset + device * (1 + drift),
+        device in seconds since the first exchange (with wraps of micros() undone).
+    """
+
+    def __init__(self):
+        # (device seconds, host time in the middle of the round trip, round trip)
+        self.points = []
+        self.offset = None
+        self.drift = 0.0
+        self.rtt = None
+        self._ref_us = None
+        self._ref = 0.0
+
+    @property
+    def synced(self):
+        """ Return True, if offset and drift were fitted """
+        return self.offset is not None
+
+    def device_seconds(self, device_us):
+        """
+            Return the device time <device_us> (micros(), also as NumPy array)
+            in seconds since the first exchange. Wraps are undone relative to
+            the last exchange, so times must be within ~35 minutes of it.
+        """
+        delta = (device_us - self._ref_us + WRAP // 2) % WRAP - WRAP // 2
+        return self._ref + delta / 1e6
+
+    def add(self, device_us, before, after):
+        """ Add an exchange: <device_us> was read between host times <before> and <after> """
+        if self._ref_us is None:
+            self._ref_us = device_us
+        device = self.device_seconds(device_us)
+        self._ref_us, self._ref = device_us, device
+        self.points.append((device, (before + after) / 2, after - before))
+        del self.points[:-MAX_POINTS]
+
+    def fit(self):
+        """
+            Fit offset and drift (least squares) to the exchanges with the
+            shortest round trips, one per stretch of time, so the fit keeps
+            the whole span. Below MIN_BASELINE, only the offset is fitted.
+        """
+        if not self.points:
+            raise ValueError('No exchanges to fit the clock to')
+        exchanges = sorted(self.points)
+        count = len(exchanges)
+        stretches = max(min(count, 2), math.ceil(count * FASTEST))
+        points = [min(exchanges[num * count // stretches:(num + 1) * count // stretches],
+                      key=lambda point: point[2])[:2] for num in range(stretches)]
+        mean_device = sum(device for device, _host in points) / len(points)
+        mean_host = sum(host for _device, host in points) / len(points)
+        slope = 1.0
+        if exchanges[-1][0] - exchanges[0][0] >= MIN_BASELINE:
+            var = sum((device - mean_device) ** 2 for device, _host in points)
+            slope = sum((device - mean_device) * (host - mean_host)
+                        for device, host in points) / var if var else 1.0
+        self.drift = slope - 1
+        self.offset = mean_host - slope * mean_device
+        self.rtt = min(rtt for _device, _host, rtt in exchanges)
+        return self
+
+    def to_host(self, device_us):
+        """ Return the host time (time.monotonic()) of the device time <device_us> """
+        return self.offset + self.device_seconds(device_us) * (1 + self.drift)
+
+    def as_dict(self):
+        """ Return offset, drift, shortest round trip and number of exchanges """
+        return {'offset': self.offset, 'drift': self.drift, 'rtt': self.rtt,
+                'exchanges': len(self.points)}
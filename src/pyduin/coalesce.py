@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  coalesce.py
+#
+"""
+    Coalescing writer. Output updates (pwm, high, low) that come in faster
+    than the serial link can carry them are merged: only the latest value
+    per pin is sent, superseded ones are dropped. Output latency stays
+    bounded instead of growing with the backlog.
+"""
+import threading
+import time
+import weakref
+
+import serial
+
+from pyduin.utils import ReplyTimeoutError, UnsupportedOperationError
+
+# Flushes per second
+COALESCE_RATE = 50
+
+
+class CoalescingWriter:  # pylint: disable=too-many-instance-attributes
+    """
+        Holds the latest pending output per pin of <arduino>. Pending
+        outputs are sent as one pipelined batch, when the previous batch
+        was answered (the link is free), but at most <rate> times per
+        second. Use start() to flush from a background thread or call
+        flush() yourself.
+
+        Reads through the writer are not coalesced. They are sent after
+        the pending outputs, in the order they were issued.
+    """
+
+    def __init__(self, arduino, rate=COALESCE_RATE, timeout=None):
+        self.arduino = weakref.proxy(arduino)
+        self.rate = rate
+        self.timeout = timeout
+        self.pending = {}
+        self.counters = {'queued': 0, 'dropped': 0, 'sent': 0, 'flushes': 0}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_flush = 0.0
+
+    def put(self, key, message):
+        """ Queue <message> as output <key>. A pending output of <key> is dropped. """
+        with self._lock:
+            if key in self.pending:
+                self.counters['dropped'] += 1
+            self.pending[key] = message
+            self.counters['queued'] += 1
+        self._wakeup.set()
+
+    def write(self, pin, action, value=0):
+        """ Queue <action> (high, low, pwm) with <value> for <pin> """
+        pin = self.arduino.get_pin(pin)
+        if action not in ('high', 'low', 'pwm'):
+            raise ValueError(f'Only outputs can be coalesced, not {action}')
+        if action == 'pwm' and not pin.pwm_capable:
+            raise UnsupportedOperationError(f'Pin {pin.pin_id} is not pwm capable')
+        # Restored after a reset like outputs sent directly
+        pin.output = pin.frame(action, value).encode('utf-8')
+        self.put(pin.pin_id, pin.output)
+
+    def pwm(self, pin, value):
+        """ Queue the pwm <value> for <pin> """
+        self.write(pin, 'pwm', value)
+
+    def flush(self):
+        """ Send the pending outputs now. Return their replies by key. """
+        with self.arduino.lock:
+            with self._lock:
+                batch, self.pending = self.pending, {}
+            if not batch:
+                return {}
+            self._last_flush = time.monotonic()
+            try:
+                replies = self.arduino.send_batch(list(batch.values()), self.timeout)
+            except (serial.SerialException, OSError, ReplyTimeoutError):
+                # Keep the outputs, unless newer ones came in meanwhile.
+                with self._lock:
+                    self.pending = {**batch, **self.pending}
+                raise
+        self.counters['sent'] += len(batch)
+        self.counters['flushes'] += 1
+        return dict(zip(batch, replies))
+
+    def read(self, pin, timeout=None):
+        """ Send the pending outputs, then read <pin> """
+        with self.arduino.lock:
+            self.flush()
+            return self.arduino.get_pin(pin).read(timeout=timeout)
+
+    def stats(self):
+        """ Return the queued, dropped and sent outputs and the number of flushes """
+        return dict(self.counters, pending=len(self.pending))
+
+    def _run(self):
+        """ Flush pending outputs until stop() is called """
+        while not self._stop.is_set():
+            self._wakeup.wait()
+            self._wakeup.clear()
+            wait = self._last_flush + 1 / self.rate - time.monotonic()
+            if wait > 0 and self._stop.wait(wait):
+                break
+            try:
+                self.flush()
+            except (serial.SerialException, OSError, ReplyTimeoutError) as error:
+                self.arduino.logger.warning('Flushing outputs failed: %s', error)
+                self._wakeup.set()
+
+    def start(self):
+        """ Flush from a background thread until stop() is called """
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def stop(self):
+        """ Stop the background thread and send what is pending """
+        thread, self._thread = self._thread, None
+        self._stop.set()
+        self._wakeup.set()
+        if thread:
+            thread.join()
+        self.flush()
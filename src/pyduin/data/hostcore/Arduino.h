@@ -0,0 +1,102 @@
+//  Stub of the Arduino core to build the pyduin firmware for the host.
+//  Serial is a pseudo terminal, pins live in memory (see core.cpp).
+#pragma once
+#include <math.h>
+#include <stddef.h>
+#include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
+#include <string>
+
+typedef uint8_t byte;
+typedef bool boolean;
+
+#define HIGH 1
+#define LOW 0
+#define INPUT 0
+#define OUTPUT 1
+#define INPUT_PULLUP 2
+#define DEC 10
+#define HEX 16
+#define PROGMEM
+#define F(x) (x)
+#define pgm_read_byte(x) (*(const uint8_t *)(x))
+
+#define NUM_DIGITAL_PINS 72
+#define NOT_A_PORT 0
+#define SERIAL_RX_BUFFER_SIZE 64
+
+unsigned long millis();
+unsigned long micros();
+void delay(unsigned long ms);
+void delayMicroseconds(unsigned int us);
+
+void pinMode(uint8_t pin, uint8_t mode);
+int digitalRead(uint8_t pin);
+void digitalWrite(uint8_t pin, uint8_t value);
+int analogRead(uint8_t pin);
+void analogWrite(uint8_t pin, int value);
+
+uint8_t digitalPinToPort(uint8_t pin);
+uint8_t digitalPinToBitMask(uint8_t pin);
+volatile uint8_t *portModeRegister(uint8_t port);
+volatile uint8_t *portOutputRegister(uint8_t port);
+volatile uint8_t *portInputRegister(uint8_t port);
+void noInterrupts();
+void interrupts();
+
+class String {
+ public:
+  String() {}
+  String(const char *s) : s_(s) {}  // NOLINT
+  String(const std::string &s) : s_(s) {}  // NOLINT
+  String(int v) : s_(std::to_string(v)) {}  // NOLINT
+  String(long v) : s_(std::to_string(v)) {}  // NOLINT
+  String(unsigned long v) : s_(std::to_string(v)) {}  // NOLINT
+  unsigned int length() const { return s_.size(); }
+  char operator[](unsigned int i) const { return i < s_.size() ? s_[i] : 0; }
+  String substring(unsigned int from) const {
+    return from < s_.size() ? String(s_.substr(from)) : String();
+  }
+  String substring(unsigned int from, unsigned int to) const {
+    return from < s_.size() && from < to ? String(s_.substr(from, to - from)) : String();
+  }
+  long toInt() const { return atol(s_.c_str()); }
+  const char *c_str() const { return s_.c_str(); }
+  String operator+(const String &other) const { return String(s_ + other.s_); }
+  bool operator==(const String &other) const { return s_ == other.s_; }
+
+ private:
+  std::string s_;
+};
+
+class HardwareSerial {
+ public:
+  void begin(unsigned long baudrate);
+  void end() {}
+  int available();
+  int read();
+  int peek();
+  void flush() {}
+  void setTimeout(unsigned long timeout) { timeout_ = timeout; }
+  String readStringUntil(char terminator);
+  size_t write(uint8_t c);
+  size_t write(const uint8_t *buf, size_t n);
+  size_t print(const String &s) { return print(s.c_str()); }
+  size_t print(const char *s) { return write(reinterpret_cast<const uint8_t *>(s), strlen(s)); }
+  size_t print(char c) { return write(c); }
+  size_t print(int v, int base = DEC) { return print(static_cast<long>(v), base); }
+  size_t print(unsigned int v, int base = DEC) { return print(static_cast<unsigned long>(v), base); }
+  size_t print(long v, int base = DEC);
+  size_t print(unsigned long v, int base = DEC);
+  size_t print(double v, int digits = 2);
+  size_t println() { return print("\r\n"); }
+  template <typename T> size_t println(T v) { return print(v) + println(); }
+  template <typename T> size_t println(T v, int arg) { return print(v, arg) + println(); }
+  operator bool() { return true; }
+
+ private:
+  unsigned long timeout_ = 1000;
+};
+
+extern HardwareSerial Serial;
@@ -0,0 +1,11 @@
+#pragma once
+#include <Arduino.h>
+
+// A sensor with constant readings
+class DHT {
+ public:
+  DHT(uint8_t pin, uint8_t type) {}
+  void begin() {}
+  float readHumidity() { return 40.0; }
+  float readTemperature() { return 21.5; }
+};
@@ -0,0 +1,14 @@
+#pragma once
+#include <OneWire.h>
+
+typedef uint8_t DeviceAddress[8];
+
+// A single sensor with a constant reading
+class DallasTemperature {
+ public:
+  explicit DallasTemperature(OneWire *wire) {}
+  bool getAddress(uint8_t *address, uint8_t index) { return index == 0; }
+  void setResolution(uint8_t *address, uint8_t resolution) {}
+  void requestTemperatures() {}
+  float getTempCByIndex(uint8_t index) { return 21.5; }
+};
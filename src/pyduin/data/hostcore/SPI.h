@@ -0,0 +1,26 @@
+#pragma once
+#include <Arduino.h>
+
+#define MSBFIRST 1
+#define SPI_MODE0 0x00
+#define SPI_MODE1 0x04
+#define SPI_MODE2 0x08
+#define SPI_MODE3 0x0C
+
+class SPISettings {
+ public:
+  SPISettings() {}
+  SPISettings(uint32_t clock, uint8_t order, uint8_t mode) {}
+};
+
+// MISO is wired to MOSI: every byte is shifted back in.
+class SPIClass {
+ public:
+  void begin() {}
+  void beginTransaction(SPISettings settings) {}
+  uint8_t transfer(uint8_t data) { return data; }
+  void transfer(void *buf, size_t n) {}
+  void endTransaction() {}
+};
+
+extern SPIClass SPI;
@@ -0,0 +1,19 @@
+#pragma once
+#include <Arduino.h>
+
+#define BUFFER_LENGTH 32
+
+// The bus has one device: a 256 byte EEPROM (24C02) at address 0x50.
+class TwoWire {
+ public:
+  void begin() {}
+  void setClock(uint32_t clock) {}
+  void beginTransmission(uint8_t address);
+  size_t write(uint8_t data);
+  uint8_t endTransmission(bool stop = true);
+  uint8_t requestFrom(uint8_t address, uint8_t count, uint8_t stop = true);
+  int available();
+  int read();
+};
+
+extern TwoWire Wire;
@@ -0,0 +1,282 @@
+//  Runtime of the stub Arduino core. Serial is the master side of a pseudo
+//  terminal, whose name is printed as first line to stdout. Pins are kept
+//  in memory: digital pins in 8 bit port registers (pin p is bit p % 8 of
+//  port p / 8 + 1), analog values in an array shared by analogWrite() and
+//  analogRead(). Pins never written read a ramp of micros() % 1024, so
+//  analog captures see a signal. The I2C bus has a 256 byte EEPROM at 0x50, MISO of the SPI
+//  bus is wired to MOSI.
+#include <Arduino.h>
+#include <MemoryFree.h>
+#include <SPI.h>
+#include <Wire.h>
+#include <errno.h>
+#include <fcntl.h>
+#include <poll.h>
+#include <stdio.h>
+#include <termios.h>
+#include <time.h>
+#include <unistd.h>
+
+#define NUM_PORTS (NUM_DIGITAL_PINS / 8 + 1)
+#define EEPROM_ADDRESS 0x50
+#define WRITE_TIMEOUT 100
+
+HardwareSerial Serial;
+TwoWire Wire;
+SPIClass SPI;
+
+void setup();
+void loop();
+
+static int master = -1;
+static std::string input;
+static struct timespec started;
+
+static volatile uint8_t mode_registers[NUM_PORTS + 1];
+static volatile uint8_t output_registers[NUM_PORTS + 1];
+static int analog_values[NUM_DIGITAL_PINS];
+static bool analog_written[NUM_DIGITAL_PINS];
+
+
+// time
+
+static unsigned long elapsed_us() {
+  struct timespec now;
+  clock_gettime(CLOCK_MONOTONIC, &now);
+  return (now.tv_sec - started.tv_sec) * 1000000UL +
+      (now.tv_nsec - started.tv_nsec) / 1000;
+}
+
+unsigned long millis() { return elapsed_us() / 1000; }
+
+unsigned long micros() { return elapsed_us(); }
+
+void delay(unsigned long ms) { usleep(ms * 1000); }
+
+void delayMicroseconds(unsigned int us) { usleep(us); }
+
+
+// pins
+
+uint8_t digitalPinToPort(uint8_t pin) {
+  return pin < NUM_DIGITAL_PINS ? pin / 8 + 1 : NOT_A_PORT;
+}
+
+uint8_t digitalPinToBitMask(uint8_t pin) { return 1 << (pin % 8); }
+
+volatile uint8_t *portModeRegister(uint8_t port) { return &mode_registers[port]; }
+
+volatile uint8_t *portOutputRegister(uint8_t port) { return &output_registers[port]; }
+
+// Nothing drives the pins from outside, inputs read back the output latch.
+volatile uint8_t *portInputRegister(uint8_t port) { return &output_registers[port]; }
+
+void noInterrupts() {}
+
+void interrupts() {}
+
+void pinMode(uint8_t pin, uint8_t mode) {
+  uint8_t port = digitalPinToPort(pin);
+  uint8_t bit = digitalPinToBitMask(pin);
+  if (port == NOT_A_PORT) return;
+  if (mode == OUTPUT) {
+    mode_registers[port] |= bit;
+    return;
+  }
+  mode_registers[port] &= ~bit;
+  if (mode == INPUT_PULLUP) {
+    output_registers[port] |= bit;
+  } else {
+    output_registers[port] &= ~bit;
+  }
+}
+
+void digitalWrite(uint8_t pin, uint8_t value) {
+  uint8_t port = digitalPinToPort(pin);
+  if (port == NOT_A_PORT) return;
+  if (value) {
+    output_registers[port] |= digitalPinToBitMask(pin);
+  } else {
+    output_registers[port] &= ~digitalPinToBitMask(pin);
+  }
+}
+
+int digitalRead(uint8_t pin) {
+  uint8_t port = digitalPinToPort(pin);
+  if (port == NOT_A_PORT) return LOW;
+  return (output_registers[port] & digitalPinToBitMask(pin)) ? HIGH : LOW;
+}
+
+void analogWrite(uint8_t pin, int value) {
+  if (pin < NUM_DIGITAL_PINS) {
+    analog_values[pin] = value;
+    analog_written[pin] = true;
+  }
+  digitalWrite(pin, value >= 128);
+}
+
+int analogRead(uint8_t pin) {
+  if (pin >= NUM_DIGITAL_PINS) return 0;
+  return analog_written[pin] ? analog_values[pin] : micros() % 1024;
+}
+
+int freeMemory() { return 2048; }
+
+
+// serial
+
+static void receive(int timeout) {
+  struct pollfd fds = {master, POLLIN, 0};
+  if (poll(&fds, 1, timeout) <= 0) return;
+  char buf[256];
+  ssize_t n = read(master, buf, sizeof(buf));
+  if (n > 0) input.append(buf, n);
+}
+
+void HardwareSerial::begin(unsigned long baudrate) {}
+
+int HardwareSerial::available() {
+  if (input.empty()) receive(0);
+  return input.size();
+}
+
+int HardwareSerial::read() {
+  if (!available()) return -1;
+  uint8_t c = input[0];
+  input.erase(0, 1);
+  return c;
+}
+
+int HardwareSerial::peek() {
+  return available() ? static_cast<uint8_t>(input[0]) : -1;
+}
+
+String HardwareSerial::readStringUntil(char terminator) {
+  unsigned long deadline = millis() + timeout_;
+  size_t end;
+  while ((end = input.find(terminator)) == std::string::npos) {
+    long remaining = static_cast<long>(deadline - millis());
+    if (remaining <= 0) {
+      String res(input);
+      input.clear();
+      return res;
+    }
+    receive(remaining);
+  }
+  String res(input.substr(0, end));
+  input.erase(0, end + 1);
+  return res;
+}
+
+size_t HardwareSerial::write(uint8_t c) { return write(&c, 1); }
+
+size_t HardwareSerial::write(const uint8_t *buf, size_t n) {
+  // Like a real UART, output is dropped if nobody reads it.
+  size_t written = 0;
+  while (written < n) {
+    ssize_t res = ::write(master, buf + written, n - written);
+    if (res > 0) {
+      written += res;
+      continue;
+    }
+    struct pollfd fds = {master, POLLOUT, 0};
+    if (res < 0 && errno != EAGAIN) break;
+    if (poll(&fds, 1, WRITE_TIMEOUT) <= 0) break;
+  }
+  return n;
+}
+
+size_t HardwareSerial::print(long v, int base) {
+  char buf[24];
+  snprintf(buf, sizeof(buf), base == HEX ? "%lX" : "%ld", v);
+  return print(buf);
+}
+
+size_t HardwareSerial::print(unsigned long v, int base) {
+  char buf[24];
+  snprintf(buf, sizeof(buf), base == HEX ? "%lX" : "%lu", v);
+  return print(buf);
+}
+
+size_t HardwareSerial::print(double v, int digits) {
+  char buf[32];
+  snprintf(buf, sizeof(buf), "%.*f", digits, v);
+  return print(buf);
+}
+
+
+// i2c
+
+static uint8_t eeprom[256];
+static uint8_t eeprom_pointer = 0;
+static uint8_t wire_address;
+static bool wire_addressed;
+static std::string wire_rx;
+
+void TwoWire::beginTransmission(uint8_t address) {
+  wire_address = address;
+  wire_addressed = false;
+}
+
+size_t TwoWire::write(uint8_t data) {
+  if (wire_address != EEPROM_ADDRESS) return 1;
+  if (!wire_addressed) {
+    eeprom_pointer = data;
+    wire_addressed = true;
+  } else {
+    eeprom[eeprom_pointer++] = data;
+  }
+  return 1;
+}
+
+uint8_t TwoWire::endTransmission(bool stop) {
+  // 2: NACK on the address
+  return wire_address == EEPROM_ADDRESS ? 0 : 2;
+}
+
+uint8_t TwoWire::requestFrom(uint8_t address, uint8_t count, uint8_t stop) {
+  wire_rx.clear();
+  if (address != EEPROM_ADDRESS) return 0;
+  for (uint8_t j = 0; j < count; j++) {
+    wire_rx += static_cast<char>(eeprom[eeprom_pointer++]);
+  }
+  return count;
+}
+
+int TwoWire::available() { return wire_rx.size(); }
+
+int TwoWire::read() {
+  if (wire_rx.empty()) return -1;
+  uint8_t c = wire_rx[0];
+  wire_rx.erase(0, 1);
+  return c;
+}
+
+
+int main() {
+  clock_gettime(CLOCK_MONOTONIC, &started);
+  master = posix_openpt(O_RDWR | O_NOCTTY | O_NONBLOCK);
+  if (master < 0 || grantpt(master) != 0 || unlockpt(master) != 0) {
+    perror("posix_openpt");
+    return 1;
+  }
+  // Keep the slave side open, so the pty survives clients closing it.
+  int slave = open(ptsname(master), O_RDWR | O_NOCTTY);
+  struct termios tio;
+  if (slave < 0 || tcgetattr(slave, &tio) != 0) {
+    perror(ptsname(master));
+    return 1;
+  }
+  cfmakeraw(&tio);
+  tcsetattr(slave, TCSANOW, &tio);
+  // Boot before the tty is announced. Clients discard the queued banner
+  // when they open the port, instead of taking it for a reset.
+  setup();
+  printf("%s\n", ptsname(master));
+  fflush(stdout);
+
+  while (true) {
+    receive(1);
+    loop();
+  }
+}
@@ -1,16 +1,31 @@
 // Copyright 2023 Steffen Kockel info@steffen-kockel.de
 // License MIT
 {{ extra_libs }}
-#include <DHT.h>
 #include <string.h>
+{% if 'dht' in features %}
+#include <DHT.h>
+{% endif %}
+{% if 'onewire' in features %}
 #include <OneWire.h>
-#include <Wire.h>
 #include <DallasTemperature.h>
+{% endif %}
+{% if 'i2c' in features %}
+#include <Wire.h>
+{% endif %}
+{% if 'spi' in features %}
+#include <SPI.h>
+{% endif %}
+{% if 'free_memory' in features %}
 #include <MemoryFree.h>
+{% endif %}
 
+#ifndef BUFFER_LENGTH
+#define BUFFER_LENGTH 32
+#endif
 
-// command
-// String s;
+#ifndef SERIAL_RX_BUFFER_SIZE
+#define SERIAL_RX_BUFFER_SIZE 64
+#endif
 
 
 // command (byte 1)
@@ -24,6 +39,11 @@
 //
 // z - memory usage
 // v - version
+// b - switch baudrate (value: index into baudrates[])
+// k - confirm the current baudrate
+// e - echo value (link test)
+// d - describe firmware capabilities
+// t - device time (micros())
 // Pin (byte 3,4)
 // 01-13 - digital pins
 // A0-A7 (14-21) - analog pins
@@ -31,17 +51,70 @@
 // Value (byte 5,6,7)
 // 0-255 - for pwm enabled pins
 // 000-001 for digital pins in INPUT/INPUT_PULLUP/OUTPUT
+// 001 for reads - append the device time (micros()) of the reading
+//
+// Payload (optional, after byte 7)
+// :<comma separated values> - for commands that need more than one value
+//
+// P - pwm playback (pin = pwm pin)
+// R - ramp     (payload: start,end,duration_ms,curve,loop)
+// T - table    (payload: interval_ms,loop,value1,value2,...)
+// S - stop
+//
+// I - i2c (pin = bus, value = device address)
+// S - scan        (reply: hex addresses)
+// R - read        (payload: register,count, register -1 = none. reply: hex data)
+// W - write       (payload: register,hex data, register -1 = none. reply: count)
+//
+// G - pin group (payload: value,pin1,pin2,... bit n of value = pin n+1)
+// W - write       (all pins change at once through the port registers. reply: value)
+// R - read        (all pins are sampled at once. reply: value)
+//
+// X - spi (pin = bus, value = chip select pin, 0 = none)
+// T - transfer    (payload: clock,mode,count,hex data[,flags]. reply: hex data)
+// W - write       (payload: clock,mode,count,hex data[,flags]. reply: count)
+//                  flags: 1 = begin, 2 = end of the exchange (default 3). Chip
+//                  select stays asserted from the begin to the end frame.
+//
+// C - analog capture
+// B - burst       (payload: interval_us,prescaler,rows,pin1,pin2,...
+//                  reply: rows,pins,first_us,last_us followed by
+//                  rows * pins samples as uint16 little endian and a line break)
+//
+// K - macro (pin = slot)
+// D - define      (payload: frames without '<' and '>' separated by ';',
+//                  none = delete. reply: number of frames)
+// R - run         (reply: id%macro%number of frames%replies of the frames
+//                  separated by ';', -1 = no such macro)
 
 
+{% if 'dht' in features %}
 DHT *myDHT = NULL;
+{% endif %}
+{% if 'onewire' in features %}
 OneWire *myOneWire = NULL;
 DallasTemperature *myDallasTemperature = NULL;
 DeviceAddress OneWireAddr;
+{% endif %}
 
 // firmware version
-String firmware_version = "0.7.0";
+const char *firmware_version = "0.8.0";
+// hash over firmware template and board configuration
+const char build_hash[] = "{{ build_hash }}";
+// supported commands, reported by describe
+const char supported_ops[] = "{{ supported_ops }}";
 // arduino id
-int arduino_id = 0;
+int arduino_id = {{ arduino_id }};
+// baudrates the host can negotiate (keep in sync with pyduin.arduino.BAUDRATES)
+const long baudrates[] = {9600, 19200, 38400, 57600, 115200, 230400, 250000,
+                          500000, 1000000, 2000000};
+const int num_baudrates = 10;
+long current_baudrate = {{ baudrate }};
+// last confirmed baudrate. Restored, if a switch is not confirmed in time.
+long fallback_baudrate = {{ baudrate }};
+// millis() deadline for the confirmation of a baudrate switch, 0 = confirmed
+unsigned long baudrate_probation = 0;
+const unsigned long baudrate_probation_ms = 2000;
 // command
 char c;
 // pin type
@@ -50,21 +123,122 @@ char t;
 int p;
 // value
 int v;
-// input
-int i;
-// temp
 int pwmPins[{{ num_pwm_pins }}] = {{ pwm_pins }};
 int num_pwm_Pins = {{ num_pwm_pins }};
-// int analogPins[{{ num_analog_pins }}] = {{ analog_pins }};
-// int num_analog_pins = {{ num_analog_pins }};
+int analogPins[{{ num_analog_pins }}] = {{ analog_pins }};
+int num_analog_pins = {{ num_analog_pins }};
+int num_physical_pins = {{ num_physical_pins }};
 // int digitalPins[{{ num_digital_pins }}] = {{ digital_pins }};
 // int num_digital_pins = {{ num_digital_pins }};
 // int physical_pin_ids[{{ num_physical_pins }}] = {{ physical_pins }};
 // int min_pin = {{ min_pin }}
 // int max_pin = {{ max_pin }}
-String tmp;
-String pin;
-String val;
+// Pin bitmaps (bit p % 8 of byte p / 8 is set for pin p), generated from the boardfile
+#define PIN_MAP_BITS {{ pin_map_bits }}
+const uint8_t pin_map[] PROGMEM = {{ pin_map }};
+const uint8_t pwm_map[] PROGMEM = {{ pwm_map }};
+const uint8_t analog_map[] PROGMEM = {{ analog_map }};
+
+// The frame between '<' and '>' is read byte by byte into a fixed buffer
+#define MAX_FRAME 160
+char frame[MAX_FRAME + 1];
+uint8_t frame_len = 0;
+bool in_frame = false;
+// payload of the current command (after ':')
+const char *payload;
+
+{% if 'playback' in features %}
+// pwm playback
+#define MAX_WAVEFORMS 4
+#define MAX_WAVEFORM_POINTS 32
+#define CURVE_LINEAR 0
+#define CURVE_EASE_IN 1
+#define CURVE_EASE_OUT 2
+#define CURVE_TABLE 3
+
+struct Waveform {
+  int8_t pin;  // -1 = slot unused
+  uint8_t curve;
+  bool loop;
+  uint8_t start;
+  uint8_t end;
+  uint8_t num_points;
+  int16_t last;
+  unsigned long duration;  // ramp: total, table: per point (ms)
+  unsigned long started;
+  uint8_t points[MAX_WAVEFORM_POINTS];
+};
+Waveform waveforms[MAX_WAVEFORMS];
+{% endif %}
+
+{% if 'i2c' in features %}
+// i2c
+#define I2C_BLOCK BUFFER_LENGTH
+// bitmask of started i2c busses
+uint8_t i2c_started = 0;
+{% endif %}
+
+{% if 'group' in features %}
+// pin groups
+#define MAX_GROUP_PINS 16
+#define MAX_GROUP_PORTS 8
+{% endif %}
+
+{% if 'spi' in features %}
+// spi
+#define SPI_BLOCK 32
+#define SPI_BEGIN 1
+#define SPI_END 2
+bool spi_started = false;
+// chip select pin of the open exchange, -1 = none
+int spi_open = -1;
+{% endif %}
+
+{% if 'capture' in features %}
+// analog capture, samples of all pins of one burst
+#define CAPTURE_SAMPLES 256
+#define MAX_CAPTURE_PINS 8
+uint16_t capture_buffer[CAPTURE_SAMPLES];
+{% endif %}
+
+{% if 'macro' in features %}
+// macros, frames separated by ';'
+#define MAX_MACROS 4
+#define MACRO_SIZE 64
+char macros[MAX_MACROS][MACRO_SIZE + 1];
+
+
+class Reply {
+  // Replies are printed through this, so a macro can join the replies of
+  // its frames into one line. While joined, line breaks become ';'.
+ public:
+  bool joined = false;
+  template <typename T> size_t print(T v) { separate(); return Serial.print(v); }
+  template <typename T> size_t print(T v, int arg) { separate(); return Serial.print(v, arg); }
+  size_t println() {
+    if (joined) {
+      pending = true;
+      return 0;
+    }
+    pending = false;
+    return Serial.println();
+  }
+  template <typename T> size_t println(T v) { return print(v) + println(); }
+  template <typename T> size_t println(T v, int arg) { return print(v, arg) + println(); }
+
+ private:
+  bool pending = false;
+  void separate() {
+    if (pending) {
+      pending = false;
+      Serial.print(';');
+    }
+  }
+};
+Reply reply;
+{% else %}
+#define reply Serial
+{% endif %}
 //              1 2     3     4 5        6 7 8       9
 // input format < A|a|s A|D   0-21|A0-A6 001|000|255 >
 //                0     1     2 3        4 5 6       7
@@ -85,41 +259,326 @@ int getPinMode(uint8_t pin) {
 
 
 void setup() {
-  Serial.begin({{ baudrate }});
-  Serial.println("Boot complete");
+{% if 'playback' in features %}
+  for (int j = 0; j < MAX_WAVEFORMS; j++) {
+    waveforms[j].pin = -1;
+  }
+{% endif %}
+  Serial.begin(current_baudrate);
+  reply.println("Boot complete");
+}
+
+
+void print_pins(const char *name, int *pins, int num) {
+  reply.print(name);
+  reply.print("=");
+  for (int j = 0; j < num; j++) {
+    if (j) {
+      reply.print(",");
+    }
+    reply.print(pins[j]);
+  }
+  reply.print(";");
+}
+
+
+void describe() {
+  // Reply all capabilities in one line:
+  // describe%version=..;hash=..;pins=..;pwm=..;analog=..;rx=..;ops=..
+  reply.print("describe%version=");
+  reply.print(firmware_version);
+  reply.print(";hash=");
+  reply.print(build_hash);
+  reply.print(";pins=");
+  reply.print(num_physical_pins);
+  reply.print(";");
+  print_pins("pwm", pwmPins, num_pwm_Pins);
+  print_pins("analog", analogPins, num_analog_pins);
+  reply.print("rx=");
+  reply.print(SERIAL_RX_BUFFER_SIZE);
+{% if 'i2c' in features %}
+  reply.print(";i2c=");
+  reply.print(I2C_BLOCK);
+{% endif %}
+{% if 'spi' in features %}
+  reply.print(";spi=");
+  reply.print(SPI_BLOCK);
+{% endif %}
+{% if 'capture' in features %}
+  reply.print(";capture=");
+  reply.print(CAPTURE_SAMPLES);
+{% endif %}
+{% if 'macro' in features %}
+  reply.print(";macros=");
+  reply.print(MAX_MACROS);
+  reply.print(";macro=");
+  reply.print(MACRO_SIZE);
+{% endif %}
+  reply.print(";ops=");
+  reply.println(supported_ops);
+}
+
+
+void switch_baudrate(long rate) {
+  Serial.flush();
+  Serial.end();
+  current_baudrate = rate;
+  Serial.begin(current_baudrate);
+}
+
+
+void set_baudrate(int v) {
+  // The reply is sent with the old rate, so the host knows
+  // when to switch.
+  if (v < 0 || v >= num_baudrates) {
+    reply.print("baudrate");
+    reply.print("%");
+    reply.println(current_baudrate);
+    return;
+  }
+  reply.print("baudrate");
+  reply.print("%");
+  reply.println(baudrates[v]);
+  if (baudrate_probation == 0) {
+    fallback_baudrate = current_baudrate;
+  }
+  switch_baudrate(baudrates[v]);
+  baudrate_probation = millis() + baudrate_probation_ms;
+  if (baudrate_probation == 0) {
+    baudrate_probation = 1;
+  }
+}
+
+
+void check_baudrate_probation() {
+  // Fall back to the last confirmed baudrate, when the host
+  // did not confirm the new one in time.
+  if (baudrate_probation != 0 &&
+      static_cast<long>(millis() - baudrate_probation) >= 0) {
+    baudrate_probation = 0;
+    switch_baudrate(fallback_baudrate);
+  }
+}
+
+
+void invalid_command(const char *S) {
+  reply.print("Invalid command:");
+  reply.println(S);
+}
+
+
+bool has_pin(const uint8_t *map, long p) {
+  return p >= 0 && p < PIN_MAP_BITS && (pgm_read_byte(map + (p >> 3)) >> (p & 7)) & 1;
+}
+
+
+int parse_field(const char *s, int len) {
+  // Parse a fixed width decimal field like String.toInt()
+  int res = 0;
+  int j = s[0] == '-' ? 1 : 0;
+  for (; j < len && s[j] >= '0' && s[j] <= '9'; j++) {
+    res = res * 10 + s[j] - '0';
+  }
+  return s[0] == '-' ? -res : res;
+}
+
+
+int parse_values(const char *s, long *values, int max_values) {
+  // Parse up to max_values comma separated integers. Return the
+  // number of values found.
+  int n = 0;
+  char *end;
+  while (s && *s && n < max_values) {
+    values[n++] = strtol(s, &end, 10);
+    if (*end != ',') {
+      break;
+    }
+    s = end + 1;
+  }
+  return n;
+}
+
+
+int parse_hex(const char *s, uint8_t *buf, int max_bytes) {
+  // Decode a hex string into buf. Return the number of bytes.
+  int n = 0;
+  while (s && s[0] && s[1] && n < max_bytes) {
+    char digits[3] = {s[0], s[1], 0};
+    buf[n++] = strtol(digits, NULL, 16);
+    s += 2;
+  }
+  return n;
+}
+
+
+void print_hex(const uint8_t *buf, int n) {
+  for (int j = 0; j < n; j++) {
+    if (buf[j] < 16) {
+      reply.print('0');
+    }
+    reply.print(buf[j], HEX);
+  }
+}
+
+
+{% if 'playback' in features %}
+void stop_waveform(int p) {
+  for (int j = 0; j < MAX_WAVEFORMS; j++) {
+    if (waveforms[j].pin == p) {
+      waveforms[j].pin = -1;
+    }
+  }
+}
+
+
+Waveform *waveform_slot(int p) {
+  // Return the slot playing on pin p or a free one.
+  stop_waveform(p);
+  for (int j = 0; j < MAX_WAVEFORMS; j++) {
+    if (waveforms[j].pin == -1) {
+      return &waveforms[j];
+    }
+  }
+  return NULL;
+}
+
+
+int waveform_value(Waveform *w, unsigned long elapsed) {
+  if (w->curve == CURVE_TABLE) {
+    return w->points[elapsed / w->duration];
+  }
+  // position within the ramp, 0-1024
+  long f = (elapsed << 10) / w->duration;
+  if (w->curve == CURVE_EASE_IN) {
+    f = (f * f) >> 10;
+  } else if (w->curve == CURVE_EASE_OUT) {
+    f = 1024 - (((1024 - f) * (1024 - f)) >> 10);
+  }
+  return w->start + ((static_cast<long>(w->end) - w->start) * f >> 10);
 }
 
 
-void invalid_command(String S) {
-  Serial.print("Invalid command:");
-  Serial.println(S);
+void update_waveforms() {
+  // Step all playing waveforms according to millis().
+  unsigned long now = millis();
+  for (int j = 0; j < MAX_WAVEFORMS; j++) {
+    Waveform *w = &waveforms[j];
+    int8_t p = w->pin;
+    if (p == -1) {
+      continue;
+    }
+    unsigned long length = w->curve == CURVE_TABLE ?
+      w->duration * w->num_points : w->duration;
+    unsigned long elapsed = now - w->started;
+    int value;
+    if (elapsed >= length) {
+      if (w->loop) {
+        w->started += length * (elapsed / length);
+        elapsed = now - w->started;
+        value = waveform_value(w, elapsed);
+      } else {
+        value = w->curve == CURVE_TABLE ? w->points[w->num_points - 1] : w->end;
+        w->pin = -1;
+      }
+    } else {
+      value = waveform_value(w, elapsed);
+    }
+    if (value != w->last) {
+      analogWrite(p, value);
+      w->last = value;
+    }
+  }
 }
+{% endif %}
 
 
 void pwm(int p, int v) {
   // analog sensor/actor (PWM) WRITE
   // Check, if we really have a PWM capable
   // pin here.
-  for (int j = 0; j < num_pwm_Pins; j++) {
-    if (pwmPins[j] == p) {
-      analogWrite(p, v);
-      // Serial.println(v);
+  if (has_pin(pwm_map, p)) {
+{% if 'playback' in features %}
+    stop_waveform(p);
+{% endif %}
+    analogWrite(p, v);
+  }
+}
+
+
+{% if 'playback' in features %}
+void playback(char t, int p) {
+  long values[MAX_WAVEFORM_POINTS + 2];
+  int n = parse_values(payload, values, MAX_WAVEFORM_POINTS + 2);
+  Waveform *w = NULL;
+  if (t == 'S') {
+    stop_waveform(p);
+    reply.println(0);
+    return;
+  }
+  bool valid = has_pin(pwm_map, p) && ((t == 'R' && n == 5 && values[2] > 0) ||
+                                 (t == 'T' && n >= 3 && values[0] > 0));
+  if (valid) {
+    w = waveform_slot(p);
+  }
+  if (w == NULL) {
+    reply.println(-1);
+    return;
+  }
+  if (t == 'R') {
+    w->start = values[0];
+    w->end = values[1];
+    w->duration = values[2];
+    w->curve = values[3] < CURVE_TABLE ? values[3] : CURVE_LINEAR;
+    w->loop = values[4];
+    w->num_points = 0;
+  } else {
+    w->duration = values[0];
+    w->loop = values[1];
+    w->curve = CURVE_TABLE;
+    w->num_points = n - 2;
+    for (int j = 0; j < w->num_points; j++) {
+      w->points[j] = values[j + 2];
     }
   }
+  w->last = -1;
+  w->started = millis();
+  w->pin = p;
+  reply.println(t == 'R' ? w->start : w->num_points);
+}
+{% endif %}
+
+void print_reading(int value, unsigned long at, int v) {
+  // value, with v == 1 followed by %<micros() of the reading>
+  if (v != 1) {
+    reply.println(value);
+    return;
+  }
+  reply.print(value);
+  reply.print('%');
+  reply.println(at);
 }
 
+
 void analog_actor_sensor(char c, char t,  int p, int v) {
+  if (!has_pin(c == 'A' && t == 'R' ? analog_map : pin_map, p)) {
+    reply.println(-1);
+    return;
+  }
+  unsigned long now = micros();
   switch (c) {
     // analog actor/sensor
     case 'A':
       switch (t) {
         case 'R':
           // analog sensor/actor READ
-          Serial.println(analogRead(p));
+          print_reading(analogRead(p), now, v);
           break;
         case 'W':
           pwm(p, v);
-          Serial.println(v);
+          reply.println(v);
+          break;
+        default:
+          reply.println(-1);
           break;
       }
       break;
@@ -128,13 +587,16 @@ void analog_actor_sensor(char c, char t,  int p, int v) {
       // digital actor/sensor READ
       switch (t) {
         case 'R':
-          Serial.println(digitalRead(p));
+          print_reading(digitalRead(p), now, v);
           break;
         case 'W':
           digitalWrite(p, v);
-          // Serial.print(p);
-          // Serial.println(v);
-          Serial.println(digitalRead(p));
+          // reply.print(p);
+          // reply.println(v);
+          reply.println(digitalRead(p));
+          break;
+        default:
+          reply.println(-1);
           break;
       }
       break;
@@ -142,6 +604,7 @@ void analog_actor_sensor(char c, char t,  int p, int v) {
 }
 
 
+{% if 'onewire' in features %}
 void onewire(int p, int v) {
   myOneWire = new OneWire(p);
   delay(200);
@@ -152,14 +615,16 @@ void onewire(int p, int v) {
   myDallasTemperature->setResolution(OneWireAddr, 9);
   // myDallasTemperature->setResolution(OneWireAddr, 12);
   myDallasTemperature->requestTemperatures();
-  Serial.print(v);
-  Serial.print("%");
-  Serial.println(myDallasTemperature->getTempCByIndex(v));
+  reply.print(v);
+  reply.print("%");
+  reply.println(myDallasTemperature->getTempCByIndex(v));
   delete myOneWire;
   delete myDallasTemperature;
 }
+{% endif %}
 
 
+{% if 'dht' in features %}
 void dhtsensor(int p, int v) {
   myDHT = new DHT(p, v);
   // delay(2000);
@@ -170,104 +635,542 @@ void dhtsensor(int p, int v) {
   float temp = myDHT->readTemperature();
   // Check if any reads failed and exit early (to try again).
   if (isnan(hum) || isnan(temp)) {
-    Serial.println("Failed to read from DHT sensor!");
+    reply.println("Failed to read from DHT sensor!");
     delete myDHT;
     return;
   }
-  Serial.print(hum);
-  Serial.print(":");
-  Serial.println(temp);
+  reply.print(hum);
+  reply.print(":");
+  reply.println(temp);
   delete myDHT;
 }
+{% endif %}
+
+
+{% if 'i2c' in features %}
+TwoWire *i2c_bus(int bus) {
+  // Return the i2c bus with the given number and start it on first use.
+  TwoWire *wire = NULL;
+  if (bus == 0) {
+    wire = &Wire;
+  }
+#if defined(WIRE_INTERFACES_COUNT) && WIRE_INTERFACES_COUNT > 1
+  if (bus == 1) {
+    wire = &Wire1;
+  }
+#endif
+  if (wire != NULL && !(i2c_started & (1 << bus))) {
+    wire->begin();
+    i2c_started |= 1 << bus;
+  }
+  return wire;
+}
+
+
+void i2c(char t, int bus, int address) {
+  TwoWire *wire = i2c_bus(bus);
+  uint8_t buf[I2C_BLOCK];
+  char *data;
+  int n = 0;
+  long reg = payload ? strtol(payload, &data, 10) : -1;
+  if (wire == NULL) {
+    reply.println(-1);
+    return;
+  }
+  switch (t) {
+    case 'S':
+      for (uint8_t addr = 1; addr < 127 && n < I2C_BLOCK; addr++) {
+        wire->beginTransmission(addr);
+        if (wire->endTransmission() == 0) {
+          buf[n++] = addr;
+        }
+      }
+      print_hex(buf, n);
+      reply.println();
+      return;
+    case 'R':
+      n = payload && *data == ',' ? strtol(data + 1, NULL, 10) : 0;
+      if (n <= 0 || n > I2C_BLOCK) {
+        break;
+      }
+      if (reg >= 0) {
+        wire->beginTransmission(address);
+        wire->write(static_cast<uint8_t>(reg));
+        if (wire->endTransmission(false) != 0) {
+          break;
+        }
+      }
+      if (wire->requestFrom(static_cast<uint8_t>(address),
+                            static_cast<uint8_t>(n)) != n) {
+        break;
+      }
+      for (int j = 0; j < n; j++) {
+        buf[j] = wire->read();
+      }
+      print_hex(buf, n);
+      reply.println();
+      return;
+    case 'W':
+      n = payload && *data == ',' ? parse_hex(data + 1, buf, I2C_BLOCK) : 0;
+      wire->beginTransmission(address);
+      if (reg >= 0) {
+        wire->write(static_cast<uint8_t>(reg));
+      }
+      for (int j = 0; j < n; j++) {
+        wire->write(buf[j]);
+      }
+      if (wire->endTransmission() != 0) {
+        break;
+      }
+      reply.println(n);
+      return;
+  }
+  reply.println(-1);
+}
+{% endif %}
+
+
+{% if 'group' in features %}
+void group(char t) {
+  // Write or read a group of pins through their port registers, so all
+  // pins of a port change (or are sampled) at the same time.
+  long values[MAX_GROUP_PINS + 1];
+  uint8_t ports[MAX_GROUP_PORTS];
+  uint8_t masks[MAX_GROUP_PORTS];
+  uint8_t bits[MAX_GROUP_PORTS];
+  int num_ports = 0;
+  int n = parse_values(payload, values, MAX_GROUP_PINS + 1);
+  if (n < 2 || (t != 'W' && t != 'R')) {
+    reply.println(-1);
+    return;
+  }
+  for (int j = 0; j < MAX_GROUP_PORTS; j++) {
+    masks[j] = bits[j] = 0;
+  }
+  // collect the bits to set and clear per port
+  for (int j = 1; j < n; j++) {
+    uint8_t port = has_pin(pin_map, values[j]) ?
+      digitalPinToPort(values[j]) : NOT_A_PORT;
+    int k = 0;
+    while (k < num_ports && ports[k] != port) {
+      k++;
+    }
+    if (port == NOT_A_PORT || k == MAX_GROUP_PORTS) {
+      reply.println(-1);
+      return;
+    }
+    ports[k] = port;
+    num_ports = k == num_ports ? num_ports + 1 : num_ports;
+    masks[k] |= digitalPinToBitMask(values[j]);
+    if ((values[0] >> (j - 1)) & 1) {
+      bits[k] |= digitalPinToBitMask(values[j]);
+    }
+  }
+  noInterrupts();
+  for (int k = 0; k < num_ports; k++) {
+    if (t == 'W') {
+      volatile uint8_t *out = portOutputRegister(ports[k]);
+      *out = (*out & ~masks[k]) | bits[k];
+    } else {
+      bits[k] = *portInputRegister(ports[k]);
+    }
+  }
+  interrupts();
+  if (t == 'R') {
+    values[0] = 0;
+    for (int j = 1; j < n; j++) {
+      int k = 0;
+      while (ports[k] != digitalPinToPort(values[j])) {
+        k++;
+      }
+      if (bits[k] & digitalPinToBitMask(values[j])) {
+        values[0] |= 1L << (j - 1);
+      }
+    }
+  }
+  reply.println(values[0]);
+}
+{% endif %}
+
+
+{% if 'spi' in features %}
+void spi_end() {
+  // Close the open exchange and release chip select
+  SPI.endTransaction();
+  if (spi_open > 0) {
+    digitalWrite(spi_open, HIGH);
+  }
+  spi_open = -1;
+}
+
+
+void spi(char t, int bus, int cs) {
+  // Shift a buffer through SPI. An exchange (one transaction, chip select
+  // asserted) spans the frames from the begin to the end flag. The count
+  // guards against truncated frames.
+  const uint8_t modes[] = {SPI_MODE0, SPI_MODE1, SPI_MODE2, SPI_MODE3};
+  uint8_t buf[SPI_BLOCK];
+  char *data = NULL;
+  long clock = payload ? strtol(payload, &data, 10) : 0;
+  long mode = clock > 0 && *data == ',' ? strtol(data + 1, &data, 10) : -1;
+  long count = mode >= 0 && *data == ',' ? strtol(data + 1, &data, 10) : 0;
+  int n = count > 0 && count <= SPI_BLOCK && *data == ',' ?
+    parse_hex(data + 1, buf, count) : 0;
+  long flags = SPI_BEGIN | SPI_END;
+  if (n > 0 && data[1 + 2 * n] == ',') {
+    flags = strtol(data + 2 + 2 * n, NULL, 10);
+  }
+  bool begin = flags & SPI_BEGIN;
+  if (bus != 0 || mode > 3 || n == 0 || n != count || (t != 'T' && t != 'W') ||
+      flags < 0 || flags > (SPI_BEGIN | SPI_END) ||
+      (cs > 0 && !has_pin(pin_map, cs)) || (!begin && spi_open != cs)) {
+    reply.println(-1);
+    return;
+  }
+  if (!spi_started) {
+    SPI.begin();
+    spi_started = true;
+  }
+  if (begin) {
+    if (spi_open >= 0) {
+      // The end of the previous exchange got lost
+      spi_end();
+    }
+    if (cs > 0) {
+      pinMode(cs, OUTPUT);
+      digitalWrite(cs, LOW);
+    }
+    SPI.beginTransaction(SPISettings(clock, MSBFIRST, modes[mode]));
+    spi_open = cs;
+  }
+  SPI.transfer(buf, n);
+  if (flags & SPI_END) {
+    spi_end();
+  }
+  if (t == 'T') {
+    print_hex(buf, n);
+    reply.println();
+  } else {
+    reply.println(n);
+  }
+}
+{% endif %}
+
+
+{% if 'capture' in features %}
+void capture(char t) {
+  // Sample the analog pins every interval_us into the buffer, then dump
+  // it in one go. Nothing else runs during the burst.
+  long values[MAX_CAPTURE_PINS + 3];
+  int n = parse_values(payload, values, MAX_CAPTURE_PINS + 3);
+  int num_pins = n - 3;
+  long rows = n > 3 ? values[2] : 0;
+  bool valid = t == 'B' && num_pins > 0 && values[0] >= 0 && rows > 0 &&
+    rows * num_pins <= CAPTURE_SAMPLES;
+  for (int j = 3; valid && j < n; j++) {
+    valid = has_pin(analog_map, values[j]);
+  }
+  if (!valid) {
+    reply.println(-1);
+    return;
+  }
+  unsigned long interval = values[0];
+#if defined(ADCSRA)
+  // ADC clock = CPU clock / prescaler (2-128). Smaller is faster, but less accurate.
+  uint8_t adcsra = ADCSRA;
+  if (values[1] > 1) {
+    uint8_t bits = 1;
+    while (bits < 7 && (1L << bits) < values[1]) {
+      bits++;
+    }
+    ADCSRA = (ADCSRA & ~7) | bits;
+  }
+#endif
+  uint16_t *sample = capture_buffer;
+  unsigned long first = micros();
+  unsigned long next = first;
+  unsigned long last = first;
+  for (long row = 0; row < rows; row++) {
+    while (static_cast<long>(micros() - next) < 0) {
+    }
+    last = micros();
+    for (int j = 3; j < n; j++) {
+      *sample++ = analogRead(values[j]);
+    }
+    next += interval;
+  }
+#if defined(ADCSRA)
+  ADCSRA = adcsra;
+#endif
+  reply.print(rows);
+  reply.print(',');
+  reply.print(num_pins);
+  reply.print(',');
+  reply.print(first);
+  reply.print(',');
+  reply.println(last);
+  // All supported controllers are little endian
+  Serial.write(reinterpret_cast<uint8_t *>(capture_buffer),
+               rows * num_pins * sizeof(uint16_t));
+  reply.println();
+}
+{% endif %}
+
+
+{% if 'macro' in features %}
+void define_macro(int slot) {
+  // Store the frames of the payload. Macros cannot run macros, captures
+  // (binary reply) or describe (';' in the reply).
+  int n = 0;
+  int len = payload ? strlen(payload) : 0;
+  bool valid = slot >= 0 && slot < MAX_MACROS && len <= MACRO_SIZE;
+  for (const char *s = payload; valid && s; n++) {
+    const char *end = strchr(s, ';');
+    int frame_size = end ? end - s : strlen(s);
+    valid = frame_size >= 7 && s[0] != 'K' && s[0] != 'C' && !(s[0] == 'z' && s[1] == 'd');
+    s = end ? end + 1 : NULL;
+  }
+  if (!valid) {
+    reply.println(-1);
+    return;
+  }
+  memcpy(macros[slot], payload ? payload : "", len + 1);
+  reply.println(n);
+}
+
+
+void run_command();
+
+
+void run_macro(int slot) {
+  // Run the frames of a macro as if they were received one by one. Their
+  // replies are joined into the one reply line of the macro.
+  const char *frames = slot >= 0 && slot < MAX_MACROS && macros[slot][0] ?
+    macros[slot] : NULL;
+  int n = 0;
+  for (const char *s = frames; s; n++) {
+    s = strchr(s, ';');
+    s = s ? s + 1 : NULL;
+  }
+  reply.print(arduino_id);
+  reply.print("%macro%");
+  reply.print(n ? n : -1);
+  reply.print("%");
+  reply.joined = true;
+  for (const char *s = frames; s;) {
+    const char *end = strchr(s, ';');
+    frame_len = end ? end - s : strlen(s);
+    memcpy(frame, s, frame_len);
+    frame[frame_len] = 0;
+    run_command();
+    s = end ? end + 1 : NULL;
+  }
+  reply.joined = false;
+  reply.println();
+}
+{% endif %}
 
 
 void pin_mode(char t, int p) {
+  if (!has_pin(pin_map, p)) {
+    reply.println(-1);
+    return;
+  }
   switch (t) {
     // input
     case 'I':
       pinMode(p, INPUT);
-      Serial.println(INPUT);
+      reply.println(INPUT);
       break;
     // pullup
     case 'P':
       pinMode(p, INPUT_PULLUP);
-      Serial.println(INPUT_PULLUP);
+      reply.println(INPUT_PULLUP);
       break;
     // output
     case 'O':
       pinMode(p, OUTPUT);
-      Serial.println(OUTPUT);
+      reply.println(OUTPUT);
       break;
     case 'R':
-      Serial.println(getPinMode(p));
+      reply.println(getPinMode(p));
+      break;
+    default:
+      reply.println(-1);
       break;
   }
 }
 
 
-void loop() {
+bool read_frame() {
+  // Feed the received bytes into the frame buffer. Return true, when a
+  // complete frame is in the buffer. Bytes outside of frames are dropped,
+  // a '<' starts over.
   while (Serial.available() > 0) {
-    i = Serial.read();
-    if (i != '<') {
-      // invalid_command(tmp);
-      break;
+    char b = Serial.read();
+    if (b == '<') {
+      in_frame = true;
+      frame_len = 0;
+    } else if (!in_frame) {
+      continue;
+    } else if (b == '>') {
+      in_frame = false;
+      frame[frame_len] = 0;
+      return true;
+    } else if (frame_len < MAX_FRAME) {
+      frame[frame_len++] = b;
+    } else {
+      in_frame = false;
+      frame[frame_len] = 0;
+      invalid_command(frame);
     }
-    tmp = Serial.readStringUntil('>');
-    if (tmp.length() != 7) {
-      invalid_command(tmp);
-      break;
+  }
+  return false;
+}
+
+
+void run_command() {
+  if (frame_len < 7 || (frame_len > 7 && frame[7] != ':')) {
+    invalid_command(frame);
+    return;
+  }
+  payload = frame_len > 8 ? frame + 8 : NULL;
+  c = frame[0];
+  t = frame[1];
+  p = parse_field(frame + 2, 2);
+  v = parse_field(frame + 4, 3);
+{% if 'macro' in features %}
+  if (c == 'K' && t == 'R') {
+    // replies with the replies of its frames
+    run_macro(p);
+    return;
+  }
+{% endif %}
+  reply.print(arduino_id);
+  reply.print('%');  // 1
+
+  // only reply pin_number if a pin is involved
+  if (c != 'z') {
+    reply.print(p);
+    reply.print("%");  // 2
+  }
+
+  switch (c) {
+    // handle special commands
+    case 'z':
+      switch (t) {
+{% if 'free_memory' in features %}
+        case 'z':
+          reply.print("free_mem");
+          reply.print("%");
+          reply.println(freeMemory());
+          break;
+{% endif %}
+        case 'v':
+          reply.print("version");
+          reply.print("%");
+          reply.println(firmware_version);
+          break;
+        case 'b':
+          set_baudrate(v);
+          break;
+        case 'k':
+          baudrate_probation = 0;
+          fallback_baudrate = current_baudrate;
+          reply.print("baudrate");
+          reply.print("%");
+          reply.println(current_baudrate);
+          break;
+        case 'e':
+          reply.print("echo");
+          reply.print("%");
+          reply.println(v);
+          break;
+        case 'd':
+          describe();
+          break;
+        case 't':
+          reply.print("time");
+          reply.print("%");
+          reply.println(micros());
+          break;
+        default:
+          reply.println(-1);
+          break;
       }
-    c = static_cast<char>(tmp[0]);
-    t = static_cast<char>(tmp[1]);
-    pin = tmp.substring(2, 4);
-    val = tmp.substring(4, 7);
-    Serial.print(arduino_id);
-    Serial.print('%');  // 1
-    p = pin.toInt();
-    v = val.toInt();
-
-    // only reply pin_number if a pin is involved
-    if (c != 'z') {
-      Serial.print(p);
-      Serial.print("%");  // 2
-    }
+      break;
+    // handle native analog and digital pins
+    case 'A':
+    case 'D':
+      analog_actor_sensor(c, t, p, v);
+      break;
+{% if 'playback' in features %}
+    // handle pwm playback
+    case 'P':
+      playback(t, p);
+      break;
+{% endif %}
+{% if 'i2c' in features %}
+    // handle i2c
+    case 'I':
+      i2c(t, p, v);
+      break;
+{% endif %}
+{% if 'group' in features %}
+    // handle pin groups
+    case 'G':
+      group(t);
+      break;
+{% endif %}
+{% if 'spi' in features %}
+    // handle spi
+    case 'X':
+      spi(t, p, v);
+      break;
+{% endif %}
+{% if 'capture' in features %}
+    // handle analog capture
+    case 'C':
+      capture(t);
+      break;
+{% endif %}
+{% if 'macro' in features %}
+    // handle macro definitions
+    case 'K':
+      define_macro(t == 'D' ? p : -1);
+      break;
+{% endif %}
+    // handle setPinMode
+    case 'M':
+      pin_mode(t, p);
+      break;
+{% if 'onewire' in features %}
+    case 'w':
+    case 'W':
+      // handle OneWire connections
+      // DallasTemperature on OneWire
+      onewire(p, v);
+      break;
+{% endif %}
+{% if 'dht' in features %}
+    case 'S':
+      // handle sensors
+      dhtsensor(p, v);
+      break;
+{% endif %}
+    default:
+      reply.println(-1);
+      break;
+  }  // main command switch
+}
 
-    switch (c) {
-      // handle special commands
-      case 'z':
-        switch (t) {
-          case 'z':
-            Serial.print("free_mem");
-            Serial.print("%");
-            Serial.println(freeMemory());
-            break;
-          case 'v':
-            Serial.print("version");
-            Serial.print("%");
-            Serial.println(firmware_version);
-            break;
-        }
-        break;
-      // handle native analog and digital pins
-      case 'A':
-      case 'D':
-        analog_actor_sensor(c, t, p, v);
-        break;
-      // handle setPinMode
-      case 'M':
-        pin_mode(t, p);
-        break;
-      case 'w':
-      case 'W':
-        // handle OneWire connections
-        // DallasTemperature on OneWire
-        onewire(p, v);
-        break;
-      case 'S':
-        // handle sensors
-        dhtsensor(p, v);
-        break;
-    }  // main command switch
-  }  // pin type switch
-}  // while serial
-  // loop
+
+void loop() {
+  check_baudrate_probation();
+{% if 'playback' in features %}
+  update_waveforms();
+{% endif %}
+  while (read_frame()) {
+    run_command();
+  }
+}
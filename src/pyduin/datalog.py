@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  datalog.py
+#
+"""
+    Data acquisition. Samples pins at a fixed rate over one held connection
+    and writes the samples to compact binary files.
+
+    A data log file starts with a header: the magic string, the header length
+    (uint32) and a JSON document describing the columns, padded to a multiple
+    of 64 bytes. The header is followed by fixed-width rows of a float64
+    timestamp (seconds since the epoch) and one int16 per pin. Failed reads
+    are stored as -1. The rows can be memory-mapped with NumPy (see load()).
+"""
+import csv
+import json
+import os
+import struct
+import threading
+import time
+
+MAGIC = b'PYDLOG'
+FORMAT_VERSION = 1
+PREAMBLE = struct.Struct('<6sI')
+ALIGNMENT = 64
+MISSING = -1
+# Buffered rows are written at least this often (seconds)
+FLUSH_INTERVAL = 1.0
+
+
+def _row_struct(num_columns):
+    """ Return the struct describing one row with <num_columns> values """
+    return struct.Struct('<d' + 'h' * num_columns)
+
+
+class ColumnarWriter:  # pylint: disable=too-many-instance-attributes
+    """
+        Writes timestamped samples to data log files. Rows are collected in
+        memory and written in batches of <batch> rows, but at least every
+        <flush_interval> seconds. With <rotate_bytes> or <rotate_seconds>
+        a new file (<name>.<index><ext>) is started, when the current one
+        exceeds the given size or age.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, path, columns, *, batch=1024, rotate_bytes=None, rotate_seconds=None,
+                 meta=None, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.columns = list(columns)
+        self.batch = batch
+        self.flush_interval = flush_interval
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.meta = meta or {}
+        self.row = _row_struct(len(self.columns))
+        self.files = []
+        self._buffer = bytearray()
+        self._pending = 0
+        self._file = None
+        self._size = 0
+        self._opened = 0
+        self._flushed = 0
+        self._open()
+
+    @property
+    def rotating(self):
+        """ Return True, if files are rotated """
+        return bool(self.rotate_bytes or self.rotate_seconds)
+
+    def header(self):
+        """ Return the encoded, padded file header """
+        desc = dict(self.meta, version=FORMAT_VERSION, columns=['time'] + self.columns,
+                    dtype=[['time', '<f8']] + [[column, '<i2'] for column in self.columns])
+        desc = json.dumps(desc).encode('utf-8')
+        length = -(-(PREAMBLE.size + len(desc) + 1) // ALIGNMENT) * ALIGNMENT
+        return PREAMBLE.pack(MAGIC, length) + desc.ljust(length - PREAMBLE.size - 1) + b'\n'
+
+    def _open(self):
+        """ Open the next file """
+        path = self.path
+        if self.rotating:
+            root, ext = os.path.splitext(self.path)
+            path = f'{root}.{len(self.files):04d}{ext}'
+        # pylint: disable=consider-using-with
+        self._file = open(path, 'wb')
+        self._size = self._file.write(self.header())
+        self._file.flush()
+        self._opened = self._flushed = time.monotonic()
+        self.files.append(path)
+
+    def append(self, timestamp, values):
+        """ Add one row of samples """
+        self._buffer += self.row.pack(timestamp, *values)
+        self._pending += 1
+        now = time.monotonic()
+        if self._pending >= self.batch or now - self._flushed >= self.flush_interval or \
+                (self.rotate_seconds and now - self._opened >= self.rotate_seconds):
+            self.flush()
+
+    def flush(self):
+        """ Write buffered rows to disk and rotate if needed """
+        if self._buffer:
+            self._size += self._file.write(self._buffer)
+            self._file.flush()
+            self._buffer = bytearray()
+            self._pending = 0
+        self._flushed = time.monotonic()
+        if (self.rotate_bytes and self._size >= self.rotate_bytes) or \
+                (self.rotate_seconds and time.monotonic() - self._opened >= self.rotate_seconds):
+            self._file.close()
+            self._open()
+
+    def close(self):
+        """ Flush and close the current file """
+        self.flush()
+        self._file.close()
+
+
+def read_header(path):
+    """ Return the header dict of a data log file and the offset of the first row """
+    with open(path, 'rb') as logfile:
+        magic, length = PREAMBLE.unpack(logfile.read(PREAMBLE.size))
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a pyduin data log')
+        header = json.loads(logfile.read(length - PREAMBLE.size))
+    return header, length
+
+
+def read_rows(path):
+    """ Iterate over the rows of a data log file without NumPy """
+    header, offset = read_header(path)
+    row = _row_struct(len(header['columns']) - 1)
+    with open(path, 'rb') as logfile:
+        logfile.seek(offset)
+        while True:
+            data = logfile.read(row.size * 1024)
+            yield from row.iter_unpack(data[:len(data) - len(data) % row.size])
+            if len(data) < row.size * 1024:
+                break
+
+
+def load(path):
+    """ Memory-map a data log file as NumPy structured array """
+    import numpy  # pylint: disable=import-outside-toplevel
+    header, offset = read_header(path)
+    dtype = numpy.dtype([tuple(column) for column in header['dtype']])
+    rows = (os.path.getsize(path) - offset) // dtype.itemsize
+    return numpy.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(rows,))
+
+
+def export_csv(path, csvpath):
+    """ Export a data log file to CSV """
+    header, _ = read_header(path)
+    with open(csvpath, 'w', encoding='utf-8', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(header['columns'])
+        writer.writerows(read_rows(path))
+    return csvpath
+
+
+def _value(reply):
+    """ Return the value of a read reply or MISSING """
+    try:
+        return int(reply.rsplit('%', 1)[-1])
+    except (AttributeError, ValueError):
+        return MISSING
+
+
+class DataLogger:  # pylint: disable=too-many-instance-attributes
+    """
+        Samples <pins> of an Arduino object at <rate> Hz. All pins of one
+        sample are read with one pipelined batch.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, arduino, pins, rate, path, *, batch=1024, rotate_bytes=None,
+                 rotate_seconds=None):
+        self.arduino = arduino
+        self.pins = [arduino.get_pin(pin) for pin in pins]
+        self.rate = rate
+        self.messages = [pin.frames['read'] for pin in self.pins]
+        self.writer = ColumnarWriter(path, [str(pin) for pin in pins], batch=batch,
+                                     rotate_bytes=rotate_bytes, rotate_seconds=rotate_seconds,
+                                     meta={'board': arduino.board, 'rate': rate})
+        self.samples = 0
+        self.overruns = 0
+        self._stop = threading.Event()
+
+    def sample(self):
+        """ Take one sample of all pins and hand it to the writer """
+        timestamp = time.time()
+        values = [_value(reply) for reply in self.arduino.send_batch(self.messages)]
+        self.writer.append(timestamp, values)
+        self.samples += 1
+
+    def run(self, duration=None, samples=None):
+        """
+            Sample until <duration> seconds passed, <samples> were taken or
+            stop() was called. Missed sample times are skipped and counted
+            as overruns.
+        """
+        interval = 1.0 / self.rate
+        start = time.monotonic()
+        tick = 0
+        try:
+            while not self._stop.is_set():
+                if samples is not None and self.samples >= samples:
+                    break
+                now = time.monotonic()
+                if duration is not None and now - start >= duration:
+                    break
+                due = start + tick * interval
+                if now < due:
+                    time.sleep(due - now)
+                elif now - due >= interval:
+                    missed = int((now - due) / interval)
+                    self.overruns += missed
+                    tick += missed
+                self.sample()
+                tick += 1
+        finally:
+            self.writer.close()
+        return self.samples
+
+    def stop(self):
+        """ Stop a running logger """
+        self._stop.set()
+
+
+def log_boards(loggers, duration=None, samples=None):
+    """ Run several DataLoggers (one per board) in parallel threads """
+    threads = [threading.Thread(target=logger.run, kwargs={'duration': duration,
+                                                           'samples': samples})
+               for logger in loggers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [logger.samples for logger in loggers]
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  discover.py
+#
+"""
+    Discover devices running the pyduin firmware. All candidate serial ports
+    are probed in parallel with a version query. The reply carries the
+    arduino_id of the device, which is used to match devices to buddies.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import serial
+from serial.tools import list_ports
+
+from pyduin.transport import LineReader
+
+PROBE = b'<zv00000>'
+BOOT_BANNER = 'Boot complete'
+# Most boards reset when the port is opened and need up to ~1.5s to boot.
+PROBE_TIMEOUT = 2.0
+
+
+def candidate_ports():
+    """ Return the device names of all serial ports of the system """
+    return sorted(port.device for port in list_ports.comports())
+
+
+def probe(port, baudrate=115200, timeout=PROBE_TIMEOUT):
+    """
+        Ask the device on <port> for its firmware version. Return a dict
+        (tty, arduino_id, version) or None, if no pyduin firmware answered
+        within <timeout> seconds.
+    """
+    deadline = time.monotonic() + timeout
+    try:
+        connection = serial.Serial(port, baudrate, timeout=timeout)
+    except (serial.SerialException, OSError):
+        return None
+    try:
+        reader = LineReader(connection)
+        connection.write(PROBE)
+        while time.monotonic() < deadline:
+            line = reader.readline(max(deadline - time.monotonic(), 0))
+            line = line.decode('utf-8', 'replace').strip()
+            if line == BOOT_BANNER:
+                # The device was reset by opening the port, ask again.
+                connection.write(PROBE)
+                continue
+            fields = line.split('%')
+            if len(fields) == 3 and fields[1] == 'version' and fields[0].isdigit():
+                return {'tty': port, 'arduino_id': int(fields[0]), 'version': fields[2]}
+    except (serial.SerialException, OSError):
+        pass
+    finally:
+        connection.close()
+    return None
+
+
+def discover(ports=None, baudrate=115200, timeout=PROBE_TIMEOUT):
+    """
+        Probe <ports> (default: all serial ports) in parallel and return the
+        devices that answered, see probe().
+    """
+    ports = candidate_ports() if ports is None else list(ports)
+    if not ports:
+        return []
+    with ThreadPoolExecutor(max_workers=len(ports)) as pool:
+        found = pool.map(lambda port: probe(port, baudrate, timeout), ports)
+    return [device for device in found if device]
+
+
+def match_buddies(devices, buddies):
+    """
+        Match discovered <devices> to <buddies> (the buddies section of the
+        config file) by arduino_id. Return a dict of buddy name -> device.
+        Buddies without arduino_id and ids found on several devices are skipped.
+    """
+    by_id = {}
+    for device in devices:
+        by_id.setdefault(device['arduino_id'], []).append(device)
+    res = {}
+    for name, buddy in (buddies or {}).items():
+        if not buddy or buddy.get('arduino_id') is None:
+            continue
+        candidates = by_id.get(int(buddy['arduino_id']), [])
+        if len(candidates) == 1:
+            res[name] = candidates[0]
+    return res
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  firmware.py
+#
+"""
+    Firmware module. Renders the firmware template for a board and builds it
+    as a native program against a stub Arduino core (data/hostcore). The host
+    build talks the serial protocol over a pseudo terminal, so an Arduino
+    object can be connected to it without hardware.
+"""
+import hashlib
+import json
+import os
+import select
+import shutil
+import subprocess
+
+from jinja2 import Template
+
+from pyduin.utils import PyduinUtils, BoardFile, DeviceConfigError
+
+utils = PyduinUtils()
+
+# Seconds to wait for the host build to report its tty
+HOST_START_TIMEOUT = 5
+# Commands every firmware build supports
+BASE_OPS = ('zv', 'zb', 'zk', 'ze', 'zd', 'zt', 'AR', 'AW', 'DR', 'DW', 'MI', 'MO', 'MP', 'MR')
+# Optional firmware features (boardfile: firmware/features) and their commands
+FEATURES = {
+    'free_memory': ('zz',),  # needs the MemoryFree library
+    'playback': ('PR', 'PT', 'PS'),
+    'group': ('GW', 'GR'),
+    'i2c': ('IS', 'IR', 'IW'),
+    'spi': ('XT', 'XW'),
+    'capture': ('CB',),
+    'macro': ('KD', 'KR'),
+    'onewire': ('WR',),  # needs the OneWire and DallasTemperature libraries
+    'dht': ('SR',),  # needs the DHT library
+}
+# Features of boardfiles that do not list any. They fit into the 2 KB RAM of
+# ATmega328 boards; capture, macros, I2C and SPI buffers need to be chosen.
+DEFAULT_FEATURES = ('free_memory', 'playback', 'group', 'onewire', 'dht')
+
+
+def pin_bitmap(pins, size):
+    """ Return a C initializer of a <size> byte bitmap with the bits of <pins> set """
+    bitmap = bytearray(size)
+    for pin in map(int, pins):
+        bitmap[pin >> 3] |= 1 << (pin & 7)
+    return '{%s}' % ', '.join(f'0x{byte:02x}' for byte in bitmap)
+
+
+def resolve_features(features=None, default=DEFAULT_FEATURES):
+    """ Return the enabled features in canonical order. None enables <default>. """
+    if features is None:
+        features = default
+    unknown = set(features) - set(FEATURES)
+    if unknown:
+        raise DeviceConfigError(f'Unknown firmware features: {", ".join(sorted(unknown))}. '
+                                f'Known: {", ".join(FEATURES)}')
+    return [feature for feature in FEATURES if feature in features]
+
+
+def firmware_env(boardfile, baudrate, arduino_id=0, default_features=DEFAULT_FEATURES):
+    """
+        Return the template variables of the firmware for <boardfile>. Without
+        features in the boardfile, <default_features> are built in.
+    """
+    _tpl = '{%s}'
+    features = resolve_features(boardfile.features, default_features)
+    size = max(map(int, boardfile.physical_pin_ids), default=0) // 8 + 1
+    return {
+        "num_analog_pins": boardfile.num_analog_pins,
+        "num_digital_pins": boardfile.num_digital_pins,
+        "num_pwm_pins": boardfile.num_pwm_pins,
+        "pwm_pins": _tpl % ", ".join(map(str, boardfile.pwm_pins)),
+        "analog_pins": _tpl % ", ".join(map(str, boardfile.analog_pins)),
+        "digital_pins": _tpl % ", ".join(map(str, boardfile.digital_pins)),
+        "physical_pins": _tpl % ", ".join(map(str, boardfile.physical_pin_ids)),
+        "num_physical_pins":  boardfile.num_physical_pins,
+        "extra_libs": '\n'.join(boardfile.extra_libs),
+        "baudrate": baudrate,
+        "arduino_id": int(arduino_id or 0),
+        "pin_map_bits": size * 8,
+        "pin_map": pin_bitmap(boardfile.physical_pin_ids, size),
+        "pwm_map": pin_bitmap(boardfile.pwm_pins, size),
+        "analog_map": pin_bitmap(boardfile.analog_pins, size),
+        "features": features,
+        "supported_ops": ','.join(BASE_OPS + sum((FEATURES[f] for f in features), ())),
+    }
+
+
+def render_firmware(source, fwenv):
+    """ Render the firmware template <source>. The build hash covers source and env. """
+    build_hash = hashlib.sha1(source.encode('utf-8'))
+    build_hash.update(json.dumps(fwenv, sort_keys=True).encode('utf-8'))
+    template = Template(source, trim_blocks=True, lstrip_blocks=True,
+                        keep_trailing_newline=True)
+    return template.render(dict(fwenv, build_hash=build_hash.hexdigest()[:8]))
+
+
+class HostBuild:
+    """
+        Builds the firmware of <board> as native program in <workdir>/<board>/host.
+        The firmware template is taken from <workdir>/<board>/src, if a
+        buildenv exists, otherwise the shipped one is used.
+    """
+
+    def __init__(self, workdir, board, compiler=None):
+        self.workdir = os.path.expanduser(workdir)
+        self.board = board
+        self.compiler = compiler or os.environ.get('CXX', 'c++')
+        self.build_dir = os.path.join(self.workdir, board, 'host')
+        self.binary = os.path.join(self.build_dir, 'pyduin')
+        self.logger = utils.logger()
+
+    @property
+    def template(self):
+        """ Return the path of the firmware template """
+        firmware = os.path.join(self.workdir, self.board, 'src', 'pyduin.cpp')
+        return firmware if os.path.isfile(firmware) else utils.firmware
+
+    def build(self, baudrate=None, arduino_id=0, boardfile=None):
+        """
+            Render and compile the firmware. Return the path of the binary.
+            The compiler is only run, if the rendered firmware changed. Without
+            features in the boardfile, all features are built in.
+        """
+        if not shutil.which(self.compiler):
+            raise DeviceConfigError(f'No C++ compiler found: {self.compiler}')
+        boardfile = BoardFile.get(boardfile or utils.board_boardfile(self.board))
+        with open(self.template, 'r', encoding='utf-8') as template:
+            source = render_firmware(template.read(), firmware_env(
+                boardfile, baudrate or boardfile.baudrate, arduino_id, tuple(FEATURES)))
+        os.makedirs(self.build_dir, exist_ok=True)
+        firmware = os.path.join(self.build_dir, 'pyduin.cpp')
+        if os.path.isfile(self.binary) and os.path.isfile(firmware):
+            with open(firmware, 'r', encoding='utf-8') as previous:
+                if previous.read() == source:
+                    return self.binary
+        with open(firmware, 'w', encoding='utf-8') as target:
+            target.write(source)
+        cmd = [self.compiler, '-std=c++11', '-O1', '-w', '-I', utils.hostcoredir,
+               '-include', 'Arduino.h', firmware, os.path.join(utils.hostcoredir, 'core.cpp'),
+               '-o', self.binary]
+        self.logger.debug(cmd)
+        try:
+            subprocess.run(cmd, check=True, capture_output=True, text=True)
+        except subprocess.CalledProcessError as error:
+            # Without the rendered firmware, the next build runs the compiler again.
+            os.remove(firmware)
+            raise DeviceConfigError(f'Host build failed:\n{error.stderr}') from error
+        return self.binary
+
+
+class HostDevice:
+    """
+        Runs a host build of the firmware. The tty of the device is available
+        as <tty>, once the process started. Use as context manager or call
+        close().
+    """
+
+    def __init__(self, binary):
+        self.binary = binary
+        # pylint: disable=consider-using-with
+        self.process = subprocess.Popen([binary], stdout=subprocess.PIPE, text=True)
+        try:
+            self.tty = self._read_tty()
+        except DeviceConfigError:
+            self.close()
+            raise
+
+    def _read_tty(self):
+        """ Return the tty, the process prints as first line """
+        ready, _, _ = select.select([self.process.stdout], [], [], HOST_START_TIMEOUT)
+        line = self.process.stdout.readline() if ready else ''
+        if not line.startswith('/dev/'):
+            raise DeviceConfigError(f'{self.binary} did not report a tty: {line!r}')
+        return line.strip()
+
+    def close(self):
+        """ Stop the process """
+        if self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+        self.process.stdout.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  metrics.py
+#
+"""
+    Metrics module. Collects latency histograms and counters for the
+    serial traffic of an Arduino object.
+"""
+from bisect import bisect_left
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+COUNTERS = {
+    'bytes_out': ('pyduin_sent_bytes_total', 'Bytes written to the device'),
+    'bytes_in': ('pyduin_received_bytes_total', 'Bytes read from the device'),
+    'timeouts': ('pyduin_timeouts_total', 'Reads that hit the serial timeout'),
+    'invalid_replies': ('pyduin_invalid_replies_total', 'Replies reporting an invalid command'),
+    'reconnects': ('pyduin_reconnects_total', 'Reopened serial connections'),
+    'flow_stalls': ('pyduin_flow_stalls_total',
+                    'Batch writes that waited for space in the device receive buffer'),
+    'flow_drops': ('pyduin_flow_drops_total', 'Batched frames lost or garbled on the way'),
+}
+
+
+class Histogram:
+    """
+        A latency histogram with fixed bucket bounds
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """ Add a value to the histogram """
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """ Return (upper bound, cumulative count) pairs as in Prometheus """
+        total = 0
+        res = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            res.append((bound, total))
+        return res
+
+    def as_dict(self):
+        """ Return the histogram as dict """
+        return {'count': self.count,
+                'sum': self.sum,
+                'mean': self.sum / self.count if self.count else 0.0,
+                'buckets': dict(self.cumulative())}
+
+
+class Metrics:
+    """
+        Per-command latency histograms and traffic counters of one device
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.latency = {}
+        self.counters = dict.fromkeys(COUNTERS, 0)
+
+    def count(self, counter, value=1):
+        """ Increase <counter> by <value> """
+        self.counters[counter] += value
+
+    def observe(self, message, duration):
+        """ Record the round trip time of <message>. The command type is
+        taken from the two command bytes of the frame (e.g. DW, AR, zv). """
+        command = message[1:3]
+        if isinstance(command, bytes):
+            command = command.decode('utf-8')
+        try:
+            self.latency[command].observe(duration)
+        except KeyError:
+            self.latency[command] = Histogram(self.buckets)
+            self.latency[command].observe(duration)
+
+    def received(self, line):
+        """ Account a line read from the device """
+        self.counters['bytes_in'] += len(line)
+        if not line.endswith(b'\n'):
+            self.counters['timeouts'] += 1
+        elif line.startswith(b'Invalid command'):
+            self.counters['invalid_replies'] += 1
+
+    def as_dict(self):
+        """ Return all metrics as dict """
+        res = dict(self.counters)
+        res['commands'] = {command: histogram.as_dict()
+                           for command, histogram in sorted(self.latency.items())}
+        return res
+
+    def reset(self):
+        """ Reset all metrics """
+        self.latency = {}
+        self.counters = dict.fromkeys(COUNTERS, 0)
+
+
+def _labels(labels):
+    """ Render a label dict in Prometheus syntax """
+    return ','.join(f'{key}="{value}"' for key, value in labels.items())
+
+
+def prometheus(*arduinos):
+    """
+        Return the metrics of the given Arduino objects in Prometheus text
+        format. Each device is labeled with its board and tty.
+    """
+    lines = []
+    devices = [(arduino, {'board': arduino.board, 'tty': arduino.tty})
+               for arduino in arduinos if arduino.metrics is not None]
+    name = 'pyduin_command_latency_seconds'
+    lines.append(f'# HELP {name} Round trip time of commands by command type')
+    lines.append(f'# TYPE {name} histogram')
+    for arduino, labels in devices:
+        for command, histogram in sorted(arduino.metrics.latency.items()):
+            _lbl = _labels(dict(labels, command=command))
+            for bound, count in histogram.cumulative():
+                _le = '+Inf' if bound == float('inf') else repr(float(bound))
+                lines.append(f'{name}_bucket{{{_lbl},le="{_le}"}} {count}')
+            lines.append(f'{name}_sum{{{_lbl}}} {histogram.sum}')
+            lines.append(f'{name}_count{{{_lbl}}} {histogram.count}')
+    for counter, (name, description) in COUNTERS.items():
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} counter')
+        for arduino, labels in devices:
+            lines.append(f'{name}{{{_labels(labels)}}} {arduino.metrics.counters[counter]}')
+    return '\n'.join(lines) + '\n'
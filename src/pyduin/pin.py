@@ -8,6 +8,18 @@
 """
 import weakref
 
+from pyduin.utils import UnsupportedOperationError
+
+# Ramp curves in the order the firmware knows them
+CURVES = ('linear', 'ease_in', 'ease_out')
+# Maximum number of values in a waveform table (MAX_WAVEFORM_POINTS in pyduin.cpp)
+WAVEFORM_POINTS = 32
+# Maximum number of pins in a group (MAX_GROUP_PINS in pyduin.cpp)
+GROUP_PINS = 16
+# Command and value (digital, analog pins) of the mode messages
+MODE_FRAMES = {'output': ('MO', '001', '030'), 'input': ('MI', '000', '000'),
+               'input_pullup': ('MP', '000', '000')}
+
 
 class Mode:
     """
@@ -17,6 +29,8 @@ class Mode:
     def __init__(self, pin, pin_mode):
         self.pin = weakref.proxy(pin)
         self.wanted_mode = pin_mode
+        # The last mode message sent, to restore the mode after a reset
+        self.message = None
         self._setpinmodetext = f'Set pin mode for pin {self.pin.pin_id} to'
         if not self.pin.arduino.wait:
             self.set_mode(pin_mode)
@@ -28,15 +42,25 @@ class Mode:
         """
         return self.pin.pin_type
 
+    def frame(self, mode):
+        """
+            Return the message setting <mode> (input, output, input_pullup,
+            pwm) without sending it.
+        """
+        mode = 'output' if mode == 'pwm' else mode.lower()
+        if mode not in MODE_FRAMES:
+            raise ValueError(f'Unknown pin mode: {mode}')
+        command, digital, analog = MODE_FRAMES[mode]
+        value = digital if self.analog_or_digital() == 'digital' else analog
+        return f'<{command}{self.pin.pin_id:02d}{value}>'
+
     def output(self):
         """
             Set mode for this pin to output
         """
         self.wanted_mode = self.pin.pin_mode = 'output'
         self.logger.info('%s OUTPUT', self._setpinmodetext)
-        message = "<MO%02d001>" if self.analog_or_digital() == 'digital' else "<MO%s030>"
-        message = message % self.pin.pin_id
-        self.pin.pin_mode = 'output'
+        self.message = message = self.frame('output')
         return self.pin.arduino.send(message)
 
     def input(self):
@@ -44,11 +68,8 @@ class Mode:
             Set mode for this pin to INPUT
         """
         self.wanted_mode = self.pin.pin_mode = 'input'
-        self.wanted_mode = 'input'
         self.logger.info("%s INPUT", self._setpinmodetext)
-        message = "<MI%02d000>" if self.analog_or_digital() == 'digital' else "<MI%s000>"
-        message = message % self.pin.pin_id
-        self.pin.pin_mode = 'input'
+        self.message = message = self.frame('input')
         return self.pin.arduino.send(message)
 
     def input_pullup(self):
@@ -57,9 +78,7 @@ class Mode:
         """
         self.wanted_mode = self.pin.pin_mode = 'input_pullup'
         self.logger.info("%s INPUT_PULLUP", self._setpinmodetext)
-        message = "<MP%02d000>" if self.analog_or_digital() == 'digital' else "<MP%s000>"
-        message = message % self.pin.pin_id
-        self.pin.pin_mode = 'input_pullup'
+        self.message = message = self.frame('input_pullup')
         return self.pin.arduino.send(message)
 
     def get_mode(self):
@@ -94,11 +113,27 @@ class ArduinoPin:  # pylint: disable=too-many-instance-attributes
         self.arduino = weakref.proxy(arduino)  # pylint: disable=invalid-name
         self.pin_id = pin_config['physical_id']
         self.pin_type = 'analog' if 'analog' in pin_config.get('extra', [])  else 'digital'
-        #self.pwm_capable = pin_config.get('pwm_capable', False)
-        #self.pwm_enabled = pin_config.get('pwm_enabled', False)
+        self.pwm_capable = 'pwm' in pin_config.get('extra', [])
         self.pin_mode = pin_config.get('pin_mode', 'input_pullup')
         self.Mode = Mode(self, self.pin_mode)  # pylint: disable=invalid-name
-        self.message = ""
+        # Encoded frames of the constant actions, built once
+        self.frames = {action: self.frame(action).encode('utf-8')
+                       for action in ('high', 'low', 'read')}
+        self.frames['read_timed'] = self.frame('read', 1).encode('utf-8')
+        self._message = ""
+        # The last output frame sent (high, low, pwm), to restore it after a reset
+        self.output = None
+
+    @property
+    def message(self):
+        """ Return the last message sent by this pin """
+        if isinstance(self._message, bytes):
+            return self._message.decode('utf-8')
+        return self._message
+
+    @message.setter
+    def message(self, message):
+        self._message = message
 
     def set_mode(self, mode):
         """
@@ -112,31 +147,152 @@ class ArduinoPin:  # pylint: disable=too-many-instance-attributes
         """
         return self.Mode.get_mode()
 
-    def high(self):
+    def frame(self, action, value=0):
+        """
+            Return the message for <action> (high, low, read, pwm) without
+            sending it. Reads with <value> 1 are answered with the device time.
+        """
+        if action == 'high':
+            return f'<DW{self.pin_id:02d}001>'
+        if action == 'low':
+            return f'<DW{self.pin_id:02d}000>'
+        if action == 'read':
+            return f'<{self.pin_type[0].upper()}R{self.pin_id:02d}{value:03d}>'
+        if action == 'pwm':
+            return f'<AW{self.pin_id:02d}{value:03d}>'
+        raise ValueError(f'Unknown pin action: {action}')
+
+    def high(self, timeout=None):
         """
             Set this pin to HIGH
         """
-        self.message = f'<DW{self.pin_id:02d}001>'
-        return self.arduino.send(self.message)
+        self.output = self._message = self.frames['high']
+        return self.arduino.send(self._message, timeout=timeout)
 
-    def low(self):
+    def low(self, timeout=None):
         """
             Set this pin to LOW
         """
-        self.message = f'<DW{self.pin_id:02d}000>'
+        self.output = self._message = self.frames['low']
+        return self.arduino.send(self._message, timeout=timeout)
+
+    def read(self, timeout=None, timestamp=False):
+        """
+            Read-out a pin. With <timestamp>, (reply, time) is returned, time
+            is the time.monotonic() the device took the reading at (None, if
+            the firmware did not send it).
+        """
+        if not timestamp:
+            self._message = self.frames['read']
+            return self.arduino.send(self._message, timeout=timeout)
+        self._message = self.frames['read_timed']
+        reply = self.arduino.send(self._message, timeout=timeout)
+        fields = reply.split('%') if isinstance(reply, str) else []
+        if len(fields) != 4 or not fields[3].isdigit():
+            return reply, None
+        return '%'.join(fields[:3]), self.arduino.device_time(int(fields[3]))
+
+    def _check_pwm(self):
+        """ Raise UnsupportedOperationError, if this pin is not pwm capable """
+        if not self.pwm_capable:
+            raise UnsupportedOperationError(f'Pin {self.pin_id} is not pwm capable')
+
+    def pwm(self, value=0, timeout=None):
+        """
+            Set pin to a specific pwm value
+        """
+        self._check_pwm()
+        self.output = self.message = self.frame('pwm', value)
+        return self.arduino.send(self.message, timeout=timeout)
+
+    def ramp(self, start, end, duration, curve='linear', loop=False):
+        """
+            Let the device ramp the pwm value of this pin from <start> to <end>
+            within <duration> seconds. Curve is one of 'linear', 'ease_in' or
+            'ease_out'. With loop=True, the ramp restarts when done.
+        """
+        self._check_pwm()
+        self.arduino.require('PR')
+        if not 0 <= start <= 255 or not 0 <= end <= 255:
+            raise ValueError('Ramp values must be within 0-255')
+        self.message = f'<PR{self.pin_id:02d}000:{start},{end},{int(duration * 1000)},' \
+                       f'{CURVES.index(curve)},{int(loop)}>'
         return self.arduino.send(self.message)
 
-    def read(self):
+    def play(self, table, interval, loop=False):
         """
-            Read-out a pin. 
+            Let the device play a table of pwm values on this pin, one value
+            every <interval> seconds. With loop=True, playback restarts when done.
         """
-        self.message = f'<{self.pin_type[0].upper()}R{self.pin_id:02d}000>'
+        self._check_pwm()
+        self.arduino.require('PT')
+        if not 0 < len(table) <= WAVEFORM_POINTS:
+            raise ValueError(f'A waveform table holds 1-{WAVEFORM_POINTS} values')
+        if not all(0 <= value <= 255 for value in table):
+            raise ValueError('Waveform values must be within 0-255')
+        values = ','.join(map(str, table))
+        self.message = f'<PT{self.pin_id:02d}000:{int(interval * 1000)},{int(loop)},{values}>'
         return self.arduino.send(self.message)
 
-    def pwm(self, value=0):
+    def stop(self):
         """
-            Set pin to a specific pwm value
+            Stop a ramp or waveform playing on this pin
         """
-        # @TODO, check, if the pin is indeed a pwm capable pin
-        self.message = f'<AW{self.pin_id:02d}{value:03d}>'
+        self.arduino.require('PS')
+        self.message = f'<PS{self.pin_id:02d}000>'
         return self.arduino.send(self.message)
+
+
+class PinGroup:
+    """
+        A group of pins that is written or read as one value in one frame.
+        Bit n of the value belongs to the n-th pin of the group. The device
+        applies the value through the port registers, so all pins on the
+        same port change at the same time.
+    """
+
+    def __init__(self, arduino, pins):
+        self.arduino = weakref.proxy(arduino)
+        pin_ids = [arduino.boardfile.normalize_pin_id(pin) for pin in pins]
+        if not 0 < len(pin_ids) <= GROUP_PINS:
+            raise ValueError(f'A pin group holds 1-{GROUP_PINS} pins')
+        if len(set(pin_ids)) != len(pin_ids):
+            raise ValueError(f'Pins must not appear twice in a group: {pin_ids}')
+        self.pins = [arduino.get_pin(pin_id) for pin_id in pin_ids]
+        self._pin_ids = ','.join(str(pin_id) for pin_id in pin_ids)
+        self.message = ""
+
+    def set_mode(self, mode):
+        """
+            Set the mode of all pins in the group (one batch)
+        """
+        messages = [pin.Mode.frame(mode) for pin in self.pins]
+        mode = 'output' if mode == 'pwm' else mode.lower()
+        for pin, message in zip(self.pins, messages):
+            pin.Mode.wanted_mode = pin.pin_mode = mode
+            pin.Mode.message = message
+        return self.arduino.send_batch(messages)
+
+    def write(self, value, timeout=None):
+        """
+            Set the pins of the group to the bits of <value> at once
+        """
+        self.arduino.require('GW')
+        if not 0 <= value < 1 << len(self.pins):
+            raise ValueError(f'Value does not fit into {len(self.pins)} pins: {value}')
+        self.message = f'<GW00000:{value},{self._pin_ids}>'
+        for bit, pin in enumerate(self.pins):
+            pin.output = pin.frames['high' if value >> bit & 1 else 'low']
+        return self.arduino.send(self.message, timeout=timeout)
+
+    def read(self, timeout=None):
+        """
+            Sample all pins of the group at once and return them as int
+        """
+        self.arduino.require('GR')
+        self.message = f'<GR00000:0,{self._pin_ids}>'
+        reply = self.arduino.send(self.message, timeout=timeout)
+        try:
+            return int(reply.split('%')[-1])
+        except (AttributeError, ValueError):
+            return -1
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  recording.py
+#
+"""
+    Record and replay serial sessions.
+
+    A recording is an append-only binary log of one session (an existing
+    file is replaced). It starts with a header
+    (magic, format version, wall clock time of creation) followed by one
+    record per frame:
+
+        direction (uint8) | monotonic timestamp in ns (uint64) | length (uint16) | payload
+"""
+import mmap
+import os
+import struct
+import time
+
+from pyduin.utils import ReplayError
+
+MAGIC = b'PYDREC'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<6sHd')
+RECORD = struct.Struct('<BQH')
+SENT = 0
+RECEIVED = 1
+
+
+class RecordingConnection:
+    """
+        Wraps a connection (e.g. serial.Serial) and logs every frame
+        written to and read from it. All other attributes (including the
+        timeout, which is set per call) are passed through to the wrapped
+        connection. An existing recording at <path>
+        is replaced, unless <append> continues the same session (e.g. after
+        a reconnect).
+    """
+
+    def __init__(self, connection, path, append=False):
+        self.connection = connection
+        self.path = path
+        # pylint: disable=consider-using-with
+        self.logfile = open(path, 'ab' if append else 'wb')
+        if self.logfile.tell() == 0:
+            self.logfile.write(HEADER.pack(MAGIC, FORMAT_VERSION, time.time()))
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+    @property
+    def timeout(self):
+        """ The read timeout of the wrapped connection """
+        return self.connection.timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self.connection.timeout = value
+
+    def _record(self, direction, data):
+        """ Append a record to the log """
+        self.logfile.write(RECORD.pack(direction, time.monotonic_ns(), len(data)))
+        self.logfile.write(data)
+
+    def write(self, data):
+        """ Write <data> to the connection and record it """
+        self._record(SENT, data)
+        return self.connection.write(data)
+
+    def readline(self):
+        """ Read a line from the connection and record it """
+        line = self.connection.readline()
+        self._record(RECEIVED, line)
+        return line
+
+    def read(self, size=1):
+        """ Read <size> bytes from the connection and record them """
+        data = self.connection.read(size)
+        self._record(RECEIVED, data)
+        return data
+
+    def stop(self):
+        """ Stop recording and return the wrapped connection """
+        self.logfile.close()
+        return self.connection
+
+    def close(self):
+        """ Stop recording and close the wrapped connection """
+        self.stop()
+        self.connection.close()
+
+
+def records(buf, offset=HEADER.size):
+    """ Iterate over (direction, timestamp, payload) records in <buf> """
+    end = len(buf)
+    while offset + RECORD.size <= end:
+        direction, timestamp, length = RECORD.unpack_from(buf, offset)
+        offset += RECORD.size
+        yield direction, timestamp, buf[offset:offset + length]
+        offset += length
+
+
+class ReplayConnection:  # pylint: disable=too-many-instance-attributes
+    """
+        A connection that feeds a recorded session back to an Arduino object.
+        The recording is memory-mapped, so long captures are not loaded at once.
+
+        With realtime=True, replies are delayed by the latency they had in the
+        recording. With strict=True, written frames must match the recording.
+    """
+    baudrate = False
+    timeout = False
+
+    def __init__(self, path, realtime=False, strict=False):
+        self.path = path
+        self.realtime = realtime
+        self.strict = strict
+        with open(path, 'rb') as logfile:
+            if os.fstat(logfile.fileno()).st_size < HEADER.size:
+                raise ReplayError(f'{path} is not a pyduin recording')
+            self._mmap = mmap.mmap(logfile.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.created = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ReplayError(f'{path} is not a pyduin recording')
+        self._sent = self._iter(SENT)
+        self._received = self._iter(RECEIVED)
+        self._anchor = None
+
+    def _iter(self, direction):
+        """ Iterate over the records of one direction """
+        for _direction, timestamp, payload in records(self._mmap):
+            if _direction == direction:
+                yield timestamp, payload
+
+    def write(self, data):
+        """ Consume the next sent frame of the recording """
+        try:
+            timestamp, payload = next(self._sent)
+        except StopIteration as exc:
+            raise ReplayError('Recording exhausted') from exc
+        if self.strict and payload != data:
+            raise ReplayError(f'Expected {bytes(payload)!r}, got {data!r}')
+        # Relate the recorded time line to now.
+        self._anchor = time.monotonic_ns() - timestamp
+        return len(data)
+
+    def readline(self):
+        """ Return the next received frame of the recording """
+        try:
+            timestamp, payload = next(self._received)
+        except StopIteration:
+            return b''
+        if self.realtime and self._anchor is not None:
+            delay = (self._anchor + timestamp - time.monotonic_ns()) / 1e9
+            if delay > 0:
+                time.sleep(delay)
+        return bytes(payload)
+
+    def read(self, size=1):  # pylint: disable=unused-argument
+        """ Return the next received chunk of the recording """
+        return self.readline()
+
+    def reset_input_buffer(self):
+        """ Nothing is buffered """
+
+    def close(self):
+        """ Release the memory map """
+        self._sent.close()
+        self._received.close()
+        self._mmap.close()
+
+
+def summary(path):
+    """ Return frame and byte counts and the duration of a recording """
+    with open(path, 'rb') as logfile:
+        if os.fstat(logfile.fileno()).st_size <= HEADER.size:
+            return {'frames_sent': 0, 'frames_received': 0, 'bytes_sent': 0,
+                    'bytes_received': 0, 'duration': 0.0}
+        buf = mmap.mmap(logfile.fileno(), 0, access=mmap.ACCESS_READ)
+    res = {'frames_sent': 0, 'frames_received': 0, 'bytes_sent': 0, 'bytes_received': 0}
+    first = last = None
+    for direction, timestamp, payload in records(buf):
+        key = 'sent' if direction == SENT else 'received'
+        res[f'frames_{key}'] += 1
+        res[f'bytes_{key}'] += len(payload)
+        first = timestamp if first is None else first
+        last = timestamp
+    buf.close()
+    res['duration'] = (last - first) / 1e9 if first is not None else 0.0
+    return res
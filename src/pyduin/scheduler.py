@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  scheduler.py
+#
+"""
+    Scheduler module. Runs periodic and one-shot pin operations of an
+    Arduino object against a monotonic clock.
+"""
+import math
+import threading
+import time
+
+SKIP = 'skip'
+CATCH_UP = 'catch_up'
+WARN = 'warn'
+OVERRUN_POLICIES = (SKIP, CATCH_UP, WARN)
+
+
+class Job:  # pylint: disable=too-many-instance-attributes
+    """
+        A scheduled pin operation. <interval> is None for one-shot jobs.
+        The callback (if any) receives the reply of the device.
+    """
+
+    def __init__(self, message, due, *, interval=None, callback=None, name=None):
+        self.message = message
+        self.due = due
+        self.interval = interval
+        self.callback = callback
+        self.name = name or message
+        self.runs = 0
+        self.overruns = 0
+        self._lateness_sum = 0.0
+        self._lateness_sq = 0.0
+        self.max_lateness = 0.0
+
+    def record(self, lateness):
+        """ Account the lateness of one run """
+        self.runs += 1
+        self._lateness_sum += lateness
+        self._lateness_sq += lateness * lateness
+        self.max_lateness = max(self.max_lateness, lateness)
+
+    def jitter(self):
+        """ Return run count, overruns and lateness statistics (seconds) """
+        mean = self._lateness_sum / self.runs if self.runs else 0.0
+        var = self._lateness_sq / self.runs - mean * mean if self.runs else 0.0
+        return {'runs': self.runs, 'overruns': self.overruns, 'mean': mean,
+                'max': self.max_lateness, 'stdev': math.sqrt(max(var, 0.0))}
+
+
+class Scheduler:  # pylint: disable=too-many-instance-attributes
+    """
+        Runs jobs of one Arduino object. Periodic jobs are scheduled relative
+        to their previous due time, so they do not drift. Jobs that are due
+        within the same tick (<tick> seconds) are sent as one pipelined batch.
+
+        If a periodic job misses one or more periods, <overrun> decides:
+        'skip' drops the missed runs, 'catch_up' runs them as fast as
+        possible and 'warn' logs a warning and drops them.
+    """
+
+    def __init__(self, arduino, tick=0.001, overrun=SKIP):
+        if overrun not in OVERRUN_POLICIES:
+            raise ValueError(f'Overrun policy must be one of {OVERRUN_POLICIES}')
+        self.arduino = arduino
+        self.tick = tick
+        self.overrun = overrun
+        self.jobs = []
+        # Statistics of the one-shot jobs that ran, by job name
+        self.done = {}
+        self._lock = threading.RLock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # pylint: disable=too-many-arguments
+    def every(self, interval, pin, action, value=0, *, callback=None, start=None):
+        """
+            Run <action> (high, low, read, pwm) on <pin> every <interval>
+            seconds, first after <start> seconds (default: now).
+        """
+        message = self.arduino.get_pin(pin).frame(action, value).encode('utf-8')
+        due = time.monotonic() + (start or 0)
+        return self._add(Job(message, due, interval=interval, callback=callback,
+                             name=f'{pin}:{action}'))
+
+    def once(self, delay, pin, action, value=0, *, callback=None):
+        """ Run <action> on <pin> once after <delay> seconds """
+        message = self.arduino.get_pin(pin).frame(action, value).encode('utf-8')
+        return self._add(Job(message, time.monotonic() + delay, callback=callback,
+                             name=f'{pin}:{action}'))
+
+    def _add(self, job):
+        """ Register a job and wake up the run loop """
+        with self._lock:
+            self.jobs.append(job)
+        self._wakeup.set()
+        return job
+
+    def cancel(self, job):
+        """ Remove a job """
+        with self._lock:
+            if job in self.jobs:
+                self.jobs.remove(job)
+
+    def _reschedule(self, job, now):
+        """ Set the next due time of a periodic job after it ran """
+        job.due += job.interval
+        if job.due > now or self.overrun == CATCH_UP:
+            return
+        missed = int((now - job.due) / job.interval) + 1
+        job.overruns += missed
+        job.due += missed * job.interval
+        if self.overrun == WARN:
+            self.arduino.logger.warning('Job %s missed %s run(s)', job.name, missed)
+
+    def run_pending(self):
+        """
+            Run all jobs that are due within the current tick as one batch.
+            Return the time until the next job is due (None without jobs).
+            Lateness is measured when the batch is sent.
+        """
+        with self._lock:
+            sent = time.monotonic()
+            due = [job for job in self.jobs if job.due <= sent + self.tick]
+        if due:
+            replies = self.arduino.send_batch([job.message for job in due])
+            now = time.monotonic()
+            with self._lock:
+                for job in due:
+                    job.record(max(sent - job.due, 0.0))
+                    if job.interval is None:
+                        self.cancel(job)
+                        self.done.setdefault(job.name, Job(job.message, job.due, name=job.name)) \
+                            .record(max(sent - job.due, 0.0))
+                    else:
+                        self._reschedule(job, now)
+            for job, reply in zip(due, replies):
+                if job.callback:
+                    job.callback(reply)
+        with self._lock:
+            if not self.jobs:
+                return None
+            return max(min(job.due for job in self.jobs) - time.monotonic(), 0.0)
+
+    def run(self, duration=None):
+        """
+            Run jobs until <duration> passed, stop() was called or no job
+            is left.
+        """
+        self._stop.clear()
+        self._run(duration)
+
+    def _run(self, duration=None, forever=False):
+        """ The run loop. With <forever>, it waits for new jobs when idle. """
+        end = time.monotonic() + duration if duration is not None else None
+        while not self._stop.is_set():
+            self._wakeup.clear()
+            wait = self.run_pending()
+            if wait is None and not forever and end is None:
+                break
+            if end is not None:
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    break
+                wait = remaining if wait is None else min(wait, remaining)
+            if wait is None or wait > 0:
+                self._wakeup.wait(wait)
+
+    def start(self):
+        """ Run jobs in a background thread until stop() is called """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, kwargs={'forever': True},
+                                        daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        """ Stop the run loop """
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def jitter(self):
+        """
+            Return the jitter statistics of all jobs by job name. One-shot
+            jobs that ran are summed up by name.
+        """
+        with self._lock:
+            res = {name: job.jitter() for name, job in self.done.items()}
+            res.update({job.name: job.jitter() for job in self.jobs})
+        return res
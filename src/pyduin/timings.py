@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  timings.py
+#
+"""
+    Timings module. Records the wall time of named, possibly nested phases
+    (e.g. config loading, serial open, boot wait) and reports them as table
+    or as collapsed stacks for flamegraph tools.
+"""
+import time
+from contextlib import contextmanager, nullcontext
+
+
+class Timings:
+    """
+        Wall time of phases. Phases started within another phase are
+        recorded as its children.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.started = clock()
+        # [path, duration] in the order the phases were started
+        self.phases = []
+        self._stack = []
+
+    @contextmanager
+    def phase(self, name):
+        """ Record the time spent in the with block as phase <name> """
+        self._stack.append(name)
+        entry = [tuple(self._stack), 0.0]
+        self.phases.append(entry)
+        start = self.clock()
+        try:
+            yield entry
+        finally:
+            entry[1] = self.clock() - start
+            self._stack.pop()
+
+    @property
+    def total(self):
+        """ Return the time since the object was created """
+        return self.clock() - self.started
+
+    def durations(self, exclusive=False):
+        """
+            Return the summed durations by phase path, in the order the phases
+            were first started. With <exclusive>, the time of the children is
+            not included.
+        """
+        res = {}
+        for path, duration in self.phases:
+            res[path] = res.get(path, 0.0) + duration
+            if exclusive and len(path) > 1:
+                res[path[:-1]] -= duration
+        return res
+
+    def as_dict(self):
+        """ Return the durations by phase path as string ('connect/serial_open') """
+        return {'/'.join(path): duration for path, duration in self.durations().items()}
+
+    def breakdown(self):
+        """ Return a table of the phases, indented by nesting level """
+        total = self.total
+        width = max([len('total')] + [len(path) * 2 - 2 + len(path[-1]) for path, _ in self.phases])
+        lines = []
+        for path, duration in self.durations().items():
+            label = '  ' * (len(path) - 1) + path[-1]
+            share = duration / total * 100 if total else 0.0
+            lines.append(f'{label:<{width}} {duration * 1000:10.1f} ms {share:5.1f}%')
+        lines.append(f'{"total":<{width}} {total * 1000:10.1f} ms')
+        return '\n'.join(lines)
+
+    def collapsed(self, root='pyduin'):
+        """
+            Return the phases as collapsed stacks ('root;connect;serial_open 1234',
+            self time in microseconds), as read by flamegraph.pl and speedscope.
+        """
+        lines = [f'{";".join((root,) + path)} {round(duration * 1e6)}'
+                 for path, duration in self.durations(exclusive=True).items()]
+        return '\n'.join(lines) + '\n'
+
+
+def phase(timings, name):
+    """ Return a context manager, that records phase <name> to <timings> (if not None) """
+    return timings.phase(name) if timings is not None else nullcontext()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  transport.py
+#
+"""
+    Transport module. Reads reply lines (and binary replies) from a
+    connection with a deadline per call instead of the fixed timeout of
+    the connection.
+"""
+import select
+import time
+
+import serial
+
+
+class LineReader:
+    """
+        Reads lines from <connection>. For serial ports, the file descriptor
+        is polled with select() and read into a buffer, so every call can
+        have its own timeout. Other connections (mocks, recordings) are
+        read with readline() and their timeout attribute set per call.
+
+        Like serial.Serial.readline(), a read that hits the timeout returns
+        what has been received so far (without a line break).
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.buffer = bytearray()
+        # Only POSIX serial ports can be polled (serial.Serial has no fileno() on Windows)
+        self.fd = connection.fileno() if isinstance(connection, serial.SerialBase) and \
+            hasattr(connection, 'fileno') else None
+
+    def readline(self, timeout=None):
+        """ Return the next line. <timeout> defaults to the connection's timeout. """
+        if self.fd is None:
+            return self._readline_fallback(timeout)
+        if timeout is None:
+            timeout = self.connection.timeout
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            end = self.buffer.find(b'\n')
+            if end >= 0:
+                line = bytes(self.buffer[:end + 1])
+                del self.buffer[:end + 1]
+                return line
+            remaining = deadline - time.monotonic() if deadline is not None else None
+            if remaining is not None and remaining <= 0:
+                break
+            ready, _, _ = select.select([self.fd], [], [], remaining)
+            if not ready:
+                break
+            self.buffer += self.connection.read(self.connection.in_waiting or 1)
+        line = bytes(self.buffer)
+        self.buffer.clear()
+        return line
+
+    def read(self, size, timeout=None):
+        """
+            Return the next <size> bytes (binary replies). Like readline(), a
+            read that hits the timeout returns what has been received so far.
+        """
+        if self.fd is None:
+            return self._read_fallback(size, timeout)
+        if timeout is None:
+            timeout = self.connection.timeout
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while len(self.buffer) < size:
+            remaining = deadline - time.monotonic() if deadline is not None else None
+            if remaining is not None and remaining <= 0:
+                break
+            ready, _, _ = select.select([self.fd], [], [], remaining)
+            if not ready:
+                break
+            self.buffer += self.connection.read(self.connection.in_waiting or 1)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def _readline_fallback(self, timeout):
+        """ Read a line with readline() of the connection """
+        if timeout is None:
+            return self.connection.readline()
+        previous = getattr(self.connection, 'timeout', None)
+        self.connection.timeout = timeout
+        try:
+            return self.connection.readline()
+        finally:
+            self.connection.timeout = previous
+
+    def _read_fallback(self, size, timeout):
+        """ Read <size> bytes with read() of the connection """
+        if timeout is None:
+            return self.connection.read(size)
+        previous = getattr(self.connection, 'timeout', None)
+        self.connection.timeout = timeout
+        try:
+            return self.connection.read(size)
+        finally:
+            self.connection.timeout = previous
+
+    def reset(self):
+        """ Discard buffered and pending input """
+        self.buffer.clear()
+        if hasattr(self.connection, 'reset_input_buffer'):
+            self.connection.reset_input_buffer()
@@ -1,11 +1,13 @@
 """ Useful functions to save redundant code """
+import configparser
 import os
 import logging
 import re
 import subprocess
+import threading
 import time
 from shutil import copyfile, which, rmtree
-from collections import OrderedDict
+from types import MappingProxyType
 from termcolor import colored
 import yaml
 
@@ -47,6 +49,18 @@ class LEDNotFoundError(BaseException):
         msg = f'LED {led} cannot be resolved to a pin on the device.'
         super().__init__(msg, *args, **kwargs)
 
+class UnsupportedOperationError(BaseException):
+    """ Error class to throw, when the device cannot perform an operation """
+
+class ReplyTimeoutError(BaseException):
+    """ Error class to throw, when the device does not reply within a per-call timeout """
+
+class BusError(BaseException):
+    """ Error class to throw, when a transfer on an I2C or SPI bus fails """
+
+class ReplayError(BaseException):
+    """ Error class to throw, when a recorded session cannot be replayed """
+
 class PyduinUtils:
     """ Wrapper for some useful functions. Exists, to be able to make
     use of @propget decorator and ease handling on the usage side """
@@ -74,6 +88,11 @@ class PyduinUtils:
         """ Return the directory within the package, where the firmware resides """
         return os.path.join(self.package_root, 'data', 'platformio')
 
+    @property
+    def hostcoredir(self):
+        """ Return the directory within the package, where the stub core for host builds resides """
+        return os.path.join(self.package_root, 'data', 'hostcore')
+
     @property
     def firmware(self):
         """ Return full path to default firmware file """
@@ -126,6 +145,73 @@ class PyduinUtils:
                 return False
         return False
 
+    @staticmethod
+    def update_buddy_cfg(location, buddy, key, value):
+        """
+            Persist <key>: <value> for <buddy> in the config file at <location>.
+            Only the line of the key is changed or added, so comments and
+            formatting are kept.
+        """
+        with open(location, 'r', encoding='utf-8') as _configfile:
+            lines = _configfile.read().splitlines()
+        item = yaml.safe_dump({key: value}, default_flow_style=True, width=float('inf'))
+        item = item.strip()[1:-1].strip()
+
+        def _indent(line):
+            return len(line) - len(line.lstrip())
+
+        def _block(start, indent):
+            """ Return the end of the block below line <start> (deeper than <indent>) """
+            end = start + 1
+            for num in range(start + 1, len(lines)):
+                stripped = lines[num].strip()
+                if stripped and not stripped.startswith('#'):
+                    if _indent(lines[num]) <= indent:
+                        break
+                    end = num + 1
+            return end
+
+        def _find(name, start, end, indent=None):
+            """ Return the line of <name>: between <start> and <end> """
+            for num in range(start, end):
+                if lines[num].lstrip().split(':', 1)[0].strip() == str(name) and \
+                        ':' in lines[num] and (indent is None or _indent(lines[num]) == indent):
+                    return num
+            return None
+
+        buddies = _find('buddies', 0, len(lines), 0)
+        if buddies is None:
+            lines += ['buddies:', f'  {buddy}:', f'    {item}']
+        else:
+            end = _block(buddies, 0)
+            children = [num for num in range(buddies + 1, end)
+                        if lines[num].strip() and not lines[num].strip().startswith('#')]
+            indent = _indent(lines[children[0]]) if children else 2
+            entry = _find(buddy, buddies + 1, end, indent)
+            if entry is None:
+                lines[end:end] = [f'{" " * indent}{buddy}:', f'{" " * indent * 2}{item}']
+            else:
+                entry_end = _block(entry, indent)
+                key_indent = _indent(lines[entry + 1]) if entry + 1 < entry_end \
+                    else indent * 2
+                line = _find(key, entry + 1, entry_end, key_indent)
+                if line is None:
+                    lines.insert(entry_end, f'{" " * key_indent}{item}')
+                else:
+                    lines[line] = f'{" " * key_indent}{item}'
+        text = '\n'.join(lines) + '\n'
+        try:
+            config = yaml.load(text, Loader=yaml.Loader)
+            updated = config['buddies'][buddy][key] == value
+        except (yaml.YAMLError, KeyError, TypeError):
+            updated = False
+        if not updated:
+            raise DeviceConfigError(f'Cannot update {key} of {buddy} in {location}, '
+                                    f'please set it to {value}')
+        with open(location, 'w', encoding='utf-8') as _configfile:
+            _configfile.write(text)
+        return config
+
     @staticmethod
     def loglevel_int(level):
         """ Return the integer corresponding to log level string """
@@ -153,93 +239,122 @@ class PyduinUtils:
 
 
 
-class BoardFile:
+class BoardFile:  # pylint: disable=too-many-instance-attributes
     """ Represents a boardfile and provides functions mostly required for templating
-    the firmware for different boards """
-    _analog_pins = []
-    _digital_pins = []
-    _pwm_pins = []
-    _physical_pin_ids = []
-    _leds = []
-    _spi_interfaces = {}
-    _i2c_interfaces = {}
-    pins = OrderedDict()
-    _boardfile = False
-    _baudrate = False
-
-    def __init__(self, boardfile):
+    the firmware for different boards. The parsed boardfile is immutable, use
+    BoardFile.get() to share one object between all devices of a model. """
+    __slots__ = ('path', 'pins', '_analog_pins', '_digital_pins', '_pwm_pins',
+                 '_physical_pin_ids', '_pin_ids', '_aliases', '_leds', '_led_pins',
+                 '_spi_interfaces', '_i2c_interfaces', '_baudrate', '_extra_libs',
+                 '_features', '_rx_buffer')
+    # realpath -> (mtime, BoardFile), see get()
+    _registry = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, boardfile):  # pylint: disable=too-many-locals
         if not os.path.isfile(boardfile):
             raise DeviceConfigError(f'Cannot open boardfile: {boardfile}')
 
         with open(boardfile, 'r', encoding='utf-8') as pfile:
-            self._boardfile = yaml.load(pfile, Loader=yaml.Loader)
+            _boardfile = yaml.load(pfile, Loader=yaml.Loader)
 
-        self.pins = sorted(list(self._boardfile['pins']),
-                       key=lambda x: int(x['physical_id']))
+        self.path = boardfile
+        pins = sorted(_boardfile['pins'], key=lambda x: int(x['physical_id']))
+        analog_pins, digital_pins, pwm_pins, leds = [], [], [], []
+        spi_interfaces, i2c_interfaces = {}, {}
 
-        for pinconfig in self.pins:
+        for pinconfig in pins:
 
             pin_id = pinconfig['physical_id']
-            self._physical_pin_ids.append(pin_id)
             extra = pinconfig.get('extra', [])
 
-            if 'analog' in extra and not pin_id in self._analog_pins:
-                self._analog_pins.append(pin_id)
+            if 'analog' in extra and not pin_id in analog_pins:
+                analog_pins.append(pin_id)
             else:
-                self._digital_pins.append(pin_id)
+                digital_pins.append(pin_id)
 
             if extra:
                 if 'pwm' in extra:
-                    self._pwm_pins.append(pin_id)
+                    pwm_pins.append(pin_id)
 
                 for match in list(filter(re.compile("led[0-9]+").match, extra)):
-                    self._leds.append({match: pin_id})
-                # spi
+                    leds.append({match: pin_id})
+                # i2c
                 for match in list(filter(re.compile("sda|scl").match, extra)):
                     num = re.findall(re.compile(r'\d+'), match) or ['0']
-                    # pylint: disable=expression-not-assigned
-                    self._i2c_interfaces.get(num[0]) or \
-                        self._i2c_interfaces.setdefault(num[0], {})
-                    self._i2c_interfaces[num[0]][match] = pin_id
-                # i2c
+                    i2c_interfaces.setdefault(num[0], {})[match] = pin_id
+                # spi
                 for match in list(filter(re.compile("ss|mosi|miso|sck").match, extra)):
                     num = re.findall(re.compile(r'\d+'), match) or ['0']
-                    # pylint: disable=expression-not-assigned
-                    self._spi_interfaces.get(num[0]) or \
-                        self._spi_interfaces.setdefault(num[0], {})
-                    self._spi_interfaces[num[0]][match] = pin_id
-
-
-        self._baudrate = self._boardfile['baudrate']
+                    spi_interfaces.setdefault(num[0], {})[match] = pin_id
+
+        self.pins = tuple(MappingProxyType(dict(pin, extra=tuple(pin.get('extra', []))))
+                          for pin in pins)
+        self._physical_pin_ids = tuple(pin['physical_id'] for pin in pins)
+        self._pin_ids = frozenset(self._physical_pin_ids)
+        self._aliases = MappingProxyType(
+            {pin['alias']: pin['physical_id'] for pin in pins if pin.get('alias')})
+        self._analog_pins = tuple(analog_pins)
+        self._digital_pins = tuple(digital_pins)
+        self._pwm_pins = tuple(pwm_pins)
+        self._leds = tuple(MappingProxyType(led) for led in leds)
+        self._led_pins = MappingProxyType({k: v for led in leds for k, v in led.items()})
+        self._i2c_interfaces = MappingProxyType(
+            {num: MappingProxyType(pins) for num, pins in i2c_interfaces.items()})
+        self._spi_interfaces = MappingProxyType(
+            {num: MappingProxyType(pins) for num, pins in spi_interfaces.items()})
+        self._baudrate = _boardfile['baudrate']
+        fwcfg = _boardfile.get('firmware') or {}
+        self._extra_libs = tuple(fwcfg.get('extra_libs') or ())
+        features = fwcfg.get('features')
+        self._features = tuple(features) if features is not None else None
+        self._rx_buffer = _boardfile.get('rx_buffer')
+
+    @classmethod
+    def get(cls, boardfile):
+        """
+            Return the shared BoardFile object of <boardfile>. The file is
+            only parsed again, when it was modified.
+        """
+        path = os.path.realpath(boardfile)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError as exc:
+            raise DeviceConfigError(f'Cannot open boardfile: {boardfile}') from exc
+        with cls._registry_lock:
+            cached = cls._registry.get(path)
+            if cached is None or cached[0] != mtime:
+                cached = cls._registry[path] = (mtime, cls(path))
+            return cached[1]
 
     @property
-    def analog_pins(self) -> list:
-        """ Return a list of analog pin id's """
+    def analog_pins(self) -> tuple:
+        """ Return a tuple of analog pin id's """
         return self._analog_pins
 
     @property
-    def digital_pins(self):
-        """ Return a list of digital pin id's """
+    def digital_pins(self) -> tuple:
+        """ Return a tuple of digital pin id's """
         return self._digital_pins
 
     @property
-    def pwm_pins(self) -> list:
-        """ return a list of pwm-capable pin id'w """
+    def pwm_pins(self) -> tuple:
+        """ return a tuple of pwm-capable pin id'w """
         return self._pwm_pins
 
     @property
-    def leds(self) -> list:
-        """ Return a List of pins that have an LED connected """
+    def leds(self) -> tuple:
+        """ Return a tuple of pins that have an LED connected """
         return self._leds
 
     @property
-    def i2c_interfaces(self) -> list:
-        """ Return a list of i2c interfaces """
+    def i2c_interfaces(self):
+        """ Return the i2c interfaces by number """
         return self._i2c_interfaces
 
     @property
-    def spi_interfaces(self) -> list:
-        """ Return a list of spi interfaces """
+    def spi_interfaces(self):
+        """ Return the spi interfaces by number """
         return self._spi_interfaces
 
     @property
@@ -264,31 +379,36 @@ class BoardFile:
 
     @property
     def physical_pin_ids(self):
-        """ Return a list of all pins """
+        """ Return a tuple of all pins """
         return self._physical_pin_ids
 
     @property
     def extra_libs(self):
-        """ Return a list of extra libraries to include in the firmware """
-        fwcfg = self._boardfile.get('firmware', False )
-        if fwcfg:
-            extra_libs = fwcfg.get('extra_libs', False)
-            if extra_libs:
-                return fwcfg['extra_libs']
-        return []
+        """ Return a tuple of extra libraries to include in the firmware """
+        return self._extra_libs
+
+    @property
+    def features(self):
+        """ Return the list of firmware features to build in, None for all """
+        return list(self._features) if self._features is not None else None
 
     @property
     def baudrate(self):
         """ Return the baudrate used to connect to this board """
         return self._baudrate
 
+    @property
+    def rx_buffer(self):
+        """ Return the serial receive buffer size of the board (bytes), if known """
+        return self._rx_buffer
+
     def led_to_pin(self, led_id):
         """ Resolve led[0-9] back to an actual pin id """
         led = f'led{led_id}'
-        pin = list(filter(lambda x: led in x ,self._leds))
-        if pin:
-            return pin[0][led]
-        raise LEDNotFoundError(led)
+        try:
+            return self._led_pins[led]
+        except KeyError as exc:
+            raise LEDNotFoundError(led) from exc
 
     def normalize_pin_id(self, pin_id):
         """ Return the physical_id of a pin. This function is used to
@@ -296,28 +416,28 @@ class BoardFile:
         """
         if isinstance(pin_id, str):
             try:
-                pin_id = [{'physical_id': int(pin_id)}]
+                pin_id = int(pin_id)
             except ValueError:
-                pin_id = list(filter(lambda x:  x.get('alias') == pin_id, self.pins))
-
-            try:
-                pin_id = pin_id[0]['physical_id']
-            except IndexError as exc:
-                raise PinNotFoundError(pin_id) from exc
+                try:
+                    pin_id = self._aliases[pin_id]
+                except KeyError as exc:
+                    raise PinNotFoundError(pin_id) from exc
 
-        if not pin_id in self.physical_pin_ids:
-            raise PinNotFoundError(pin_id)
-        return pin_id
-        #return int(self.get_pin_config(pin_id)['physical_id'])
+        try:
+            if pin_id in self._pin_ids:
+                return pin_id
+        except TypeError:
+            # unhashable
+            pass
+        raise PinNotFoundError(pin_id)
 
     def get_pin_config(self, pin_id:int):
-        """ Return the configuration dict of a pin """
-        print(type(pin_id))
+        """ Return the configuration of a pin """
         try:
-            return list(filter(lambda x: pin_id in ((x['physical_id']),
-                        x.get('alias')), self.pins))[0]
-        except IndexError:
+            pin_id = self.normalize_pin_id(pin_id)
+        except PinNotFoundError:
             return {}
+        return self.pins[self._physical_pin_ids.index(pin_id)]
 
 class AttrDict(dict):
     """ Helper class to ease the handling of ini files with configparser. """
@@ -410,11 +530,49 @@ class BuildEnv:
             self.logger.debug("Copying: %s", firmware)
             copyfile(self.utils.firmware, firmware)
 
-    def build(self):
-        """ Build the firmware and upload it to the device. """
+    def lib_deps(self, features):
+        """ Return the libraries (lib_deps_<feature> in platformio.ini) of <features> """
+        parser = configparser.ConfigParser(interpolation=None)
+        parser.read(self.platformio_ini)
+        libs = []
+        for feature in features:
+            value = parser.get('env', f'lib_deps_{feature}', fallback='')
+            libs += [lib.strip() for lib in value.splitlines() if lib.strip()]
+        return libs
+
+    def write_platformio_ini(self, features):
+        """
+            Write the platformio.ini of the project with the libraries of
+            <features> resolved, so `pio run` in the project dir builds the
+            same firmware. Return its path.
+        """
+        parser = configparser.ConfigParser(interpolation=None)
+        parser.read(self.platformio_ini)
+        libs = ['${env.lib_deps_builtin}'] + self.lib_deps(features)
+        parser.set('env', 'lib_deps', '\n' + '\n'.join(libs))
+        os.makedirs(self.project_dir, exist_ok=True)
+        target = os.path.join(self.project_dir, 'platformio.ini')
+        with open(target, 'w', encoding='utf-8') as ini:
+            parser.write(ini)
+        return target
+
+    @staticmethod
+    def size_report(output):
+        """ Return flash and ram usage {'flash': (used, total), ...} from the build output """
+        return {name.lower(): (int(used), int(total)) for name, used, total in
+                re.findall(r'(RAM|Flash):.*\(used (\d+) bytes from (\d+) bytes\)', output)}
+
+    def build(self, features, upload=True):
+        """
+            Build the firmware with the libraries of <features> and upload it
+            to the device. Return the size report, see size_report().
+        """
         os.chdir(self.workdir)
-        cmd = ['pio', 'run', '-e', self.board, '-t', 'upload', '--upload-port', self.tty,
-               '-d', self.project_dir, '-c', self.platformio_ini]
+        platformio_ini = self.write_platformio_ini(features)
+        cmd = ['pio', 'run', '-e', self.board, '-d', self.project_dir, '-c', platformio_ini]
+        if upload:
+            cmd += ['-t', 'upload', '--upload-port', self.tty]
         self.logger.debug(cmd)
-        out = subprocess.check_output(cmd)
+        out = subprocess.check_output(cmd).decode('utf-8', 'replace')
         print(out)
+        return self.size_report(out)
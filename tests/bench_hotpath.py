@@ -0,0 +1,46 @@
+# pylint: disable=C0116
+# -*- coding: utf-8 -*-
+"""
+    Microbenchmark of the Python side of the pin hot path. The device is
+    replaced by a connection that answers instantly, so only the overhead
+    of pyduin is measured.
+
+    python tests/bench_hotpath.py [calls]
+"""
+import sys
+import timeit
+
+from pyduin.arduino import Arduino
+
+
+class NullConnection:
+    """ Answers every frame instantly with the same reply """
+    reply = b'0%13%1\r\n'
+
+    def write(self, data):
+        return len(data)
+
+    def readline(self):
+        return self.reply
+
+    def close(self):
+        pass
+
+
+def main(calls=100000):
+    arduino = Arduino(board='uno', wait=True)
+    arduino.use_connection(NullConnection())
+    pin = arduino.get_pin(13)
+    cases = {
+        'pin.high()': pin.high,
+        'pin.read()': pin.read,
+        'send(str frame)': lambda: arduino.send(pin.frame('high')),
+        'send(bytes frame)': lambda: arduino.send(pin.frames['high']),
+    }
+    for name, func in cases.items():
+        seconds = min(timeit.repeat(func, number=calls, repeat=3))
+        print(f'{name:20} {seconds / calls * 1e6:8.2f} us/call')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -1,6 +1,9 @@
 # pylint: disable=W0621,C0116,C0114
 # -*- coding: utf-8 -*-
 #pytest_plugins = ['device']
+import re
+import time
+from collections import deque
 import pytest
 import serial
 
@@ -35,6 +38,204 @@ class FailingSerialMock():
     def __init__(self, tty, baudrate, timeout=0):
         raise serial.SerialException
 
+# pylint: disable=R0902
+class DeviceSimulator():
+    """ Answers frames the way the firmware does """
+    baudrates = (9600, 19200, 38400, 57600, 115200, 230400, 250000, 500000, 1000000, 2000000)
+    broken_baudrates = ()
+    probation = 2
+    # The device clock runs fast by this fraction and starts at <clock_start> µs
+    clock_drift = 0.0
+    clock_start = 0
+
+    def __init__(self, tty, baudrate, timeout=0):
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.device_baudrate = baudrate
+        self.fallback_baudrate = baudrate
+        self.probation_deadline = 0
+        self.replies = deque()
+        self.in_flight = deque()
+        self.max_in_flight = 0
+        self.written = []
+        self.values = {}
+        self.modes = {}
+        self.waveforms = {}
+        self.rebooting = False
+        self.spi_written = bytearray()
+        self.spi_exchanges = 0
+        self.spi_open = False
+        self.i2c_devices = {0x3c: bytearray(256), 0x68: bytearray(range(256))}
+        self.booted = time.monotonic()
+
+    @property
+    def micros(self):
+        elapsed = (time.monotonic() - self.booted) * (1 + self.clock_drift)
+        return (self.clock_start + int(elapsed * 1e6)) % 2 ** 32
+
+    @property
+    def link_ok(self):
+        if self.probation_deadline and time.monotonic() >= self.probation_deadline:
+            self.probation_deadline = 0
+            self.device_baudrate = self.fallback_baudrate
+        return self.baudrate == self.device_baudrate and \
+            self.baudrate not in self.broken_baudrates
+
+    def reboot(self):
+        """ Reset the device. The next write is lost and answered by the boot banner. """
+        self.values.clear()
+        self.modes.clear()
+        self.rebooting = True
+
+    def write(self, message):
+        self.written.append(message)
+        if self.rebooting:
+            self.rebooting = False
+            self.replies.append('Boot complete')
+            return
+        for frame in re.findall(r'<([^>]*)>', message.decode('utf-8')):
+            # Bytes sent but not answered yet (would sit in the rx buffer)
+            self.in_flight.append(len(frame) + 2)
+            self.max_in_flight = max(self.max_in_flight, sum(self.in_flight))
+            if not self.link_ok:
+                self.replies.append(b'\x00\xfe\xa3')
+                continue
+            self.replies.append(self.handle(frame))
+
+    def readline(self):
+        if self.in_flight:
+            self.in_flight.popleft()
+        if not self.replies:
+            return b''
+        reply = self.replies.popleft()
+        if isinstance(reply, str):
+            reply = reply.encode('utf-8')
+        return reply + b'\r\n'
+
+    def reset_input_buffer(self):
+        self.replies.clear()
+        self.in_flight.clear()
+
+    def close(self):
+        pass
+
+    def handle(self, frame):  # pylint: disable=R0911
+        if len(frame) < 7 or (len(frame) > 7 and frame[7] != ':'):
+            return f'Invalid command:{frame}'
+        cmd, typ, pin, val = frame[0], frame[1], int(frame[2:4]), int(frame[4:7])
+        payload = frame[8:]
+        if cmd == 'z':
+            return self.handle_system(typ, val)
+        if cmd == 'P':
+            return f'0%{pin}%{self.handle_playback(typ, pin, payload)}'
+        if cmd == 'I':
+            return f'0%{pin}%{self.handle_i2c(typ, pin, val, payload)}'
+        if cmd == 'G':
+            return f'0%{pin}%{self.handle_group(typ, payload)}'
+        if cmd == 'X':
+            return f'0%{pin}%{self.handle_spi(typ, pin, payload)}'
+        if cmd == 'M' and typ in 'IOP':
+            self.modes[pin] = typ
+        if cmd == 'A' and typ == 'W':
+            self.waveforms.pop(pin, None)
+        if cmd in 'AD' and typ == 'W':
+            self.values[pin] = val
+        elif cmd in 'AD' and typ == 'R' and val == 1:
+            return f'0%{pin}%{self.values.get(pin, 0)}%{self.micros}'
+        elif cmd in 'AD' and typ == 'R':
+            val = self.values.get(pin, 0)
+        return f'0%{pin}%{val}'
+
+    def handle_playback(self, typ, pin, payload):
+        values = [int(value) for value in payload.split(',') if value]
+        if typ == 'S':
+            self.waveforms.pop(pin, None)
+            return 0
+        if pin not in (3, 5, 6, 9, 10, 11) or (typ == 'R' and len(values) != 5) or \
+                (typ == 'T' and len(values) < 3):
+            return -1
+        self.waveforms[pin] = (typ, values)
+        return values[0] if typ == 'R' else len(values) - 2
+
+    def handle_i2c(self, typ, bus, address, payload):
+        if bus != 0:
+            return -1
+        if typ == 'S':
+            return bytes(sorted(self.i2c_devices)).hex()
+        device = self.i2c_devices.get(address)
+        register, _, data = payload.partition(',')
+        register = max(int(register or -1), 0)
+        if device is None:
+            return -1
+        if typ == 'R' and 0 < int(data) <= 32:
+            return bytes(device[register:register + int(data)]).hex()
+        if typ == 'W' and len(data) <= 64:
+            data = bytes.fromhex(data)
+            device[register:register + len(data)] = data
+            return len(data)
+        return -1
+
+    def handle_group(self, typ, payload):
+        value, *pins = (int(value) for value in payload.split(','))
+        if not pins or typ not in 'WR' or any(not 0 <= pin < 20 for pin in pins):
+            return -1
+        if typ == 'R':
+            return sum(bool(self.values.get(pin, 0)) << bit for bit, pin in enumerate(pins))
+        for bit, pin in enumerate(pins):
+            self.values[pin] = (value >> bit) & 1
+        return value
+
+    def handle_spi(self, typ, bus, payload):
+        # Loopback with inverted bits
+        _clock, mode, count, data, *flags = payload.split(',')
+        data = bytes.fromhex(data)
+        flags = int(flags[0]) if flags else 3
+        if bus != 0 or int(mode) > 3 or len(data) != int(count) or len(data) > 32:
+            return -1
+        if not flags & 1 and not self.spi_open:
+            return -1
+        if flags & 1:
+            self.spi_exchanges += 1
+        self.spi_open = not flags & 2
+        self.spi_written += data
+        return bytes(byte ^ 0xff for byte in data).hex() if typ == 'T' else len(data)
+
+    def handle_system(self, typ, val):  # pylint: disable=R0911
+        if typ == 'b' and val < len(self.baudrates):
+            if not self.probation_deadline:
+                self.fallback_baudrate = self.device_baudrate
+            self.probation_deadline = time.monotonic() + self.probation
+            self.device_baudrate = self.baudrates[val]
+            return f'0%baudrate%{self.baudrates[val]}'
+        if typ == 'k':
+            self.probation_deadline = 0
+            self.fallback_baudrate = self.device_baudrate
+            return f'0%baudrate%{self.device_baudrate}'
+        if typ == 'e':
+            return f'0%echo%{val}'
+        if typ == 't':
+            return f'0%time%{self.micros}'
+        if typ == 'v':
+            return '0%version%0.8.0'
+        if typ == 'd':
+            return '0%describe%version=0.8.0;hash=0123abcd;pins=18;pwm=3,5,6,9,10,11;' \
+                   'analog=14,15,16,17,18,19;rx=64;i2c=32;spi=32;ops=zz,zv,zb,zk,ze,zd,zt,' \
+                   'AR,AW,DR,DW,MI,MO,MP,MR,PR,PT,PS,GW,GR,IS,IR,IW,XT,XW,WR,SR'
+        return '0%free_mem%1234'
+
+
+@pytest.fixture(scope="function")
+def simulator_fixture(monkeypatch):
+    monkeypatch.setattr('serial.Serial', DeviceSimulator)
+    yield Device('uno', tty='/mock/tty', wait=True)
+
+
+@pytest.fixture(scope="function")
+def metrics_fixture(monkeypatch):
+    monkeypatch.setattr('serial.Serial', DeviceSimulator)
+    yield Device('uno', tty='/mock/tty', wait=True, metrics=True)
+
+
 @pytest.fixture(scope="function")
 def device_fixture(monkeypatch):
     monkeypatch.setattr('serial.Serial', SerialMock)
@@ -1,7 +1,10 @@
 # pylint: disable=W0621,C0116,C0114
 # -*- coding: utf-8 -*-
 
+import os
+import shutil
 import pytest
+from pyduin.arduino import Arduino
 from pyduin.utils import PinNotFoundError, BoardFile
 
 @pytest.fixture(scope="module")
@@ -11,19 +14,19 @@ def boardfile_fixture():
 
 
 def test_digital_pins(boardfile_fixture):
-    expected = [2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13]
+    expected = (2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13)
     assert boardfile_fixture.digital_pins == expected
 
 def test_analog_pins(boardfile_fixture):
-    expected =  [14, 15, 16, 17, 18, 19, 20, 21]
+    expected =  (14, 15, 16, 17, 18, 19, 20, 21)
     assert boardfile_fixture.analog_pins == expected
 
 def test_pwm_pins(boardfile_fixture):
-    expected = [3, 5, 6, 9, 10, 11]
+    expected = (3, 5, 6, 9, 10, 11)
     assert boardfile_fixture.pwm_pins == expected
 
 def test_led_pins(boardfile_fixture):
-    expected = [{'led1': 3}, {'led10': 5}]
+    expected = ({'led1': 3}, {'led10': 5})
     assert boardfile_fixture.leds == expected
 
 def test_led_to_pin(boardfile_fixture):
@@ -41,7 +44,7 @@ def test_spi_interfaces(boardfile_fixture):
     assert boardfile_fixture.spi_interfaces == expected
 
 def test_all_physical_pins(boardfile_fixture):
-    expected = [2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21]
+    expected = (2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21)
     assert boardfile_fixture.physical_pin_ids == expected
 
 def test_num_physical_pins(boardfile_fixture):
@@ -57,3 +60,26 @@ def test_normalize_pin_failure(boardfile_fixture):
     for data in dataset:
         with pytest.raises(PinNotFoundError) as result:
             assert boardfile_fixture.normalize_pin_id(data) == result
+
+def test_get_pin_config(boardfile_fixture):
+    assert boardfile_fixture.get_pin_config('D13')['physical_id'] == 13
+    assert boardfile_fixture.get_pin_config(99) == {}
+
+def test_immutable(boardfile_fixture):
+    with pytest.raises(TypeError):
+        boardfile_fixture.i2c_interfaces['0']['sda'] = 3
+    with pytest.raises(AttributeError):
+        boardfile_fixture.cache = {}
+    assert isinstance(boardfile_fixture.pins[0]['extra'], tuple)
+
+def test_registry(tmp_path):
+    path = tmp_path / 'nano2.yml'
+    shutil.copy('tests/data/boardfiles/nano2.yml', path)
+    boardfile = BoardFile.get(str(path))
+    assert BoardFile.get(str(tmp_path / '.' / 'nano2.yml')) is boardfile
+    devices = [Arduino(boardfile=str(path)) for _ in range(3)]
+    assert all(device.boardfile is boardfile for device in devices)
+    # modified boardfiles are parsed again
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000))
+    assert BoardFile.get(str(path)) is not boardfile
@@ -0,0 +1,73 @@
+# pylint: disable=W0621,C0116,C0114
+# -*- coding: utf-8 -*-
+import pytest
+from pyduin.utils import BusError, DeviceConfigError
+
+
+def test_i2c_scan(simulator_fixture):
+    assert simulator_fixture.i2c().scan() == [0x3c, 0x68]
+    assert simulator_fixture.Connection.written[-1] == b'<IS00000>'
+
+def test_i2c_bus_cached(simulator_fixture):
+    assert simulator_fixture.i2c() is simulator_fixture.i2c(0)
+    assert simulator_fixture.i2c().block == 32
+
+def test_i2c_invalid_bus(simulator_fixture):
+    with pytest.raises(DeviceConfigError):
+        simulator_fixture.i2c(9)
+
+def test_i2c_read_register(simulator_fixture):
+    assert simulator_fixture.i2c().read_register(0x68, 0x3b) == 0x3b
+    assert simulator_fixture.Connection.written[-1] == b'<IR00104:59,1>'
+
+def test_i2c_read_block_chunked(simulator_fixture):
+    data = simulator_fixture.i2c().read_block(0x68, 16, 80)
+    assert data == bytes(range(16, 96))
+    assert simulator_fixture.Connection.written[-1] == \
+        b'<IR00104:16,32><IR00104:48,32><IR00104:80,16>'
+
+def test_i2c_write_block_chunked(simulator_fixture):
+    bus = simulator_fixture.i2c()
+    assert bus.write_block(0x3c, 0, bytes(range(1, 41))) == 40
+    assert b''.join(simulator_fixture.Connection.written).count(b'<IW') == 2
+    assert bus.read_block(0x3c, 0, 40) == bytes(range(1, 41))
+
+def test_i2c_write_register(simulator_fixture):
+    bus = simulator_fixture.i2c()
+    assert bus.write_register(0x3c, 0x10, 0xff) == 1
+    assert simulator_fixture.Connection.written[-1] == b'<IW00060:16,ff>'
+    assert bus.read_register(0x3c, 0x10) == 0xff
+
+def test_i2c_nack(simulator_fixture):
+    with pytest.raises(BusError):
+        simulator_fixture.i2c().read_register(0x20, 0)
+
+def test_i2c_invalid_address(simulator_fixture):
+    with pytest.raises(ValueError):
+        simulator_fixture.i2c().read(0x80, 1)
+
+def test_spi_transfer(simulator_fixture):
+    bus = simulator_fixture.spi(clock=4000000, mode=3)
+    assert bus.cs == 10
+    assert bus.transfer(b'\x01\x02\xff') == b'\xfe\xfd\x00'
+    assert simulator_fixture.Connection.written[-1] == b'<XT00010:4000000,3,3,0102ff>'
+
+def test_spi_transfer_chunked(simulator_fixture):
+    data = bytes(range(70))
+    bus = simulator_fixture.spi(cs=0)
+    assert bus.transfer(memoryview(data)) == bytes(byte ^ 0xff for byte in data)
+    written = b''.join(simulator_fixture.Connection.written)
+    assert written.count(b'<XT00000:') == 3
+    assert written.endswith(b',1><XT00000:1000000,0,32,' + data[32:64].hex().encode() +
+                            b',0><XT00000:1000000,0,6,' + data[64:].hex().encode() + b',2>')
+    # one exchange, chip select is held across the frames
+    assert simulator_fixture.Connection.spi_exchanges == 1
+    assert not simulator_fixture.Connection.spi_open
+
+def test_spi_write(simulator_fixture):
+    assert simulator_fixture.spi().write(bytearray(b'\xaa\x55')) == 2
+    assert simulator_fixture.Connection.spi_written == b'\xaa\x55'
+
+def test_spi_invalid_mode(simulator_fixture):
+    with pytest.raises(ValueError):
+        simulator_fixture.spi(mode=4)
@@ -0,0 +1,105 @@
+# pylint: disable=W0621,C0116,C0114
+# -*- coding: utf-8 -*-
+import io
+import json
+import types
+import pytest
+import yaml
+from pyduin import arduino_cli, DeviceConfigError
+from pyduin.utils import CONFIG_TEMPLATE, PyduinUtils
+
+SCRIPT = """
+# provisioning
+pin 13 mode output
+pin 13 high
+pin 3 pwm 100   # dimmed
+pin 13 read
+led 1 off
+free
+versions
+"""
+
+
+def run(simulator, script, as_json=False):
+    args = types.SimpleNamespace(script=io.StringIO(script), json=as_json)
+    return arduino_cli.run_script(simulator, {'workdir': '/nonexistent'}, args)
+
+
+def test_run_script(simulator_fixture, capsys):
+    connection = simulator_fixture.Connection
+    results = run(simulator_fixture, SCRIPT)
+    assert results[:6] == ['1', '1', '100', '1', '0', '1234']
+    assert results[6]['device'] == '0.8.0'
+    # all frames of the script in one batch (split by the flow control window)
+    assert len(connection.written) == 2
+    assert b''.join(connection.written) == b'<MO13001><DW13001><AW03100><DR13000><MO13001><DW13000>' \
+                                    b'<zz00000><zv00000>'
+    assert capsys.readouterr().out.splitlines()[:3] == ['1', '1', '100']
+    # state is tracked for restore_state()
+    assert simulator_fixture.get_pin(13).Mode.message == '<MO13001>'
+    assert simulator_fixture.get_pin(3).output == '<AW03100>'
+
+
+def test_run_script_json(simulator_fixture, capsys):
+    run(simulator_fixture, 'pin 13 high\nfree\n', as_json=True)
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert lines == [{'line': 1, 'command': 'pin 13 high', 'result': '1'},
+                     {'line': 2, 'command': 'free', 'result': '1234'}]
+
+
+def test_run_script_invalid(simulator_fixture):
+    connection = simulator_fixture.Connection
+    connection.written.clear()
+    for script in ('pin 13 high\npin 13 blink\n', 'log 13\n', 'pin 4 pwm 10\n', 'pin 13\n',
+                   'pin 42 high\n', 'led 7 on\n'):
+        with pytest.raises(DeviceConfigError):
+            run(simulator_fixture, script)
+    # nothing is sent and no pin state is tracked, if a line is invalid
+    assert not connection.written
+    with pytest.raises(DeviceConfigError):
+        run(simulator_fixture, 'pin 13 mode output\npin 3 pwm 10\npin 13 blink\n')
+    assert not simulator_fixture.get_pin(13).Mode.message
+    assert not simulator_fixture.get_pin(3).output
+    assert simulator_fixture.restore_state() == []
+
+
+def test_pwm_unsupported(simulator_fixture, capsys):
+    args = types.SimpleNamespace(cmd='pin', pincmd='pwm', pin='4', value=10)
+    with pytest.raises(SystemExit) as exc:
+        arduino_cli.run_command(simulator_fixture, {'workdir': '/nonexistent'}, args)
+    assert exc.value.code == 1
+    assert 'not pwm capable' in capsys.readouterr().out
+
+
+def test_template_firmware_boot_baudrate(simulator_fixture, tmp_path):
+    firmware = tmp_path / 'uno' / 'src' / 'pyduin.cpp'
+    firmware.parent.mkdir(parents=True)
+    firmware.write_text('{{ baudrate }}')
+    simulator_fixture.resume_baudrate(1000000)
+    config = {'workdir': str(tmp_path), '_arduino_': {'board': 'uno', 'arduino_id': 1}}
+    arduino_cli.template_firmware(simulator_fixture, config)
+    assert firmware.read_text() == '115200'
+
+
+def test_update_buddy_cfg(tmp_path):
+    path = tmp_path / 'pyduin.yml'
+    path.write_text(CONFIG_TEMPLATE)
+    PyduinUtils.update_buddy_cfg(str(path), 'nano1', 'link_baudrate', 1000000)
+    PyduinUtils.update_buddy_cfg(str(path), 'nano1', 'tty', '/dev/ttyUSB0')
+    PyduinUtils.update_buddy_cfg(str(path), 'mega1', 'tty', '/dev/ttyACM0')
+    text = path.read_text()
+    # comments and the order of the file are kept
+    assert text.startswith(CONFIG_TEMPLATE.split('buddies:', 1)[0])
+    assert '#default_buddy: nano1' in text
+    config = yaml.safe_load(text)
+    assert config['buddies']['nano1'] == {'board': 'nanoatmega238', 'use_socat': True,
+                                          'tty': '/dev/ttyUSB0', 'link_baudrate': 1000000}
+    assert config['buddies']['mega1'] == {'tty': '/dev/ttyACM0'}
+    assert config['buddies']['uno1'] == {'board': 'uno'}
+
+def test_update_buddy_cfg_flow_style(tmp_path):
+    path = tmp_path / 'pyduin.yml'
+    path.write_text('buddies: {uno1: {board: uno}}\n')
+    with pytest.raises(DeviceConfigError):
+        PyduinUtils.update_buddy_cfg(str(path), 'uno1', 'tty', '/dev/ttyACM0')
+    assert path.read_text() == 'buddies: {uno1: {board: uno}}\n'
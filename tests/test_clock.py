@@ -0,0 +1,104 @@
+# pylint: disable=W0621,C0116,C0114
+# -*- coding: utf-8 -*-
+import time
+import pytest
+from pyduin.clock import ClockSync
+
+
+def test_clock_fit():
+    clock = ClockSync()
+    # device clock 100 ppm fast, micros() wraps after the second exchange,
+    # delayed round trips are left out
+    for host, rtt in ((1000.0, 0.001), (1003.0, 0.05), (1004.0, 0.001), (1006.0, 0.04),
+                      (1008.0, 0.001), (1010.0, 0.001)):
+        device_us = (2 ** 32 - 3500000 + int((host - 1000.0) * 1.0001e6)) % 2 ** 32
+        clock.add(device_us, host - rtt / 2, host + rtt / 2)
+    clock.fit()
+    assert clock.drift == pytest.approx(1 / 1.0001 - 1, abs=1e-7)
+    assert clock.rtt == pytest.approx(0.001)
+    assert clock.to_host((2 ** 32 - 3500000 + 5000500) % 2 ** 32) == pytest.approx(1005.0)
+    assert clock.as_dict()['exchanges'] == 6
+
+
+def test_clock_short_baseline():
+    clock = ClockSync()
+    # 1 % drift, but over 0.1 s the jitter of the round trips outweighs it
+    for step, rtt in enumerate((0.001, 0.003, 0.001, 0.002, 0.001)):
+        host = 10.0 + step * 0.025
+        clock.add(int(step * 0.025 * 1.01e6), host - rtt / 2, host + rtt / 2)
+    clock.fit()
+    assert clock.drift == 0.0
+    assert clock.to_host(0) == pytest.approx(10.0, abs=1e-3)
+
+
+def test_clock_no_exchanges(simulator_fixture):
+    with pytest.raises(ValueError):
+        ClockSync().fit()
+    with pytest.raises(ValueError):
+        simulator_fixture.sync_clock(exchanges=0)
+
+
+def test_clock_single_exchange():
+    clock = ClockSync()
+    assert not clock.synced
+    clock.add(5000000, 10.0, 10.002)
+    clock.fit()
+    assert clock.drift == 0.0
+    assert clock.to_host(5500000) == pytest.approx(10.501)
+
+
+class FakeClock:
+    """ time.monotonic() that advances by a fixed step per call, time.sleep() that does not wait """
+
+    def __init__(self, step=0.0001):
+        self.now = 100.0
+        self.step = step
+
+    def monotonic(self):
+        self.now += self.step
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture(scope="function")
+def fake_clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(time, 'monotonic', fake.monotonic)
+    monkeypatch.setattr(time, 'sleep', fake.sleep)
+    yield fake
+
+
+def test_sync_clock(simulator_fixture, fake_clock):
+    device = simulator_fixture.Connection
+    device.clock_drift = 0.01
+    device.clock_start = 2 ** 32 - 50000
+    device.booted = fake_clock.now
+    # a short sync only fits the offset
+    clock = simulator_fixture.sync_clock(exchanges=10, interval=0.01)
+    assert clock.drift == 0.0
+    clock = simulator_fixture.sync_clock(exchanges=10, interval=1)
+    assert clock.drift == pytest.approx(1 / 1.01 - 1, abs=1e-6)
+    assert simulator_fixture.device_time(device.micros) == \
+        pytest.approx(time.monotonic(), abs=5e-4)
+
+
+def test_clock_fastest_bunched():
+    clock = ClockSync()
+    # the fastest exchanges are all at the start, the fit still spans 9 s
+    for step in range(10):
+        rtt = 0.001 if step < 5 else 0.002
+        clock.add(int(step * 1.01e6), step - rtt / 2, step + rtt / 2)
+    assert clock.fit().drift == pytest.approx(1 / 1.01 - 1, abs=1e-6)
+
+
+def test_read_timestamp(simulator_fixture):
+    pin = simulator_fixture.get_pin(13)
+    pin.high()
+    before = time.monotonic()
+    reply, at = pin.read(timestamp=True)
+    assert reply == '0%13%1'
+    assert before - 1e-3 <= at <= time.monotonic() + 1e-3
+    assert simulator_fixture.clock.synced
+    assert pin.read() == '0%13%1'
@@ -0,0 +1,67 @@
+# pylint: disable=W0621,C0116,C0114
+# -*- coding: utf-8 -*-
+import time
+import pytest
+from pyduin.coalesce import CoalescingWriter
+from pyduin.utils import UnsupportedOperationError
+
+
+def test_coalesce(simulator_fixture):
+    writer = CoalescingWriter(simulator_fixture)
+    connection = simulator_fixture.Connection
+    written = len(connection.written)
+    for value in range(100):
+        writer.pwm(9, value)
+        writer.pwm(10, 255 - value)
+    writer.write(13, 'high')
+    assert writer.flush() == {9: '0%9%99', 10: '0%10%156', 13: '0%13%1'}
+    assert connection.written[written:] == [b'<AW09099><AW10156><DW13001>']
+    assert writer.stats() == {'queued': 201, 'dropped': 198, 'sent': 3, 'flushes': 1,
+                              'pending': 0}
+    assert not writer.flush()
+    # restored after a reset
+    assert simulator_fixture.get_pin(9).output == b'<AW09099>'
+    with pytest.raises(UnsupportedOperationError):
+        writer.pwm(2, 100)
+    with pytest.raises(ValueError):
+        writer.write(2, 'read')
+
+
+def test_coalesce_read(simulator_fixture):
+    writer = CoalescingWriter(simulator_fixture)
+    writer.write(13, 'high')
+    assert writer.read(13) == '0%13%1'
+    assert writer.stats()['pending'] == 0
+
+
+def test_coalesce_background(simulator_fixture):
+    writer = simulator_fixture.coalescing_writer(rate=20)
+    start = time.monotonic()
+    while time.monotonic() - start < 0.3:
+        writer.pwm(9, int((time.monotonic() - start) * 500))
+        time.sleep(0.001)
+    writer.pwm(9, 200)
+    simulator_fixture.close_serial_connection()
+    stats = writer.stats()
+    # at most 20 flushes per second, the last value is always sent
+    assert 2 <= stats['flushes'] <= 8
+    assert stats['sent'] == stats['flushes']
+    assert simulator_fixture.Connection.values[9] == 200
+
+
+def test_coalesce_close_on_error(simulator_fixture, monkeypatch):
+    writer = simulator_fixture.coalescing_writer(rate=20)
+    stop = writer.stop
+    closed = []
+
+    def fail():
+        stop()
+        raise OSError('write failed')
+
+    monkeypatch.setattr(writer, 'stop', fail)
+    monkeypatch.setattr(simulator_fixture.Connection, 'close', lambda: closed.append(True))
+    with pytest.raises(OSError):
+        simulator_fixture.close_serial_connection()
+    # the port is closed, even if the last flush failed
+    assert closed == [True]
+    assert simulator_fixture._writer is None  # pylint: disable=protected-access
@@ -0,0 +1,100 @@
+# pylint: disable=W0621,C0116,C0114
+# -*- coding: utf-8 -*-
+import csv
+import os
+import time
+import pytest
+from pyduin import datalog
+
+
+def test_send_batch(simulator_fixture):
+    simulator_fixture.get_pin(13).high()
+    replies = simulator_fixture.send_batch(['<DR13000>', '<AR14000>', '<DW13000>'])
+    assert replies == ['0%13%1', '0%14%0', '0%13%0']
+    assert simulator_fixture.Connection.written[-1] == b'<DR13000><AR14000><DW13000>'
+
+def test_writer_batches(tmp_path):
+    path = str(tmp_path / 'batch.pdl')
+    writer = datalog.ColumnarWriter(path, ['A0'], batch=10)
+    header_size = os.path.getsize(path)
+    assert header_size % datalog.ALIGNMENT == 0
+    for num in range(9):
+        writer.append(float(num), [num])
+    assert os.path.getsize(path) == header_size
+    writer.append(9.0, [9])
+    assert os.path.getsize(path) == header_size + 10 * 10
+    writer.close()
+    assert [row[1] for row in datalog.read_rows(path)] == list(range(10))
+
+def test_writer_rotation(tmp_path):
+    path = str(tmp_path / 'rotate.pdl')
+    writer = datalog.ColumnarWriter(path, ['A0', 'A1'], batch=5, rotate_bytes=256)
+    for num in range(40):
+        writer.append(float(num), [num, -num])
+    writer.close()
+    assert writer.files[0] == str(tmp_path / 'rotate.0000.pdl')
+    assert len(writer.files) > 1
+    rows = [row for path in writer.files for row in datalog.read_rows(path)]
+    assert [row[2] for row in rows] == [-num for num in range(40)]
+
+def test_writer_flush_interval(tmp_path):
+    path = str(tmp_path / 'interval.pdl')
+    writer = datalog.ColumnarWriter(path, ['A0'], batch=1000, flush_interval=0.05)
+    header_size = os.path.getsize(path)
+    writer.append(0.0, [0])
+    assert os.path.getsize(path) == header_size
+    time.sleep(0.06)
+    writer.append(1.0, [1])
+    assert os.path.getsize(path) == header_size + 2 * 10
+    writer.close()
+
+def test_writer_rotation_time(tmp_path):
+    path = str(tmp_path / 'rotate.pdl')
+    writer = datalog.ColumnarWriter(path, ['A0'], batch=1000, rotate_seconds=0.05)
+    writer.append(0.0, [0])
+    time.sleep(0.06)
+    writer.append(1.0, [1])
+    writer.append(2.0, [2])
+    writer.close()
+    assert len(writer.files) == 2
+    assert [[row[1] for row in datalog.read_rows(path)] for path in writer.files] == [[0, 1], [2]]
+
+def test_data_logger(simulator_fixture, tmp_path):
+    path = str(tmp_path / 'log.pdl')
+    simulator_fixture.get_pin(13).high()
+    simulator_fixture.Connection.values[14] = 123
+    logger = datalog.DataLogger(simulator_fixture, ['A0', 13], rate=1000, path=path)
+    assert logger.run(samples=50) == 50
+    header, _ = datalog.read_header(path)
+    assert header['columns'] == ['time', 'A0', '13']
+    assert header['board'] == 'uno'
+    rows = list(datalog.read_rows(path))
+    assert len(rows) == 50
+    assert {row[1:] for row in rows} == {(123, 1)}
+    assert rows[-1][0] >= rows[0][0]
+
+def test_data_logger_without_replies(simulator_fixture, tmp_path):
+    path = str(tmp_path / 'log.pdl')
+    simulator_fixture.wait = False
+    logger = datalog.DataLogger(simulator_fixture, ['A0', 13], rate=1000, path=path)
+    assert logger.run(samples=5) == 5
+    assert {row[1:] for row in datalog.read_rows(path)} == {(datalog.MISSING,) * 2}
+
+def test_export_csv(simulator_fixture, tmp_path):
+    path = str(tmp_path / 'log.pdl')
+    logger = datalog.DataLogger(simulator_fixture, ['A0'], rate=1000, path=path)
+    logger.run(samples=3)
+    csvpath = datalog.export_csv(path, str(tmp_path / 'log.csv'))
+    with open(csvpath, encoding='utf-8') as csvfile:
+        rows = list(csv.reader(csvfile))
+    assert rows[0] == ['time', 'A0']
+    assert len(rows) == 4
+
+def test_load_numpy(simulator_fixture, tmp_path):
+    pytest.importorskip('numpy')
+    path = str(tmp_path / 'log.pdl')
+    simulator_fixture.Connection.values[15] = 42
+    datalog.DataLogger(simulator_fixture, ['A1'], rate=1000, path=path).run(samples=20)
+    data = datalog.load(path)
+    assert data.shape == (20,)
+    assert (data['A1'] == 42).all()
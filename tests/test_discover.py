@@ -0,0 +1,48 @@
+# pylint: disable=W0621,C0116,C0114
+# -*- coding: utf-8 -*-
+import os
+import threading
+import time
+import pytest
+from pyduin import discover
+
+
+def respond(master, reply, banner=False):
+    """ Answer the first probe on <master> like the firmware """
+    if banner:
+        os.read(master, 100)
+        os.write(master, b'Boot complete\r\n')
+    os.read(master, 100)
+    os.write(master, reply)
+
+
+@pytest.fixture(scope="function")
+def ports_fixture():
+    ptys = [os.openpty() for _ in range(4)]
+    yield [(master, os.ttyname(slave)) for master, slave in ptys]
+    for master, slave in ptys:
+        os.close(master)
+        os.close(slave)
+
+
+def test_discover(ports_fixture):
+    replies = [(b'3%version%0.7.0\r\n', False), (b'5%version%0.7.0\r\n', True),
+               (b'garbage\r\n', False)]
+    for (master, _), (reply, banner) in zip(ports_fixture, replies):
+        threading.Thread(target=respond, args=(master, reply, banner), daemon=True).start()
+    start = time.monotonic()
+    devices = discover.discover([tty for _, tty in ports_fixture] + ['/dev/nonexistent'],
+                                timeout=0.5)
+    assert time.monotonic() - start < 1.5
+    assert devices == [
+        {'tty': ports_fixture[0][1], 'arduino_id': 3, 'version': '0.7.0'},
+        {'tty': ports_fixture[1][1], 'arduino_id': 5, 'version': '0.7.0'}]
+
+def test_match_buddies():
+    devices = [{'tty': '/dev/ttyUSB0', 'arduino_id': 3, 'version': '0.7.0'},
+               {'tty': '/dev/ttyUSB1', 'arduino_id': 5, 'version': '0.7.0'},
+               {'tty': '/dev/ttyUSB2', 'arduino_id': 5, 'version': '0.7.0'}]
+    buddies = {'uno': {'board': 'uno', 'arduino_id': 3},
+               'twin': {'board': 'uno', 'arduino_id': 5},
+               'nano': {'board': 'nanoatmega328'}}
+    assert discover.match_buddies(devices, buddies) == {'uno': devices[0]}
@@ -0,0 +1,226 @@
+# pylint: disable=W0621,C0116,C0114
+# -*- coding: utf-8 -*-
+import configparser
+import shutil
+import time
+import pytest
+from pyduin.arduino import Arduino
+from pyduin.firmware import FEATURES, HostBuild, HostDevice, firmware_env, \
+    render_firmware, resolve_features
+from pyduin.utils import BuildEnv, DeviceConfigError, UnsupportedOperationError
+from pyduin import BoardFile, _utils as utils
+
+pytestmark = pytest.mark.skipif(not shutil.which('c++'), reason="No C++ compiler")
+
+
+@pytest.fixture(scope="module")
+def host_fixture(tmp_path_factory):
+    binary = HostBuild(str(tmp_path_factory.mktemp('workdir')), 'uno').build(arduino_id=7)
+    with HostDevice(binary) as device:
+        arduino = Arduino(board='uno', tty=device.tty, wait=True, serial_timeout=2)
+        yield arduino
+        arduino.close_serial_connection()
+
+
+def test_render_firmware():
+    fwenv = firmware_env(BoardFile(utils.board_boardfile('uno')), 115200, arduino_id=3)
+    source = render_firmware('{{ arduino_id }};{{ baudrate }};{{ build_hash }}', fwenv)
+    assert source.startswith('3;115200;')
+    assert source != render_firmware('{{ arduino_id }};{{ baudrate }};{{ build_hash }}',
+                                     dict(fwenv, baudrate=9600))
+    # pins 2-19, pwm 3,5,6,9,10,11, analog 14-19
+    assert fwenv['pin_map'] == '{0xfc, 0xff, 0x0f}'
+    assert fwenv['pwm_map'] == '{0x68, 0x0e, 0x00}'
+    assert fwenv['analog_map'] == '{0x00, 0xc0, 0x0f}'
+    assert fwenv['pin_map_bits'] == 24
+
+
+def test_features():
+    assert resolve_features(None) == ['free_memory', 'playback', 'group', 'onewire', 'dht']
+    assert resolve_features(None, FEATURES) == ['free_memory', 'playback', 'group', 'i2c',
+                                                'spi', 'capture', 'macro', 'onewire', 'dht']
+    assert resolve_features(['spi', 'group']) == ['group', 'spi']
+    with pytest.raises(DeviceConfigError):
+        resolve_features(['group', 'lcd'])
+    fwenv = firmware_env(BoardFile('tests/data/boardfiles/uno_gpio.yml'), 115200)
+    assert fwenv['features'] == ['group']
+    assert fwenv['supported_ops'] == 'zv,zb,zk,ze,zd,zt,AR,AW,DR,DW,MI,MO,MP,MR,GW,GR'
+    with open(utils.firmware, encoding='utf-8') as template:
+        source = render_firmware(template.read(), fwenv)
+    assert '#include <Wire.h>' not in source and 'DHT' not in source
+    assert 'void group(char t)' in source and 'void playback(' not in source
+
+
+def test_buildenv_libs():
+    buildenv = BuildEnv('/tmp', 'uno', '/dev/null')
+    assert buildenv.lib_deps(['group', 'free_memory']) == \
+        ['git+https://github.com/mpflaga/Arduino-MemoryFree.git']
+    assert len(buildenv.lib_deps(resolve_features(None))) == 6
+    output = 'RAM:   [==        ]  21.6% (used 443 bytes from 2048 bytes)\n' \
+             'Flash: [===       ]  28.1% (used 9054 bytes from 32256 bytes)\n'
+    assert BuildEnv.size_report(output) == {'ram': (443, 2048), 'flash': (9054, 32256)}
+
+
+def test_buildenv_platformio_ini(tmp_path):
+    buildenv = BuildEnv(str(tmp_path), 'uno', '/dev/null')
+    path = buildenv.write_platformio_ini(['group', 'free_memory'])
+    assert path == str(tmp_path / 'uno' / 'platformio.ini')
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.read(path)
+    assert parser.get('env', 'lib_deps').split() == \
+        ['${env.lib_deps_builtin}', 'git+https://github.com/mpflaga/Arduino-MemoryFree.git']
+    assert 'sysenv' not in (tmp_path / 'uno' / 'platformio.ini').read_text()
+    assert parser.get('env:uno', 'board') == 'uno'
+
+
+def test_host_features(tmp_path):
+    binary = HostBuild(str(tmp_path), 'uno').build(
+        boardfile='tests/data/boardfiles/uno_gpio.yml')
+    with HostDevice(binary) as device:
+        arduino = Arduino(board='uno', tty=device.tty, wait=True, serial_timeout=2,
+                          timings=True)
+        assert list(arduino.timings.as_dict()) == ['boardfile', 'serial_open', 'setup_pins']
+        assert not arduino.supports('PR') and not arduino.supports('IS')
+        assert list(arduino.timings.as_dict())[-1] == 'describe'
+        assert arduino.capabilities['i2c_block'] is None
+        with pytest.raises(UnsupportedOperationError):
+            arduino.get_pin(9).ramp(0, 255, 1)
+        assert arduino.send('<IS00000>') == '0%0%-1'
+        with pytest.raises(UnsupportedOperationError, match='Add capture to firmware: features:'):
+            arduino.capture([14], 10)
+        with pytest.raises(UnsupportedOperationError):
+            arduino.define_macro('blink', ['<DW13001>'])
+        group = arduino.group([2, 3])
+        group.set_mode('output')
+        group.write(3)
+        assert group.read() == 3
+        arduino.close_serial_connection()
+
+
+def test_host_describe(host_fixture):
+    assert host_fixture.firmware_version == utils.available_firmware_version('/nonexistent')
+    assert host_fixture.send('<zv00000>').startswith('7%version%')
+    assert host_fixture.capabilities['num_pins'] == 18
+    assert host_fixture.capabilities['analog_pins'] == frozenset(range(14, 20))
+    assert host_fixture.supports('GW')
+
+
+def test_host_digital(host_fixture):
+    pin = host_fixture.get_pin(13)
+    pin.set_mode('output')
+    assert pin.high() == '7%13%1'
+    assert pin.read() == '7%13%1'
+    pin.low()
+    assert pin.read() == '7%13%0'
+    group = host_fixture.group([2, 3, 4, 5])
+    group.set_mode('output')
+    group.write(0b1010)
+    assert group.read() == 0b1010
+    assert host_fixture.get_pin(3).read() == '7%3%1'
+
+
+def test_host_parser(host_fixture):
+    # frames split over several writes, noise between frames
+    connection = host_fixture.Connection
+    for chunk in (b'<DR1', b'3000>', b'xx\r\n<DR', b'13000>'):
+        connection.write(chunk)
+        time.sleep(0.01)
+    assert [host_fixture.reader.readline(1).strip() for _ in range(2)] == [b'7%13%0'] * 2
+    # a '<' restarts the frame
+    assert host_fixture.send('<DR1<MO13001>') == '7%13%1'
+    assert host_fixture.send('<DR1300>').startswith('Invalid command:')
+    assert host_fixture.send('<DR13000:' + '1' * 200 + '>').startswith('Invalid command:')
+    # pins, pwm and analog pins not on the board
+    assert host_fixture.send('<DW01001>') == '7%1%-1'
+    assert host_fixture.send('<MO40001>') == '7%40%-1'
+    assert host_fixture.send('<AR03000>') == '7%3%-1'
+    assert host_fixture.send('<AW04100>') == '7%4%100'
+
+
+def test_host_busses(host_fixture):
+    i2c = host_fixture.i2c(0)
+    assert i2c.scan() == [0x50]
+    data = bytes(range(40, 100))
+    assert i2c.write_block(0x50, 0x10, data) == len(data)
+    assert i2c.read_block(0x50, 0x10, len(data)) == data
+    assert host_fixture.spi(0).transfer(b'pyduin' * 10) == b'pyduin' * 10
+
+
+def test_host_ramp(host_fixture):
+    pin = host_fixture.get_pin(9)
+    pin.set_mode('pwm')
+    pin.low()
+    pin.ramp(0, 200, 0.05)
+    time.sleep(0.2)
+    # The stub core drives the pin high from a pwm value of 128
+    assert pin.read() == '7%9%1'
+
+
+def test_host_capture(host_fixture):
+    numpy = pytest.importorskip('numpy')
+    assert host_fixture.capabilities['capture_samples'] == 256
+    times, samples = host_fixture.capture(['14', 15], 100, rate=10000, timestamps=True)
+    assert samples.shape == (100, 2) and samples.dtype == numpy.uint16
+    # Unwritten analog pins of the host build read micros() % 1024
+    assert samples.max() < 1024
+    steps = numpy.diff(samples[:, 0].astype(int)) % 1024
+    assert 80 <= numpy.median(steps) <= 120
+    assert numpy.median(numpy.diff(times)) == pytest.approx(1e-4, abs=2e-5)
+    assert host_fixture.capture([14], 256).shape == (256, 1)
+    with pytest.raises(ValueError):
+        host_fixture.capture([14, 15], 129)
+    with pytest.raises(ValueError):
+        host_fixture.capture([9], 10)
+    host_fixture.wait = False
+    with pytest.raises(DeviceConfigError):
+        host_fixture.capture([14], 10)
+    host_fixture.wait = True
+    # The connection is still in sync
+    assert host_fixture.get_pin(13).read() in ('7%13%0', '7%13%1')
+
+
+def test_host_macros(host_fixture):
+    pins = [host_fixture.get_pin(pin) for pin in (2, 3, 4)]
+    ops = [pin.Mode.frame('output') for pin in pins] + \
+        [pin.frame('high') for pin in pins] + [pins[1].frame('low'), '<AR14000>']
+    host_fixture.define_macro('setup', ops)
+    host_fixture.define_macro('pulse', [b'<DW05001>', b'<DW05000>'])
+    replies = host_fixture.run_macro('setup')
+    assert replies[:7] == ['7%2%1', '7%3%1', '7%4%1', '7%2%1', '7%3%1', '7%4%1', '7%3%0']
+    assert replies[7].startswith('7%14%')
+    assert host_fixture.capabilities['macro_slots'] == 4
+    # defined again in its slot, the other macro is kept
+    host_fixture.define_macro('setup', ['<DR02000>'])
+    assert host_fixture.run_macro('setup') == ['7%2%1']
+    assert host_fixture.run_macro('pulse') == ['7%5%1', '7%5%0']
+    # restored after a reset of the device
+    host_fixture.send('<KD00000>')
+    host_fixture.restore_state()
+    assert host_fixture.run_macro('setup')[0].startswith('7%2%')
+    with pytest.raises(ValueError):
+        host_fixture.define_macro('long', ['<DR02000>'] * 10)
+    with pytest.raises(ValueError):
+        host_fixture.define_macro('nested', ['<KR00000>'])
+    with pytest.raises(ValueError):
+        host_fixture.define_macro('describe', ['<zd00000>'])
+    # One reply line per macro, so replies stay in sync
+    slot = host_fixture.macros['pulse'][0]
+    assert host_fixture.send(f'<KR{slot:02d}000>') == '7%macro%2%7%5%1;7%5%0'
+    assert host_fixture.send_batch([f'<KR{slot:02d}000>', '<DR05000>', '<DR13000>'])[1:] == \
+        ['7%5%0', host_fixture.send('<DR13000>')]
+    host_fixture.delete_macro('setup')
+    host_fixture.delete_macro('pulse')
+    with pytest.raises(ValueError):
+        host_fixture.delete_macro('pulse')
+    assert host_fixture.send('<KR00000>') == '7%macro%-1%'
+
+
+def test_host_clock(host_fixture):
+    assert host_fixture.supports('zt')
+    clock = host_fixture.sync_clock(exchanges=5, interval=0.01)
+    # The host build runs on the same clock
+    assert abs(clock.drift) < 0.01
+    before = time.monotonic()
+    reply, at = host_fixture.get_pin(14).read(timestamp=True)
+    assert reply.startswith('7%14%')
+    assert before - 0.005 <= at <= time.monotonic() + 0.005
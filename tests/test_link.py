@@ -0,0 +1,71 @@
+# pylint: disable=W0621,C0116,C0114
+# -*- coding: utf-8 -*-
+import pytest
+import pyduin
+from pyduin import arduino
+
+
+@pytest.fixture(scope="function")
+def fast_probation(monkeypatch, simulator_fixture):
+    monkeypatch.setattr(arduino, "BAUDRATE_PROBATION", 0.2)
+    simulator_fixture.Connection.probation = 0.2
+    yield simulator_fixture
+
+
+def test_link_test(simulator_fixture):
+    result = simulator_fixture.link_test(frames=20)
+    assert result['baudrate'] == 115200
+    assert result['errors'] == 0
+    assert result['error_rate'] == 0
+    assert result['throughput'] > 0
+
+def test_set_baudrate(simulator_fixture):
+    assert simulator_fixture.set_baudrate(500000)
+    assert simulator_fixture.baudrate == 500000
+    assert simulator_fixture.Connection.device_baudrate == 500000
+    assert simulator_fixture.Connection.written[-2] == b'<zb00007>'
+
+def test_set_unsupported_baudrate(simulator_fixture):
+    with pytest.raises(pyduin.utils.DeviceConfigError):
+        simulator_fixture.set_baudrate(1234)
+
+def test_negotiate_baudrate(fast_probation):
+    fast_probation.Connection.broken_baudrates = (1000000, 2000000)
+    assert fast_probation.negotiate_baudrate(frames=10) == 500000
+    assert fast_probation.baudrate == 500000
+    assert fast_probation.link_test(frames=10)['errors'] == 0
+
+def test_negotiation_survives_invalid_utf8(fast_probation):
+    # Garbled replies at a broken rate are not valid UTF-8
+    fast_probation.Connection.broken_baudrates = (1000000, 2000000)
+    assert fast_probation.negotiate_baudrate(rates=(500000, 1000000), frames=5) == 500000
+    assert fast_probation.baudrate == 500000
+    assert fast_probation.link_test(frames=10)['errors'] == 0
+
+def test_benchmark_link(fast_probation):
+    fast_probation.Connection.broken_baudrates = (250000, 2000000)
+    results = fast_probation.benchmark_link(rates=(115200, 250000, 500000, 2000000), frames=10)
+    assert [r['baudrate'] for r in results] == [115200, 250000, 500000, 2000000]
+    assert [r['error_rate'] for r in results] == [0, 1, 0, 1]
+    assert fast_probation.baudrate == 115200
+    assert fast_probation.link_test(frames=10)['errors'] == 0
+
+def test_negotiation_requires_wait(device_fixture):
+    device_fixture.wait = False
+    with pytest.raises(pyduin.utils.DeviceConfigError):
+        device_fixture.negotiate_baudrate()
+
+def test_resume_baudrate_without_reset(simulator_fixture):
+    # The device kept the negotiated baudrate (no hang up on close)
+    simulator_fixture.Connection.device_baudrate = 500000
+    assert simulator_fixture.resume_baudrate(500000)
+    assert simulator_fixture.baudrate == 500000
+    assert b'<zb00007>' not in simulator_fixture.Connection.written
+    assert simulator_fixture.link_test(frames=10)['errors'] == 0
+
+def test_resume_baudrate_after_reset(simulator_fixture):
+    assert simulator_fixture.resume_baudrate(500000)
+    assert simulator_fixture.baudrate == 500000
+    assert simulator_fixture.Connection.device_baudrate == 500000
+    assert b'<zb00007>' in simulator_fixture.Connection.written
+    assert simulator_fixture.link_test(frames=10)['errors'] == 0
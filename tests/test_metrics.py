@@ -0,0 +1,89 @@
+# pylint: disable=W0621,C0116,C0114
+# -*- coding: utf-8 -*-
+import time
+from pyduin import metrics
+
+
+def test_histogram():
+    histogram = metrics.Histogram(buckets=(0.001, 0.01))
+    for value in (0.0005, 0.001, 0.005, 0.5):
+        histogram.observe(value)
+    assert histogram.cumulative() == [(0.001, 2), (0.01, 3), (float('inf'), 4)]
+    assert histogram.count == 4
+
+def test_stats_disabled(simulator_fixture):
+    simulator_fixture.get_pin(13).high()
+    assert simulator_fixture.stats() == {}
+
+def test_stats(metrics_fixture):
+    metrics_fixture.metrics.reset()
+    pin = metrics_fixture.get_pin(13)
+    pin.high()
+    pin.low()
+    pin.read()
+    stats = metrics_fixture.stats()
+    assert stats['commands']['DW']['count'] == 2
+    assert stats['commands']['DR']['count'] == 1
+    assert stats['bytes_out'] == 27
+    assert stats['bytes_in'] == len(b'0%13%1\r\n0%13%0\r\n0%13%0\r\n')
+    assert stats['timeouts'] == 0
+
+def test_invalid_replies(metrics_fixture):
+    assert metrics_fixture.send('<XX>') == 'Invalid command:XX'
+    assert metrics_fixture.stats()['invalid_replies'] == 1
+    assert metrics_fixture.stats()['timeouts'] == 0
+
+def test_timeouts(metrics_fixture, monkeypatch):
+    monkeypatch.setattr(metrics_fixture.Connection, 'write', lambda message: None)
+    assert metrics_fixture.get_pin(2).read() == ''
+    assert metrics_fixture.stats()['timeouts'] == 1
+
+def test_reconnects(metrics_fixture):
+    metrics_fixture.open_serial_connection()
+    assert metrics_fixture.stats()['reconnects'] == 1
+
+def test_prometheus(metrics_fixture):
+    metrics_fixture.metrics.reset()
+    metrics_fixture.get_pin(13).high()
+    text = metrics.prometheus(metrics_fixture)
+    assert '# TYPE pyduin_command_latency_seconds histogram' in text
+    assert 'pyduin_command_latency_seconds_count{board="uno",tty="/mock/tty",command="DW"} 1' \
+        in text
+    assert 'le="+Inf"} 1' in text
+    assert 'pyduin_sent_bytes_total{board="uno",tty="/mock/tty"} 9' in text
+
+def test_flow_window(metrics_fixture):
+    assert metrics_fixture.flow_window == 64
+    metrics_fixture.metrics.reset()
+    metrics_fixture.Connection.max_in_flight = 0
+    messages = [metrics_fixture.get_pin(pin).frame('read') for pin in range(2, 14)]
+    replies = metrics_fixture.send_batch(messages)
+    assert replies == [f'0%{pin}%0' for pin in range(2, 14)]
+    assert metrics_fixture.Connection.max_in_flight <= 64
+    assert len(metrics_fixture.Connection.written) > 1
+    assert metrics_fixture.stats()['flow_stalls'] > 0
+    assert metrics_fixture.stats()['flow_drops'] == 0
+
+def test_flow_window_oversized_frame(metrics_fixture):
+    metrics_fixture._flow_window = 5  # pylint: disable=protected-access
+    assert metrics_fixture.send_batch(['<DR02000>', '<DR03000>']) == ['0%2%0', '0%3%0']
+    assert metrics_fixture.Connection.written[-2:] == [b'<DR02000>', b'<DR03000>']
+
+def test_batch_latency_per_frame(metrics_fixture, monkeypatch):
+    metrics_fixture.metrics.reset()
+    metrics_fixture._flow_window = 5  # pylint: disable=protected-access
+    readline = metrics_fixture.Connection.readline
+    def slow_readline():
+        time.sleep(0.01)
+        return readline()
+    monkeypatch.setattr(metrics_fixture.Connection, 'readline', slow_readline)
+    metrics_fixture.send_batch([f'<DR{pin:02d}000>' for pin in range(2, 14)])
+    latency = metrics_fixture.stats()['commands']['DR']
+    assert latency['count'] == 12
+    # Each frame is measured from its own write, not from the batch start
+    assert latency['sum'] < 12 * 0.03
+
+def test_flow_drops(metrics_fixture):
+    metrics_fixture.metrics.reset()
+    metrics_fixture.send_batch(['<DR02000>', '<XX>'])
+    assert metrics_fixture.stats()['flow_drops'] == 1
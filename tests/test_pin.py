@@ -1,6 +1,7 @@
 # pylint: disable=W0621,C0116,C0114
 # -*- coding: utf-8 -*-
-
+import pytest
+from pyduin.utils import PinNotFoundError, UnsupportedOperationError
 
 # pin modes
 # 0 = input
@@ -53,11 +54,16 @@ def test_set_pin_mode_invalid_pin_mode(device_fixture):
 #     assert pin.message == '<DW06001>'
 
 def test_pin_analog_write(device_fixture):
+    pin = device_fixture.get_pin(3)
+    device_fixture.Connection.response = '0%3%222'
+    assert pin.pwm(222) == '0%3%222'
+    assert pin.message == '<AW03222>'
+
+def test_pin_pwm_not_capable(device_fixture):
     pin = device_fixture.get_pin('A3')
     assert pin.pin_type == 'analog'
-    device_fixture.Connection.response = '0%17%222'
-    assert pin.pwm(222) == '0%17%222'
-    assert pin.message == '<AW17222>'
+    with pytest.raises(UnsupportedOperationError):
+        pin.pwm(222)
 
 def test_digital_read(device_fixture):
     pin = device_fixture.Pins[2]
@@ -84,3 +90,68 @@ def test_pin_low(device_fixture):
     pin.low()
     assert pin.low() == '0%7%0'
     assert pin.message == '<DW07000>'
+
+def test_pin_ramp(simulator_fixture):
+    pin = simulator_fixture.get_pin(5)
+    assert pin.ramp(0, 255, 1.5, curve='ease_in', loop=True) == '0%5%0'
+    assert pin.message == '<PR05000:0,255,1500,1,1>'
+    assert simulator_fixture.Connection.waveforms[5] == ('R', [0, 255, 1500, 1, 1])
+
+def test_pin_ramp_invalid(simulator_fixture):
+    pin = simulator_fixture.get_pin(5)
+    with pytest.raises(ValueError):
+        pin.ramp(0, 256, 1)
+    with pytest.raises(ValueError):
+        pin.ramp(0, 255, 1, curve='cubic')
+
+def test_pin_play(simulator_fixture):
+    pin = simulator_fixture.get_pin(6)
+    assert pin.play([0, 64, 128, 255], 0.02) == '0%6%4'
+    assert pin.message == '<PT06000:20,0,0,64,128,255>'
+    assert pin.stop() == '0%6%0'
+    assert 6 not in simulator_fixture.Connection.waveforms
+
+def test_pin_play_invalid(simulator_fixture):
+    pin = simulator_fixture.get_pin(6)
+    with pytest.raises(ValueError):
+        pin.play([], 0.02)
+    with pytest.raises(ValueError):
+        pin.play([0] * 33, 0.02)
+    with pytest.raises(UnsupportedOperationError):
+        simulator_fixture.get_pin(7).play([1, 2], 0.02)
+    simulator_fixture.get_pin(7).pwm_capable = True
+    assert simulator_fixture.get_pin(7).play([1, 2], 0.02) == '0%7%-1'
+
+def test_unsupported_op(simulator_fixture):
+    simulator_fixture.capabilities.ops = frozenset(['DW'])
+    with pytest.raises(UnsupportedOperationError):
+        simulator_fixture.get_pin(5).ramp(0, 255, 1)
+
+def test_pin_group_write(simulator_fixture):
+    group = simulator_fixture.group([2, 3, 4, 5, 6, 7, 8, 9])
+    assert group.write(0b1011_0010) == '0%0%178'
+    assert simulator_fixture.Connection.written[-1] == b'<GW00000:178,2,3,4,5,6,7,8,9>'
+    assert simulator_fixture.get_pin(3).read() == '0%3%1'
+    assert simulator_fixture.get_pin(2).read() == '0%2%0'
+    assert group.read() == 178
+
+def test_pin_group_alias(simulator_fixture):
+    group = simulator_fixture.group(['A0', 13])
+    assert [pin.pin_id for pin in group.pins] == [14, 13]
+    group.set_mode('output')
+    # the same frames as set by the pins themselves
+    assert simulator_fixture.Connection.written[-1] == b'<MO14030><MO13001>'
+    assert [pin.Mode.message for pin in group.pins] == ['<MO14030>', '<MO13001>']
+    group.set_mode('pwm')
+    assert [pin.pin_mode for pin in group.pins] == ['output', 'output']
+    assert simulator_fixture.Connection.written[-1] == b'<MO14030><MO13001>'
+
+def test_pin_group_invalid(simulator_fixture):
+    with pytest.raises(PinNotFoundError):
+        simulator_fixture.group([2, 99])
+    with pytest.raises(ValueError):
+        simulator_fixture.group([2, 2])
+    with pytest.raises(ValueError):
+        simulator_fixture.group([2, 3]).write(4)
+    with pytest.raises(ValueError):
+        simulator_fixture.group([2, 3]).set_mode('blink')
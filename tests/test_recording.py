@@ -0,0 +1,74 @@
+# pylint: disable=W0621,C0116,C0114
+# -*- coding: utf-8 -*-
+import time
+import pytest
+from pyduin import recording
+from pyduin.utils import ReplayError
+
+
+@pytest.fixture(scope="function")
+def recorded_session(simulator_fixture, tmp_path):
+    path = str(tmp_path / 'session.rec')
+    simulator_fixture.record(path)
+    pin = simulator_fixture.get_pin(13)
+    replies = [pin.high(), pin.read(), pin.low(), pin.read(), simulator_fixture.free_memory]
+    simulator_fixture.stop_recording()
+    yield path, replies
+
+
+def test_record(recorded_session):
+    path, _ = recorded_session
+    res = recording.summary(path)
+    assert res['frames_sent'] == 5
+    assert res['frames_received'] == 5
+    assert res['bytes_sent'] == 45
+
+@pytest.mark.usefixtures('recorded_session')
+def test_stop_recording(simulator_fixture):
+    assert not isinstance(simulator_fixture.Connection, recording.RecordingConnection)
+
+def test_replay(simulator_fixture, recorded_session):
+    path, replies = recorded_session
+    simulator_fixture.replay(path, strict=True)
+    pin = simulator_fixture.get_pin(13)
+    assert [pin.high(), pin.read(), pin.low(), pin.read()] == replies[:4]
+    assert simulator_fixture.free_memory == replies[4]
+
+def test_replay_strict_mismatch(simulator_fixture, recorded_session):
+    path, _ = recorded_session
+    simulator_fixture.replay(path, strict=True)
+    with pytest.raises(ReplayError):
+        simulator_fixture.get_pin(12).high()
+
+def test_replay_realtime(simulator_fixture, tmp_path):
+    path = str(tmp_path / 'slow.rec')
+    connection = simulator_fixture.record(path)
+    original = connection.connection.readline
+    def slow_readline():
+        time.sleep(0.05)
+        return original()
+    connection.connection.readline = slow_readline
+    simulator_fixture.get_pin(13).high()
+    simulator_fixture.stop_recording()
+    simulator_fixture.replay(path, realtime=True)
+    start = time.monotonic()
+    assert simulator_fixture.get_pin(13).high() == '0%13%1'
+    assert time.monotonic() - start >= 0.04
+
+def test_replay_invalid_file(tmp_path):
+    path = tmp_path / 'invalid.rec'
+    path.write_bytes(b'x' * 32)
+    with pytest.raises(ReplayError):
+        recording.ReplayConnection(str(path))
+    path.write_bytes(b'')
+    with pytest.raises(ReplayError):
+        recording.ReplayConnection(str(path))
+
+def test_record_replaces_session(simulator_fixture, recorded_session):
+    path, _ = recorded_session
+    simulator_fixture.record(path)
+    simulator_fixture.get_pin(12).low()
+    simulator_fixture.stop_recording()
+    assert recording.summary(path)['frames_sent'] == 1
+    simulator_fixture.replay(path, strict=True)
+    assert simulator_fixture.get_pin(12).low() == '0%12%0'
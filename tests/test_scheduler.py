@@ -0,0 +1,77 @@
+# pylint: disable=W0621,C0116,C0114
+# -*- coding: utf-8 -*-
+import time
+import pytest
+from pyduin import scheduler
+
+
+def test_invalid_overrun_policy(simulator_fixture):
+    with pytest.raises(ValueError):
+        scheduler.Scheduler(simulator_fixture, overrun='ignore')
+
+def test_once(simulator_fixture):
+    sched = scheduler.Scheduler(simulator_fixture)
+    replies = []
+    sched.once(0.01, 13, 'high', callback=replies.append)
+    sched.run()
+    assert replies == ['0%13%1']
+    assert not sched.jobs
+    assert sched.jitter()['13:high']['runs'] == 1
+
+def test_lateness_excludes_round_trip(simulator_fixture, monkeypatch):
+    send_batch = simulator_fixture.send_batch
+    def slow_send_batch(messages, timeout=None):
+        time.sleep(0.05)
+        return send_batch(messages, timeout)
+    monkeypatch.setattr(simulator_fixture, 'send_batch', slow_send_batch)
+    sched = scheduler.Scheduler(simulator_fixture)
+    sched.once(0, 13, 'high')
+    sched.run()
+    assert sched.jitter()['13:high']['max'] < 0.02
+
+def test_every_does_not_drift(simulator_fixture):
+    sched = scheduler.Scheduler(simulator_fixture)
+    replies = []
+    job = sched.every(0.01, 'A0', 'read', callback=replies.append)
+    # Anchor the first run to the start of run(), not to every()
+    first_due = job.due = time.monotonic()
+    sched.run(duration=0.105)
+    assert 10 <= len(replies) <= 11
+    assert job.due == pytest.approx(first_due + job.runs * 0.01)
+    stats = sched.jitter()['A0:read']
+    assert stats['runs'] == job.runs
+    assert stats['max'] < 0.01
+
+def test_coalesce_due_jobs(simulator_fixture):
+    sched = scheduler.Scheduler(simulator_fixture)
+    sched.once(0, 13, 'high')
+    sched.once(0, 5, 'pwm', 100)
+    sched.once(0, 'A1', 'read')
+    sched.run_pending()
+    assert simulator_fixture.Connection.written[-1] == b'<DW13001><AW05100><AR15000>'
+
+def test_overrun_skip(simulator_fixture):
+    sched = scheduler.Scheduler(simulator_fixture, overrun='skip')
+    job = sched.every(0.01, 13, 'high')
+    job.due -= 0.055
+    sched.run_pending()
+    assert job.overruns == 5
+    assert job.due > time.monotonic()
+
+def test_overrun_catch_up(simulator_fixture):
+    sched = scheduler.Scheduler(simulator_fixture, overrun='catch_up')
+    job = sched.every(0.01, 13, 'high')
+    job.due -= 0.055
+    while sched.run_pending() == 0:
+        pass
+    assert job.runs == 6
+    assert job.overruns == 0
+
+def test_start_stop(simulator_fixture):
+    sched = scheduler.Scheduler(simulator_fixture)
+    sched.start()
+    replies = []
+    sched.every(0.005, 13, 'read', callback=replies.append)
+    time.sleep(0.05)
+    sched.stop()
+    assert replies
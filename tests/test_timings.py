@@ -0,0 +1,49 @@
+# pylint: disable=W0621,C0116,C0114
+# -*- coding: utf-8 -*-
+import pytest
+from pyduin.timings import Timings, phase
+
+
+class Clock:  # pylint: disable=too-few-public-methods
+    """ A clock advanced by hand """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_timings():
+    clock = Clock()
+    timings = Timings(clock)
+    with timings.phase('config'):
+        clock.now += 0.01
+    with timings.phase('connect'):
+        clock.now += 0.001
+        with timings.phase('serial_open'):
+            clock.now += 0.002
+        with timings.phase('describe'):
+            clock.now += 0.5
+    with phase(timings, 'command'):
+        clock.now += 0.003
+    with phase(None, 'ignored'):
+        clock.now += 1
+    assert timings.as_dict() == pytest.approx({'config': 0.01, 'connect': 0.503,
+                                               'connect/serial_open': 0.002,
+                                               'connect/describe': 0.5, 'command': 0.003})
+    assert timings.collapsed(root='cli').splitlines() == [
+        'cli;config 10000', 'cli;connect 1000', 'cli;connect;serial_open 2000',
+        'cli;connect;describe 500000', 'cli;command 3000']
+    lines = timings.breakdown().splitlines()
+    assert lines[2].split() == ['serial_open', '2.0', 'ms', '0.1%']
+    assert lines[-1].split() == ['total', '1516.0', 'ms']
+
+
+def test_timings_repeated():
+    clock = Clock()
+    timings = Timings(clock)
+    for _ in range(3):
+        with timings.phase('reconnect'):
+            clock.now += 0.25
+    assert timings.as_dict() == {'reconnect': 0.75}
@@ -0,0 +1,208 @@
+# pylint: disable=W0621,C0116,C0114
+# -*- coding: utf-8 -*-
+import os
+import threading
+import time
+import pytest
+import serial
+from pyduin import arduino
+from pyduin.transport import LineReader
+from pyduin.utils import DeviceConfigError, ReplyTimeoutError
+
+
+class FailingSerial:  # pylint: disable=R0903
+    """ A port that cannot be opened """
+    def __init__(self, *args, **kwargs):
+        raise serial.SerialException('No such device')
+
+
+@pytest.fixture(scope="function")
+def pty_fixture():
+    master, slave = os.openpty()
+    port = serial.Serial(os.ttyname(slave), 115200, timeout=3)
+    yield master, port
+    port.close()
+    os.close(master)
+    os.close(slave)
+
+
+def test_line_reader(pty_fixture):
+    master, port = pty_fixture
+    reader = LineReader(port)
+    assert reader.fd is not None
+    os.write(master, b'0%13%1\r\n0%13%')
+    assert reader.readline() == b'0%13%1\r\n'
+    os.write(master, b'0\r\n')
+    assert reader.readline() == b'0%13%0\r\n'
+
+def test_line_reader_timeout(pty_fixture):
+    master, port = pty_fixture
+    reader = LineReader(port)
+    os.write(master, b'0%13')
+    start = time.monotonic()
+    assert reader.readline(0.05) == b'0%13'
+    assert time.monotonic() - start < 1
+    assert reader.readline(0) == b''
+
+def test_line_reader_read(pty_fixture):
+    master, port = pty_fixture
+    reader = LineReader(port)
+    os.write(master, b'1,2\r\n\n\x00\x01')
+    assert reader.readline() == b'1,2\r\n'
+    assert reader.read(2, 0.05) == b'\n\x00'
+    assert reader.read(3, 0.05) == b'\x01'
+
+def test_send_timeout(pty_fixture, simulator_fixture):
+    master, port = pty_fixture
+    simulator_fixture.use_connection(port)
+    pin = simulator_fixture.get_pin(13)
+    start = time.monotonic()
+    with pytest.raises(ReplyTimeoutError):
+        pin.read(timeout=0.05)
+    assert time.monotonic() - start < 1
+    assert os.read(master, 100) == b'<DR13000>'
+    # The late reply is discarded before the next command.
+    os.write(master, b'0%13%1\r\n')
+    time.sleep(0.05)
+    threading.Timer(0.1, os.write, (master, b'0%13%0\r\n')).start()
+    assert pin.read(timeout=1) == '0%13%0'
+
+def test_repeated_timeouts(pty_fixture, simulator_fixture):
+    master, port = pty_fixture
+    simulator_fixture.use_connection(port)
+    pin = simulator_fixture.get_pin(13)
+    # The device stopped answering, every call keeps to its own timeout
+    for _ in range(5):
+        start = time.monotonic()
+        with pytest.raises(ReplyTimeoutError):
+            pin.read(timeout=0.05)
+        assert time.monotonic() - start < 0.2
+    # Nothing is sent while the replies given up on may still arrive
+    assert os.read(master, 100) == b'<DR13000>'
+    # Once the line was quiet for DRAIN_QUIET, they are taken as lost
+    time.sleep(arduino.DRAIN_QUIET)
+    threading.Timer(0.1, os.write, (master, b'0%13%1\r\n')).start()
+    assert pin.read(timeout=1) == '0%13%1'
+
+def test_late_reply(pty_fixture, simulator_fixture):
+    master, port = pty_fixture
+    simulator_fixture.use_connection(port)
+    pin = simulator_fixture.get_pin(13)
+    with pytest.raises(ReplyTimeoutError):
+        simulator_fixture.send_batch([b'<DR13000>', b'<DR12000>'], timeout=0.05)
+    # Both replies arrive after the batch was given up on, the first
+    # one only after the next command was issued.
+    threading.Timer(0.1, os.write, (master, b'0%13%1\r\n')).start()
+    threading.Timer(0.2, os.write, (master, b'0%12%1\r\n')).start()
+    threading.Timer(0.4, os.write, (master, b'0%13%0\r\n')).start()
+    assert pin.read(timeout=1) == '0%13%0'
+    os.write(master, b'0%13%1\r\n')
+    assert pin.read(timeout=1) == '0%13%1'
+    assert os.read(master, 100) == b'<DR13000><DR12000><DR13000><DR13000>'
+
+def test_send_timeout_recorded(pty_fixture, simulator_fixture, tmp_path):
+    _master, port = pty_fixture
+    simulator_fixture.use_connection(port)
+    simulator_fixture.record(str(tmp_path / 'session.rec'))
+    start = time.monotonic()
+    with pytest.raises(ReplyTimeoutError):
+        simulator_fixture.get_pin(13).read(timeout=0.05)
+    assert time.monotonic() - start < 1
+    # the timeout is set on the recorded port and restored afterwards
+    assert port.timeout == 3
+    simulator_fixture.stop_recording()
+
+def test_send_timeout_fallback(simulator_fixture, monkeypatch):
+    monkeypatch.setattr(simulator_fixture.Connection, 'write', lambda message: None)
+    with pytest.raises(ReplyTimeoutError):
+        simulator_fixture.get_pin(13).high(timeout=0.01)
+    with pytest.raises(ReplyTimeoutError):
+        simulator_fixture.send_batch(['<DR02000>', '<DR03000>'], timeout=0.01)
+
+def test_restore_after_reset(simulator_fixture):
+    simulator_fixture.auto_reconnect = True
+    simulator_fixture.get_pin(13).set_mode('output')
+    simulator_fixture.get_pin(13).high()
+    simulator_fixture.get_pin(3).pwm(100)
+    simulator_fixture.Connection.reboot()
+    assert simulator_fixture.get_pin(2).read() == '0%2%0'
+    assert simulator_fixture.Connection.modes == {13: 'O'}
+    assert simulator_fixture.Connection.values == {13: 1, 3: 100}
+
+def test_resend_batch_after_reset(simulator_fixture):
+    simulator_fixture.Connection.reboot()
+    assert simulator_fixture.send_batch(['<DW13001>', '<DR13000>']) == ['0%13%1', '0%13%1']
+
+def test_reconnect(simulator_fixture, monkeypatch):
+    monkeypatch.setattr(arduino, 'BOOT_TIMEOUT', 0.01)
+    simulator_fixture.auto_reconnect = True
+    simulator_fixture.get_pin(13).set_mode('output')
+    simulator_fixture.get_pin(13).low()
+    def unplugged(message):
+        raise serial.SerialException('device disconnected')
+    monkeypatch.setattr(simulator_fixture.Connection, 'write', unplugged)
+    old = simulator_fixture.Connection
+    assert simulator_fixture.get_pin(13).high() == '0%13%1'
+    assert simulator_fixture.Connection is not old
+    assert simulator_fixture.Connection.written[:3] == \
+        [b'<zv00000>', b'<MO13001><DW13001>', b'<DW13001>']
+
+def test_reconnect_without_reset(simulator_fixture):
+    # The device answers right away, so there is no boot banner to wait for
+    simulator_fixture.get_pin(13).set_mode('output')
+    start = time.monotonic()
+    assert simulator_fixture.reconnect() == ['0%13%1']
+    assert time.monotonic() - start < arduino.BOOT_PROBE_TIMEOUT
+
+def test_reconnect_after_reset(simulator_fixture, monkeypatch):
+    simulator = type(simulator_fixture.Connection)
+
+    def reset_on_open(*args, **kwargs):
+        device = simulator(*args, **kwargs)
+        device.reboot()
+        return device
+
+    monkeypatch.setattr('serial.Serial', reset_on_open)
+    simulator_fixture.get_pin(13).set_mode('output')
+    start = time.monotonic()
+    assert simulator_fixture.reconnect() == ['0%13%1']
+    # the banner answered the probe, so it is not waited for again
+    assert time.monotonic() - start < arduino.BOOT_PROBE_TIMEOUT
+    assert simulator_fixture.Connection.written == [b'<zv00000>', b'<MO13001>']
+
+def test_reconnect_after_reset_at_boot_baudrate(simulator_fixture, monkeypatch):
+    simulator = type(simulator_fixture.Connection)
+
+    class Booted(simulator):
+        """ Reset and already booted: the banner went out at the boot baudrate """
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.device_baudrate = self.fallback_baudrate = 115200
+
+        def readline(self):
+            # A real port waits for its timeout, if nothing arrives
+            if not self.replies and self.timeout:
+                time.sleep(self.timeout)
+            return super().readline()
+
+    simulator_fixture.set_baudrate(500000)
+    monkeypatch.setattr('serial.Serial', Booted)
+    simulator_fixture.get_pin(13).set_mode('output')
+    start = time.monotonic()
+    assert simulator_fixture.reconnect() == ['0%13%1']
+    assert time.monotonic() - start < arduino.BOOT_TIMEOUT / 2
+    assert simulator_fixture.baudrate == 500000
+    assert simulator_fixture.Connection.device_baudrate == 500000
+
+def test_reconnect_disabled(simulator_fixture, monkeypatch):
+    def unplugged(message):
+        raise serial.SerialException('device disconnected')
+    monkeypatch.setattr(simulator_fixture.Connection, 'write', unplugged)
+    with pytest.raises(serial.SerialException):
+        simulator_fixture.get_pin(13).high()
+
+def test_reconnect_fails(simulator_fixture, monkeypatch):
+    monkeypatch.setattr(arduino, 'RECONNECT_BACKOFF', 0.001)
+    monkeypatch.setattr('serial.Serial', FailingSerial)
+    with pytest.raises(DeviceConfigError):
+        simulator_fixture.reconnect()
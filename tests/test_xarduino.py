@@ -17,13 +17,48 @@ def test_mock_serial(device_fixture):
 def test_mock_reread_on_boot_complete(device_fixture):
     message = "Boot complete"
     device_fixture.Connection.response = 'Boot complete'
+    called = device_fixture.Connection.called
     ret = device_fixture.send(message)
     assert ret == message
-    assert device_fixture.Connection.called == 2
+    assert device_fixture.Connection.called == called + 2
 
 #def test_wait_false(device_fixture_nowait):
 #    assert hasattr(device_fixture_nowait, 'Connection')
 
+def test_describe(simulator_fixture):
+    capabilities = simulator_fixture.capabilities
+    assert capabilities.version == '0.8.0'
+    assert capabilities.build_hash == '0123abcd'
+    assert capabilities.num_pins == 18
+    assert capabilities.pwm_pins == {3, 5, 6, 9, 10, 11}
+    assert capabilities.analog_pins == {14, 15, 16, 17, 18, 19}
+    assert capabilities.rx_buffer == 64
+    assert 'PR' in capabilities.ops
+    assert simulator_fixture.supports('DW')
+    assert not simulator_fixture.supports('QQ')
+
+def test_describe_on_first_use(simulator_fixture):
+    # Nothing is sent on connect
+    assert not simulator_fixture.Connection.written
+    assert simulator_fixture.supports('PR')
+    assert simulator_fixture.Connection.written == [b'<zd00000>']
+    # Only complete ops match
+    assert not simulator_fixture.supports('WX')
+
+def test_describe_cached(simulator_fixture):
+    simulator_fixture.describe()
+    written = len(simulator_fixture.Connection.written)
+    assert simulator_fixture.firmware_version == '0.8.0'
+    assert simulator_fixture.describe() is simulator_fixture.capabilities
+    assert len(simulator_fixture.Connection.written) == written
+
+def test_describe_unsupported(device_fixture):
+    assert device_fixture.capabilities is False
+    called = device_fixture.Connection.called
+    assert device_fixture.supports('PR')
+    # The negative result is cached
+    assert device_fixture.Connection.called == called
+
 def test_baudrate(device_fixture):
     assert device_fixture.baudrate == 115200
 